@@ -1,5 +1,7 @@
 from .main import AutoMod
 
 
-def setup(bot,):
-    bot.add_cog(AutoMod(bot))
+async def setup(bot,):
+    cog = AutoMod(bot)
+    await cog.initialize()
+    bot.add_cog(cog)
@@ -0,0 +1,313 @@
+import asyncio
+import datetime
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Set
+
+import discord
+
+from .cache import LRUCache
+from .metrics import Metrics
+from .ratelimit import SlidingWindowStore
+
+log = logging.getLogger("red.breadcogs.automod.actions")
+
+# route -> (requests, per seconds), kept under discord's limits so we rarely see a 429
+ROUTE_LIMITS = {
+    "delete": (5, 5.0),  # per channel
+    "bulk_delete": (1, 1.0),  # per channel
+    "kick": (5, 5.0),  # per guild
+    "ban": (5, 5.0),  # per guild
+    "add_role": (10, 10.0),  # per guild
+}
+# how long deletes wait for others in the same channel before being sent
+DELETE_WINDOW = 0.5
+BULK_DELETE_MAX = 100
+# discord refuses to bulk delete messages older than two weeks, leave some margin
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=13, hours=23)
+# a member already kicked or banned isn't punished again for this long
+PUNISHMENT_TTL = 60
+PUNISHMENT_CACHE_SIZE = 5000
+
+
+@dataclass
+class PendingDelete:
+    message: discord.Message
+    rule_name: str
+    future: asyncio.Future
+
+
+class DiscordBackend:
+    """Sends the actions to discord"""
+
+    async def delete_message(self, message: discord.Message) -> None:
+        await message.delete()
+
+    async def delete_messages(self, channel: discord.TextChannel, messages: list) -> None:
+        await channel.delete_messages(messages)
+
+    async def kick(self, member: discord.Member, reason: str) -> None:
+        await member.kick(reason=reason)
+
+    async def ban(self, guild: discord.Guild, member: discord.Member, reason: str) -> None:
+        await guild.ban(user=member, reason=reason, delete_message_days=1)
+
+    async def add_role(self, member: discord.Member, role: discord.Role, reason: str) -> None:
+        if any(role.id == r.id for r in member.roles):
+            return
+        await member.add_roles(role, reason=reason)
+
+
+@dataclass
+class DryRunBackend:
+    """Records what would have been done instead of doing it"""
+
+    calls: List[tuple] = field(default_factory=list)
+
+    async def delete_message(self, message: discord.Message) -> None:
+        self.calls.append(("delete", message.channel.id, message.id))
+        log.info(f"[Dry run] Would delete message {message.id}")
+
+    async def delete_messages(self, channel: discord.TextChannel, messages: list) -> None:
+        self.calls.append(("bulk_delete", channel.id, tuple(m.id for m in messages)))
+        log.info(f"[Dry run] Would bulk delete {len(messages)} messages in {channel.id}")
+
+    async def kick(self, member: discord.Member, reason: str) -> None:
+        self.calls.append(("kick", member.id))
+        log.info(f"[Dry run] Would kick {member.id}")
+
+    async def ban(self, guild: discord.Guild, member: discord.Member, reason: str) -> None:
+        self.calls.append(("ban", guild.id, member.id))
+        log.info(f"[Dry run] Would ban {member.id}")
+
+    async def add_role(self, member: discord.Member, role: discord.Role, reason: str) -> None:
+        self.calls.append(("add_role", member.id, role.id))
+        log.info(f"[Dry run] Would add role {role.id} to {member.id}")
+
+
+class ActionExecutor:
+    """
+    Runs moderation actions in the background, off the message listener.
+
+    Deletes in the same channel are collected for `delete_window` seconds and sent as
+    bulk deletes, kicks and bans of a member that's already being punished are dropped,
+    and every route is paced by its own bucket from `ROUTE_LIMITS`.
+
+    Parameters
+    ----------
+    metrics
+        Where action outcomes and latency are recorded
+    backend
+        What actually performs the actions, `DiscordBackend` unless testing or in dry run
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        backend=None,
+        delete_window: float = DELETE_WINDOW,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.metrics = metrics
+        self.backend = backend or DiscordBackend()
+        self.delete_window = delete_window
+        self.timer = timer
+        self._limits = {
+            route: SlidingWindowStore(rate, per) for route, (rate, per) in ROUTE_LIMITS.items()
+        }
+        # channel id -> message id -> pending delete
+        self._deletes: Dict[int, Dict[int, PendingDelete]] = {}
+        # (action, guild id, member id) -> future of the first request
+        self._punishments = LRUCache(PUNISHMENT_CACHE_SIZE, PUNISHMENT_TTL)
+        self._tasks: Set[asyncio.Future] = set()
+
+    @property
+    def is_dry_run(self) -> bool:
+        return isinstance(self.backend, DryRunBackend)
+
+    def spawn(self, coro: Awaitable) -> asyncio.Future:
+        """Run a coroutine in the background, `close` waits for it"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def close(self) -> None:
+        """Wait for everything still queued to be sent, called on cog unload"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _wait_for_route(self, route: str, key) -> None:
+        limit = self._limits[route]
+        while limit.hit(key, self.timer()):
+            await asyncio.sleep(limit.retry_after(key, self.timer()))
+
+    # deletes
+
+    def delete(self, message: discord.Message, rule_name: str) -> asyncio.Future:
+        """
+        Queue a message to be deleted
+        Returns
+        -------
+        asyncio.Future
+            Resolves to True once the message is gone, False if it couldn't be deleted
+        """
+        channel_id = message.channel.id
+        pending = self._deletes.get(channel_id)
+        if pending is None:
+            pending = self._deletes[channel_id] = OrderedDict()
+            self.spawn(self._flush_deletes(channel_id))
+
+        existing = pending.get(message.id)
+        if existing is not None:
+            return existing.future
+        future = asyncio.get_event_loop().create_future()
+        pending[message.id] = PendingDelete(message, rule_name, future)
+        return future
+
+    @staticmethod
+    def _can_bulk_delete(message: discord.Message, now: datetime.datetime) -> bool:
+        created_at = message.created_at
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+        return now - created_at < BULK_DELETE_MAX_AGE
+
+    async def _flush_deletes(self, channel_id: int) -> None:
+        await asyncio.sleep(self.delete_window)
+        pending = list(self._deletes.pop(channel_id, {}).values())
+        if not pending:
+            return
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        bulk, single = [], []
+        for pending_delete in pending:
+            if self._can_bulk_delete(pending_delete.message, now):
+                bulk.append(pending_delete)
+            else:
+                single.append(pending_delete)
+        while len(bulk) > 1:
+            batch, bulk = bulk[:BULK_DELETE_MAX], bulk[BULK_DELETE_MAX:]
+            if not await self._bulk_delete(channel_id, batch):
+                single += batch
+        single += bulk
+
+        for pending_delete in single:
+            await self._delete_one(pending_delete)
+
+    async def _bulk_delete(self, channel_id: int, batch: List[PendingDelete]) -> bool:
+        """Returns False if the batch should be retried one message at a time"""
+        channel = batch[0].message.channel
+        await self._wait_for_route("bulk_delete", channel_id)
+        start = self.timer()
+        try:
+            await self.backend.delete_messages(channel, [p.message for p in batch])
+        except discord.Forbidden:
+            log.warning(f"Missing permissions to bulk delete in {channel_id}, deleting one by one")
+            return False
+        except discord.HTTPException as e:
+            log.warning(f"Bulk delete failed in {channel_id}, deleting one by one: {e}")
+            return False
+        except Exception:
+            log.exception(f"Bulk delete failed in {channel_id}, deleting one by one")
+            return False
+
+        elapsed = self.timer() - start
+        for pending_delete in batch:
+            message = pending_delete.message
+            self.metrics.record_action(
+                message.guild.id, pending_delete.rule_name, "delete", elapsed, True
+            )
+            pending_delete.future.set_result(True)
+        return True
+
+    async def _delete_one(self, pending_delete: PendingDelete) -> None:
+        message = pending_delete.message
+        await self._wait_for_route("delete", message.channel.id)
+        deleted = False
+        try:
+            with self.metrics.measure_action(
+                message.guild.id, pending_delete.rule_name, "delete"
+            ) as outcome:
+                try:
+                    await self.backend.delete_message(message)
+                    deleted = True
+                except discord.NotFound:
+                    deleted = True
+                    log.warning(f"{pending_delete.rule_name} - Message was already deleted")
+                except discord.HTTPException as e:
+                    log.warning(f"{pending_delete.rule_name} - Failed to delete message: {e}")
+                    outcome.success = False
+                except Exception:
+                    log.exception(f"{pending_delete.rule_name} - Failed to delete message")
+                    outcome.success = False
+        finally:
+            # never leave an announcement waiting on this
+            pending_delete.future.set_result(deleted)
+
+    # punishments
+
+    def punish(
+        self,
+        action: str,
+        guild: discord.Guild,
+        member: discord.Member,
+        rule_name: str,
+        reason: str,
+        role: discord.Role = None,
+    ) -> asyncio.Future:
+        """
+        Queue a kick, ban or role for a member
+        Returns
+        -------
+        asyncio.Future
+            Resolves to whether the action succeeded, shared with earlier requests if the
+            member is already being punished
+        """
+        keys = [("ban", guild.id, member.id)]
+        if action == "kick":
+            # a member already being banned doesn't need kicking
+            keys.append(("kick", guild.id, member.id))
+        elif action == "add_role":
+            keys = [("add_role", guild.id, member.id, role.id)]
+
+        for key in keys:
+            existing = self._punishments.get(key)
+            if existing is not None:
+                return existing
+
+        future = self.spawn(self._punish(action, guild, member, rule_name, reason, role))
+        self._punishments.set(keys[-1], future)
+        return future
+
+    async def _punish(
+        self,
+        action: str,
+        guild: discord.Guild,
+        member: discord.Member,
+        rule_name: str,
+        reason: str,
+        role: discord.Role,
+    ) -> bool:
+        await self._wait_for_route(action, guild.id)
+        with self.metrics.measure_action(guild.id, rule_name, action) as outcome:
+            try:
+                if action == "kick":
+                    await self.backend.kick(member, reason)
+                elif action == "ban":
+                    await self.backend.ban(guild, member, reason)
+                elif action == "add_role":
+                    await self.backend.add_role(member, role, reason)
+                log.info(f"{rule_name} - {action} {member} ({member.id})")
+            except discord.Forbidden:
+                log.warning(f"{rule_name} - Failed to {action} user, missing permissions")
+                outcome.success = False
+            except discord.HTTPException as e:
+                log.warning(f"{rule_name} - Failed to {action} user: {e}")
+                outcome.success = False
+            except Exception:
+                # logged here so one broken action can't take the announcement down with it
+                log.exception(f"{rule_name} - Failed to {action} user")
+                outcome.success = False
+        return outcome.success
@@ -0,0 +1,78 @@
+from collections import deque
+from typing import Iterable, Optional
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher.
+
+    Built once from a list of patterns, `search` then walks the text a single time
+    no matter how many patterns there are.
+    """
+
+    __slots__ = ("_goto", "_fail", "_output", "patterns")
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = tuple(dict.fromkeys(p for p in patterns if p))
+        self._goto = [{}]
+        self._fail = [0]
+        # pattern ending at this node, or the longest one reachable through fail links
+        self._output = [None]
+
+        for pattern in self.patterns:
+            self._insert(pattern)
+        self._link()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def _insert(self, pattern: str) -> None:
+        node = 0
+        for char in pattern:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            node = nxt
+        if self._output[node] is None:
+            self._output[node] = pattern
+
+    def _link(self) -> None:
+        goto, fail, output = self._goto, self._fail, self._output
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                if output[child] is None:
+                    output[child] = output[fail[child]]
+
+    def search(self, text: str) -> Optional[str]:
+        """Return the first pattern found in text, None if nothing matches"""
+        if not self.patterns:
+            return None
+
+        goto, fail, output = self._goto, self._fail, self._output
+        root = goto[0]
+        state = 0
+        for char in text:
+            if state == 0:
+                # fast path, most characters never leave the root
+                state = root.get(char, 0)
+            else:
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
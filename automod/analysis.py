@@ -0,0 +1,149 @@
+import re
+from hashlib import blake2b
+from functools import cached_property
+from string import punctuation
+from typing import Tuple
+
+from .normalize import fold_text, normalize_text
+
+MENTION_RE = re.compile(r"<@!?(\d+)>")
+# the code stops at anything that can't be part of one, so `discord.gg/abc?x` is `abc`
+INVITE_RE = re.compile(r"(?:discord\.(?:gg|io|me|li)|discord(?:app)?\.com/invite)/([\w-]+)", re.I)
+URL_RE = re.compile(r"https?://\S+", re.I)
+NEWLINE_RUN_RE = re.compile(r"\n+")
+PUNCTUATION_TABLE = str.maketrans("", "", punctuation)
+
+
+def _word_start(text: str, index: int) -> int:
+    """Start of the word before `index`, so one whole word of context is kept"""
+    while index > 0 and text[index - 1].isspace():
+        index -= 1
+    while index > 0 and not text[index - 1].isspace():
+        index -= 1
+    return index
+
+
+def _word_end(text: str, index: int) -> int:
+    while index < len(text) and text[index].isspace():
+        index += 1
+    while index < len(text) and not text[index].isspace():
+        index += 1
+    return index
+
+
+def inserted_text(before: str, after: str) -> str:
+    """
+    The part of `after` that changed from `before`, with a word either side.
+
+    Only the common prefix and suffix are stripped, so several edits in one message come
+    back as one span. The extra words mean a filtered word or invite that the edit
+    completed is still found.
+    """
+    limit = min(len(before), len(after))
+    start = 0
+    while start < limit and before[start] == after[start]:
+        start += 1
+    end = 0
+    while end < limit - start and before[-1 - end] == after[-1 - end]:
+        end += 1
+    stop = len(after) - end
+    if stop <= start:
+        # only text was removed
+        return ""
+    return after[_word_start(after, start) : _word_end(after, stop)]
+
+
+class MessageAnalysis:
+    """
+    Facts about a message's content that more than one rule needs.
+
+    Built once per message by the listener and handed to every rule, each property is
+    only computed the first time a rule asks for it.
+
+    Parameters
+    ----------
+    content
+        The text to analyze, usually `message.content`
+    """
+
+    def __init__(self, content: str):
+        self.content = content or ""
+
+    @cached_property
+    def tokens(self) -> Tuple[str, ...]:
+        """Whitespace separated words"""
+        return tuple(self.content.split())
+
+    @cached_property
+    def word_count(self) -> int:
+        return len(self.tokens)
+
+    @cached_property
+    def char_count(self) -> int:
+        return len(self.content)
+
+    @cached_property
+    def content_hash(self) -> bytes:
+        """
+        Keys memoized verdicts, hashed as is since regex rules are case sensitive.
+
+        A strong digest, as a collision would hand one message another message's verdict.
+        """
+        return blake2b(self.content.encode(errors="surrogatepass"), digest_size=16).digest()
+
+    @cached_property
+    def mention_tokens(self) -> Tuple[str, ...]:
+        """Words that start with a user mention"""
+        if "<@" not in self.content:
+            return ()
+        return tuple(token for token in self.tokens if MENTION_RE.match(token))
+
+    @cached_property
+    def mention_ids(self) -> Tuple[int, ...]:
+        return tuple(int(MENTION_RE.match(token).group(1)) for token in self.mention_tokens)
+
+    @cached_property
+    def folded(self) -> str:
+        """The content with look-alike and invisible characters undone, see `fold_text`"""
+        return fold_text(self.content)
+
+    @cached_property
+    def invite_codes(self) -> Tuple[str, ...]:
+        """Codes of the discord invites anywhere in the message, without duplicates"""
+        # folded rather than normalized, codes are case sensitive
+        if "discord" not in self.folded.lower():
+            return ()
+        return tuple(dict.fromkeys(INVITE_RE.findall(self.folded)))
+
+    @cached_property
+    def urls(self) -> Tuple[str, ...]:
+        if "://" not in self.content:
+            return ()
+        return tuple(URL_RE.findall(self.content))
+
+    @cached_property
+    def longest_newline_run(self) -> int:
+        """Most consecutive newlines anywhere in the message"""
+        if "\n" not in self.content:
+            return 0
+        return max(len(run) for run in NEWLINE_RUN_RE.findall(self.content))
+
+    @cached_property
+    def without_mentions(self) -> str:
+        if "<@" not in self.content:
+            return self.content
+        return MENTION_RE.sub("", self.content)
+
+    @cached_property
+    def without_punctuation(self) -> str:
+        """`without_mentions` with all punctuation removed"""
+        return self.without_mentions.translate(PUNCTUATION_TABLE)
+
+    @cached_property
+    def normalized(self) -> str:
+        """`without_mentions` casefolded and folded with `normalize_text`, for text filters"""
+        return normalize_text(self.without_mentions)
+
+    @cached_property
+    def normalized_without_punctuation(self) -> str:
+        return self.normalized.translate(PUNCTUATION_TABLE)
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import discord
+from redbot.core.utils.chat_formatting import box
+from tabulate import tabulate
+
+from .metrics import Metrics
+from .ratelimit import SlidingWindowStore
+from .rules.config.models import InfractionInformation
+
+log = logging.getLogger("red.breadcogs.automod")
+
+# more announcements than this in a window are collected into one digest
+DIGEST_THRESHOLD = 3
+DIGEST_WINDOW = 10.0  # seconds
+DIGEST_TOP_OFFENDERS = 5
+DIGEST_JUMP_LINKS = 8
+EMBED_FIELD_LIMIT = 1024  # characters in an embed field value
+
+
+@dataclass
+class PendingAnnouncement:
+    """Everything needed to announce one infraction, the embed is only built if it's sent alone"""
+
+    rule: object
+    message: discord.Message
+    action_to_take: Optional[str]
+    message_has_been_deleted: bool
+    action_taken_success: bool
+    infraction_information: Optional[InfractionInformation] = None
+
+    async def to_embed(self) -> discord.Embed:
+        return await self.rule.get_announcement_embed(
+            self.message,
+            self.message_has_been_deleted,
+            self.action_taken_success,
+            self.action_to_take,
+            self.infraction_information,
+        )
+
+
+def digest_embed(announcements: List[PendingAnnouncement], window: float) -> discord.Embed:
+    """One embed summing up many infractions: counts per rule, top offenders and jump links"""
+    embed = discord.Embed(
+        title=f"AutoMod digest - {len(announcements)} offenses",
+        description=f"Too many offenses to announce one by one, collected over {window:g}s.",
+        color=discord.Color.gold(),
+    )
+
+    per_rule = Counter(a.rule.rule_name for a in announcements)
+    failed = Counter(a.rule.rule_name for a in announcements if not a.action_taken_success)
+    rows = [(name, count, failed[name]) for name, count in per_rule.most_common()]
+    embed.add_field(
+        name="Rules",
+        value=box(tabulate(rows, ["Rule", "Offenses", "Failed"], tablefmt="presto"), "ini"),
+        inline=False,
+    )
+
+    offenders = Counter(a.message.author for a in announcements)
+    embed.add_field(
+        name="Top offenders",
+        value="\n".join(
+            f"{author} ({author.id}) - `{count}`"
+            for author, count in offenders.most_common(DIGEST_TOP_OFFENDERS)
+        ),
+        inline=False,
+    )
+
+    kept = [a for a in announcements if not a.message_has_been_deleted]
+    links = []
+    # room left for the links, keeping enough for the "... and N more" line
+    room = EMBED_FIELD_LIMIT - len(f"\n... and {len(kept)} more")
+    for a in kept[:DIGEST_JUMP_LINKS]:
+        link = f"[🔗 {a.rule.rule_name} in #{a.message.channel}]({a.message.jump_url})"
+        room -= len(link) + 1
+        if room < 0:
+            break
+        links.append(link)
+    if len(kept) > len(links):
+        links.append(f"... and {len(kept) - len(links)} more")
+    if links:
+        embed.add_field(name="Messages not deleted", value="\n".join(links), inline=False)
+    return embed
+
+
+class AnnouncementBuffer:
+    """
+    Sends announcements per channel, collecting them into a digest when there are too many.
+
+    The first `threshold` announcements in a `window` are sent as they come, after that they
+    are held until the window ends and sent as a single `digest_embed`.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        threshold: int = DIGEST_THRESHOLD,
+        window: float = DIGEST_WINDOW,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.metrics = metrics
+        self.window = window
+        self.timer = timer
+        # everything below is keyed by (guild id, channel id)
+        self._recent = SlidingWindowStore(threshold, window)
+        # held announcements
+        self._pending: Dict[Tuple[int, int], List[PendingAnnouncement]] = {}
+        self._flushes: Dict[Tuple[int, int], asyncio.Task] = {}
+
+    async def announce(
+        self, guild: discord.Guild, channel_id: int, announcement: PendingAnnouncement
+    ) -> None:
+        key = (guild.id, channel_id)
+        if key not in self._pending and not self._recent.hit(key, self.timer()):
+            return await self._send(guild, channel_id, [announcement])
+
+        pending = self._pending.setdefault(key, [])
+        pending.append(announcement)
+        if key not in self._flushes:
+            self._flushes[key] = asyncio.ensure_future(self._flush_later(guild, channel_id))
+
+    async def _flush_later(self, guild: discord.Guild, channel_id: int) -> None:
+        await asyncio.sleep(self.window)
+        await self.flush(guild, channel_id)
+
+    async def flush(self, guild: discord.Guild, channel_id: int) -> None:
+        key = (guild.id, channel_id)
+        task = self._flushes.pop(key, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        announcements = self._pending.pop(key, [])
+        if announcements:
+            await self._send(guild, channel_id, announcements)
+
+    async def close(self) -> None:
+        """Send everything held, called on cog unload"""
+        for guild_id, channel_id in list(self._pending):
+            announcements = self._pending[(guild_id, channel_id)]
+            await self.flush(announcements[0].message.guild, channel_id)
+
+    async def _send(
+        self, guild: discord.Guild, channel_id: int, announcements: List[PendingAnnouncement]
+    ) -> None:
+        # resolved once for everything being sent
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            return  # not Announcing
+
+        if len(announcements) == 1:
+            embed = await announcements[0].to_embed()
+        else:
+            embed = digest_embed(announcements, self.window)
+
+        start = self.timer()
+        success = False
+        try:
+            await channel.send(embed=embed)
+            success = True
+        except discord.errors.Forbidden:
+            log.exception(f"Missing permissions to send messages")
+        except discord.errors.NotFound:
+            log.exception(f"Could not send announce embed as channel was deleted")
+        except discord.HTTPException:
+            log.exception(f"Could not send announce embed")
+
+        elapsed = self.timer() - start
+        for announcement in announcements:
+            self.metrics.record_action(
+                guild.id, announcement.rule.rule_name, "announce", elapsed, success
+            )
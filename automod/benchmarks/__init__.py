@@ -0,0 +1,7 @@
+"""
+Micro-benchmarks for the rules, run with `python -m automod.benchmarks`.
+
+Recorded traffic can be replayed with `python -m automod.benchmarks.replay`.
+
+Nothing in here is loaded by the cog itself.
+"""
@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from .runner import (
+    CORPORA,
+    DEFAULT_FILTER_SIZES,
+    DEFAULT_MESSAGES,
+    DEFAULT_ROUNDS,
+    DEFAULT_TOLERANCE,
+    compare,
+    run_benchmarks,
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m automod.benchmarks", description="Time AutoMod rules against fake traffic."
+    )
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES)
+    parser.add_argument(
+        "--filter-sizes", type=int, nargs="+", default=list(DEFAULT_FILTER_SIZES)
+    )
+    parser.add_argument("--corpus", choices=list(CORPORA), nargs="+", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", "-o", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="A previous results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(
+        run_benchmarks(
+            rounds=args.rounds,
+            messages=args.messages,
+            filter_sizes=tuple(args.filter_sizes),
+            corpora=args.corpus,
+            seed=args.seed,
+        )
+    )
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            results["regressions"] = compare(json.load(baseline_file), results, args.tolerance)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
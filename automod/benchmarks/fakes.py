@@ -0,0 +1,251 @@
+"""
+Lightweight stand-ins for the discord and Red objects the rules touch.
+
+Only the attributes AutoMod actually reads are implemented, anything else raising
+AttributeError is a sign a rule started depending on something new.
+"""
+import asyncio
+import copy
+import datetime
+from itertools import count
+from typing import Optional
+
+_ids = count(1000)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+def _merge(defaults: dict, data: dict) -> dict:
+    merged = copy.deepcopy(defaults)
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+class FakeValue:
+    """A single registered global, `await config.value()` and `await config.value.set(x)`"""
+
+    def __init__(self, store: dict, key: str):
+        self._store = store
+        self._key = key
+
+    def __call__(self):
+        return self._get()
+
+    async def _get(self):
+        return copy.deepcopy(self._store[self._key])
+
+    async def set(self, value):
+        self._store[self._key] = copy.deepcopy(value)
+
+
+class FakeGroup:
+    def __init__(self, config: "InMemoryConfig", guild_id: int):
+        self._config = config
+        self._guild_id = guild_id
+
+    @property
+    def _data(self) -> dict:
+        return self._config.guilds.setdefault(self._guild_id, {})
+
+    async def all(self) -> dict:
+        self._config.reads += 1
+        return _merge(self._config.guild_defaults, self._data)
+
+    def __getattr__(self, item):
+        # `await config.guild(guild).settings()`, only reads of registered values are supported
+        if item.startswith("_") or item not in self._config.guild_defaults:
+            raise AttributeError(item)
+        self._config.reads += 1
+        return FakeValue(_merge(self._config.guild_defaults, self._data), item)
+
+    async def get_raw(self, *keys):
+        self._config.reads += 1
+        value = _merge(self._config.guild_defaults, self._data)
+        for key in keys:
+            value = value[key]
+        return copy.deepcopy(value)
+
+    async def set(self, value: dict):
+        self._config.writes += 1
+        self._config.guilds[self._guild_id] = copy.deepcopy(value)
+
+    async def set_raw(self, *keys, value):
+        self._config.writes += 1
+        data = self._data
+        for key in keys[:-1]:
+            data = data.setdefault(key, {})
+        data[keys[-1]] = copy.deepcopy(value)
+
+    async def clear_raw(self, *keys):
+        self._config.writes += 1
+        data = self._data
+        for key in keys[:-1]:
+            data = data.get(key, {})
+        data.pop(keys[-1], None)
+
+
+class InMemoryConfig:
+    """Enough of `redbot.core.Config` for AutoMod, keeps everything in dicts"""
+
+    def __init__(self):
+        self.guild_defaults = {}
+        self.global_values = {}
+        self.guilds = {}  # guild id -> raw data
+        self.reads = 0
+        self.writes = 0
+
+    def register_guild(self, **defaults):
+        self.guild_defaults.update(copy.deepcopy(defaults))
+
+    def register_global(self, **defaults):
+        for key, value in defaults.items():
+            self.global_values.setdefault(key, copy.deepcopy(value))
+
+    def guild(self, guild) -> FakeGroup:
+        return FakeGroup(self, guild.id)
+
+    def __getattr__(self, item):
+        if item in self.__dict__.get("global_values", {}):
+            return FakeValue(self.global_values, item)
+        raise AttributeError(item)
+
+
+class FakeRole:
+    def __init__(self, role_id: int = None, name: str = "role"):
+        self.id = role_id or next_id()
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int = None, name: str = "general", category_id: int = None):
+        self.id = channel_id or next_id()
+        self.name = name
+        self.category_id = category_id
+        self.mention = f"<#{self.id}>"
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember:
+    def __init__(self, member_id: int = None, name: str = "member", roles=(), bot: bool = False):
+        self.id = member_id or next_id()
+        self.name = name
+        self.display_name = name
+        self.roles = list(roles)
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+        self.avatar_url = ""
+        self.kicked = False
+        self.created_at = datetime.datetime(2020, 1, 1)
+        self.joined_at = datetime.datetime(2020, 1, 1)
+
+    async def kick(self, reason: str = None):
+        self.kicked = True
+
+    async def add_roles(self, *roles, reason: str = None):
+        self.roles.extend(roles)
+
+    def __str__(self):
+        return f"{self.name}#0001"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int = None, name: str = "guild", channels=(), roles=()):
+        self.id = guild_id or next_id()
+        self.name = name
+        self.channels = {channel.id: channel for channel in channels}
+        self.roles = {role.id: role for role in roles}
+        self.members = {}
+        self.banned = []
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self.roles.get(role_id)
+
+    def get_member(self, member_id: int) -> Optional[FakeMember]:
+        return self.members.get(member_id)
+
+    async def ban(self, user, reason: str = None, delete_message_days: int = 0):
+        self.banned.append(user.id)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeAttachment:
+    def __init__(self, filename: str, data: bytes = b""):
+        self.id = next_id()
+        self.filename = filename
+        self.size = len(data)
+        self.url = f"https://cdn.example.com/{self.id}/{filename}"
+        self._data = data
+
+    async def read(self) -> bytes:
+        return self._data
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        content: str,
+        author: FakeMember,
+        channel: FakeChannel,
+        guild: FakeGuild,
+        mentions=(),
+        attachments=(),
+        created_at: datetime.datetime = None,
+    ):
+        self.id = next_id()
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.mentions = list(mentions)
+        self.attachments = list(attachments)
+        self.created_at = created_at or datetime.datetime.utcnow()
+        self.jump_url = f"https://discord.com/channels/{guild.id}/{channel.id}/{self.id}"
+        self.deleted = False
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeInvite:
+    def __init__(self, code: str, guild: Optional[FakeGuild]):
+        self.code = code
+        self.guild = guild
+
+
+class FakeBot:
+    def __init__(self):
+        self.dispatched = []
+        self.invites = {}  # code -> guild the invite points to
+        self.fetched_invites = 0
+
+    async def fetch_invite(self, code: str, with_counts: bool = True) -> FakeInvite:
+        self.fetched_invites += 1
+        # yields once like a real request would
+        await asyncio.sleep(0)
+        return FakeInvite(code, self.invites.get(code))
+
+    async def is_automod_immune(self, to_check) -> bool:
+        return False
+
+    def dispatch(self, event_name: str, *args):
+        self.dispatched.append(event_name)
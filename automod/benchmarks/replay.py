@@ -0,0 +1,244 @@
+"""
+Replay recorded messages through the rules offline, run with `python -m automod.benchmarks.replay`.
+
+The log is JSON lines, one message per line:
+
+    {"content": "hi", "author_id": 1, "role_ids": [2], "channel_id": 3,
+     "created_at": "2020-01-01T12:00:00", "attachments": [{"filename": "a.png"}]}
+
+Only `content` is required. Everything goes through `AutoMod._listen_for_infractions` with
+the settings from a profile, the raw guild config as stored under the guild, so thresholds
+like `max_words` can be tuned against real traffic. Actions are never sent, nothing leaves
+the machine - invites resolve to no server and images aren't sent to Azure.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from ..actions import DryRunBackend
+from ..main import AutoMod, __version__
+from ..metrics import LatencyHistogram
+from .fakes import (
+    FakeAttachment,
+    FakeBot,
+    FakeChannel,
+    FakeGuild,
+    FakeMember,
+    FakeMessage,
+    FakeRole,
+    InMemoryConfig,
+)
+from .runner import fake_analyze_image
+
+
+class ReplayGuild(FakeGuild):
+    """Creates the channels, members and roles a log refers to as they show up"""
+
+    def channel(self, channel_id: Optional[int], category_id: Optional[int] = None):
+        channel_id = channel_id or 0
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(
+                channel_id, name=f"channel-{channel_id}", category_id=category_id
+            )
+        return self.channels[channel_id]
+
+    def role(self, role_id: int) -> FakeRole:
+        if role_id not in self.roles:
+            self.roles[role_id] = FakeRole(role_id, name=f"role-{role_id}")
+        return self.roles[role_id]
+
+    def member(self, member_id: Optional[int], role_ids: Iterable[int] = (), bot: bool = False):
+        member_id = member_id or 0
+        member = self.members.get(member_id)
+        if member is None:
+            member = self.members[member_id] = FakeMember(member_id, name=f"member-{member_id}")
+            member.guild = self
+        # roles as they were when the message was sent
+        member.roles = [self.role(role_id) for role_id in role_ids]
+        member.bot = bot
+        return member
+
+
+def parse_timestamp(value) -> datetime.datetime:
+    """Naive UTC datetime, like discord.py gives, from an ISO string or epoch seconds"""
+    if value is None:
+        return datetime.datetime.utcnow()
+    if isinstance(value, (int, float)):
+        return datetime.datetime.utcfromtimestamp(value)
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def read_log(lines: Iterable[str]) -> Iterator[dict]:
+    """Records from a JSON lines log, blank lines are skipped"""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {number} is not valid JSON: {e}") from None
+
+
+def record_to_message(record: dict, guild: ReplayGuild) -> FakeMessage:
+    channel = guild.channel(record.get("channel_id"), record.get("category_id"))
+    author = guild.member(
+        record.get("author_id"), record.get("role_ids", ()), record.get("author_bot", False)
+    )
+    attachments = []
+    for attachment in record.get("attachments", ()):
+        fake = FakeAttachment(attachment["filename"])
+        fake.size = attachment.get("size", 0)
+        attachments.append(fake)
+    return FakeMessage(
+        record["content"],
+        author=author,
+        channel=channel,
+        guild=guild,
+        mentions=[guild.member(member_id) for member_id in record.get("mentions", ())],
+        attachments=attachments,
+        created_at=parse_timestamp(record.get("created_at")),
+    )
+
+
+def build_replay_cog(profile: dict, guild: FakeGuild, data_path: Path) -> AutoMod:
+    """
+    An AutoMod cog wired to fakes, `profile` is the raw config of the guild.
+
+    Rules can be keyed by their command name as well, `maxwordsrule` for `MaxWordsRule`.
+    """
+    cog = AutoMod.__new__(AutoMod)
+    cog.bot = FakeBot()
+    cog.config = InMemoryConfig()
+    cog.data_path = data_path
+    cog.setup_rules()
+
+    cog.imagedetectionrule.analyze_image = fake_analyze_image
+    cog.action_executor.backend = DryRunBackend()
+    # nothing is sent, so don't hold deletes back
+    cog.action_executor.delete_window = 0
+    data = {}
+    for key, value in profile.items():
+        rule = cog.rules_map.get(key)
+        data[rule.rule_name if rule is not None else key] = value
+    cog.config.guilds[guild.id] = data
+    return cog
+
+
+async def replay(lines: Iterable[str], profile: dict) -> dict:
+    """
+    Run every message in a log through the listener
+    Parameters
+    ----------
+    lines
+        The log, read lazily so it can be bigger than memory
+    profile
+        Raw guild config, a rule is only run if `is_enabled` is set under its name
+
+    Returns
+    -------
+    dict
+        Throughput, listener latency and triggers, evaluations and latency per rule
+    """
+    guild = ReplayGuild(name="replay")
+    listener = LatencyHistogram()
+    with tempfile.TemporaryDirectory() as data_path:
+        cog = build_replay_cog(profile, guild, Path(data_path))
+        started = time.perf_counter()
+        for record in read_log(lines):
+            message = record_to_message(record, guild)
+            start = time.perf_counter()
+            await cog._listen_for_infractions(message)
+            listener.observe(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+
+        await cog.imagedetectionrule.close()
+        await cog._close_actions()
+
+    actions = {}
+    for call in cog.action_executor.backend.calls:
+        actions[call[0]] = actions.get(call[0], 0) + 1
+    return {
+        "messages": listener.count,
+        "seconds": round(elapsed, 3),
+        "per_second": round(listener.count / elapsed, 1) if elapsed else None,
+        "listener": listener.to_dict(),
+        "rules": {
+            rule_name: {
+                "evaluations": metrics.evaluations,
+                "triggers": metrics.triggers,
+                "errors": metrics.errors,
+                "latency": metrics.latency.to_dict(),
+            }
+            for _, rule_name, metrics in cog.metrics.rule_rows(guild.id)
+        },
+        "actions": actions,
+    }
+
+
+def compare_profiles(before: dict, after: dict) -> dict:
+    """Trigger count changes per rule between two replays of the same log"""
+    changes = {}
+    for rule_name in sorted(set(before["rules"]) | set(after["rules"])):
+        old = before["rules"].get(rule_name, {}).get("triggers", 0)
+        new = after["rules"].get(rule_name, {}).get("triggers", 0)
+        if old != new:
+            changes[rule_name] = {"before": old, "after": new, "change": new - old}
+    return changes
+
+
+def load_json(path: str) -> dict:
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m automod.benchmarks.replay",
+        description="Run recorded messages through AutoMod rules offline.",
+    )
+    parser.add_argument("log", help="JSON lines file of recorded messages")
+    parser.add_argument("profile", help="JSON file with the guild settings to replay with")
+    parser.add_argument("--compare", help="A second settings profile to replay the log with")
+    parser.add_argument("--output", "-o", help="Write the JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> dict:
+    profiles = {"profile": args.profile}
+    if args.compare:
+        profiles["compare"] = args.compare
+
+    results = {"version": __version__, "log": args.log}
+    for key, path in profiles.items():
+        # streamed again for every profile rather than kept in memory
+        with open(args.log) as log_file:
+            results[key] = {"path": path, **await replay(log_file, load_json(path))}
+
+    if args.compare:
+        results["changes"] = compare_profiles(results["profile"], results["compare"])
+    return results
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    output = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+import asyncio
+import datetime
+import platform
+import random
+import statistics
+import string
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+from ..analysis import MessageAnalysis
+from ..main import AutoMod, __version__
+from ..rules.allowedextensions import BLACKLIST_EXTENSIONS
+from ..rules.config.WallspamRuleConfig import WallspamRuleConfig
+from ..rules.imagedetection import AZURE_ENDPOINT, AZURE_KEY
+from ..rules.maxchars import MAX_CHARS_KEY
+from ..rules.maxwords import MAX_WORDS_KEY
+from ..rules.perceptualhash import BANNED_HASHES_KEY, format_hash
+from .fakes import (
+    FakeAttachment,
+    FakeBot,
+    FakeChannel,
+    FakeGuild,
+    FakeMember,
+    FakeMessage,
+    InMemoryConfig,
+)
+
+DEFAULT_ROUNDS = 5
+DEFAULT_MESSAGES = 200
+DEFAULT_FILTER_SIZES = (10, 100, 1000)
+# median latency growth allowed before --compare calls it a regression
+DEFAULT_TOLERANCE = 0.25
+
+SAFE_VERDICT = {
+    "adult": {"isAdultContent": False, "isRacyContent": False, "isGoryContent": False},
+    "description": {"captions": [{"text": "a cat"}], "tags": ["cat"]},
+}
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+
+
+def make_png(rng: random.Random) -> bytes:
+    image = Image.new("RGB", (32, 32))
+    image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(32 * 32)])
+    buffer = BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class Scenario:
+    """Everything a corpus needs to build messages: one guild, a few channels and members"""
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.channels = [FakeChannel(name=f"channel-{i}") for i in range(5)]
+        self.members = [FakeMember(name=f"member-{i}") for i in range(50)]
+        self.guild = FakeGuild(name="benchmark", channels=self.channels)
+        self.guild.members = {member.id: member for member in self.members}
+        self.vocabulary = [random_word(self.rng) for _ in range(500)]
+        self.images = [make_png(self.rng) for _ in range(4)]
+        # a raid reuses a handful of invites, half of them to this guild
+        self.invite_codes = [
+            "".join(self.rng.choice(string.ascii_letters) for _ in range(8)) for _ in range(20)
+        ]
+        # messages are spaced out so the rate limiting rules see normal traffic
+        self.clock = datetime.datetime(2020, 1, 1)
+
+    def sentence(self, words: int) -> str:
+        return " ".join(self.rng.choice(self.vocabulary) for _ in range(words))
+
+    def message(self, content: str, mentions=(), attachments=()) -> FakeMessage:
+        self.clock += datetime.timedelta(seconds=2)
+        return FakeMessage(
+            content,
+            author=self.rng.choice(self.members),
+            channel=self.rng.choice(self.channels),
+            guild=self.guild,
+            mentions=mentions,
+            attachments=attachments,
+            created_at=self.clock,
+        )
+
+
+def short_chat(scenario: Scenario) -> FakeMessage:
+    return scenario.message(scenario.sentence(scenario.rng.randint(1, 12)))
+
+
+def wall_of_text(scenario: Scenario) -> FakeMessage:
+    if scenario.rng.random() < 0.5:
+        return scenario.message(scenario.sentence(scenario.rng.randint(150, 350)))
+    lines = [scenario.sentence(2) if scenario.rng.random() < 0.3 else "" for _ in range(40)]
+    return scenario.message("\n".join(lines))
+
+
+def mention_storm(scenario: Scenario) -> FakeMessage:
+    mentioned = scenario.rng.sample(scenario.members, scenario.rng.randint(5, 30))
+    content = " ".join(member.mention for member in mentioned)
+    return scenario.message(f"{scenario.sentence(3)} {content}", mentions=mentioned)
+
+
+def invites(scenario: Scenario) -> FakeMessage:
+    code = scenario.rng.choice(scenario.invite_codes)
+    content = f"{scenario.sentence(4)} join discord.gg/{code} {scenario.sentence(2)}"
+    return scenario.message(content)
+
+
+def many_attachments(scenario: Scenario) -> FakeMessage:
+    # unique names so only the content hash, not the filename, can hit the verdict cache
+    attachments = [
+        FakeAttachment(f"{index}.png", scenario.rng.choice(scenario.images))
+        for index in scenario.rng.sample(range(10 ** 9), scenario.rng.randint(1, 8))
+    ]
+    return scenario.message(scenario.sentence(2), attachments=attachments)
+
+
+CORPORA: Dict[str, Callable[[Scenario], FakeMessage]] = {
+    "short_chat": short_chat,
+    "wall_of_text": wall_of_text,
+    "mention_storm": mention_storm,
+    "invites": invites,
+    "many_attachments": many_attachments,
+}
+
+
+async def fake_analyze_image(image, subscription_key: str, url: str) -> dict:
+    """Stands in for the Azure request, yields once like a real response would"""
+    await asyncio.sleep(0)
+    return SAFE_VERDICT
+
+
+def build_cog(scenario: Scenario, filter_size: int, data_path: Path) -> AutoMod:
+    """An AutoMod cog wired to fakes, every rule enabled and only firing events"""
+    cog = AutoMod.__new__(AutoMod)
+    cog.bot = FakeBot()
+    cog.config = InMemoryConfig()
+    cog.data_path = data_path
+    cog.setup_rules()
+
+    cog.imagedetectionrule.analyze_image = fake_analyze_image
+    cog.bot.invites = {code: scenario.guild for code in scenario.invite_codes[::2]}
+
+    words = scenario.rng.sample(scenario.vocabulary, min(filter_size, len(scenario.vocabulary)))
+    while len(words) < filter_size:
+        words.append(random_word(scenario.rng))
+
+    rule_options = {
+        "maxcharsrule": {MAX_CHARS_KEY: 2000},
+        "maxwordsrule": {MAX_WORDS_KEY: 300},
+        "wallspamrule": {
+            WallspamRuleConfig.emptyline_enabled: True,
+            WallspamRuleConfig.emptyline_threshold: 5,
+        },
+        "wordfilterrule": {
+            "words": [
+                {"word": word, "author": 0, "is_cleaned": index % 2 == 0, "channel": []}
+                for index, word in enumerate(words)
+            ]
+        },
+        "inviterule": {
+            "allowed_links": ["discord.gg/red"],
+            "allowed_guilds": [scenario.guild.id],
+        },
+        "imagedetectionrule": {
+            AZURE_KEY: "benchmark",
+            AZURE_ENDPOINT: "https://benchmark.cognitiveservices.azure.com",
+        },
+        "perceptualhashrule": {
+            BANNED_HASHES_KEY: [
+                {"hash": format_hash(scenario.rng.getrandbits(64)), "author": 0, "note": None}
+                for _ in range(50)
+            ]
+        },
+        "regexrule": {
+            "patterns": [
+                {"pattern": r"fr[e3]{2}\s+nitro", "ignore_case": True, "channel": []},
+                {"pattern": r"https?://\S+\.(?:ru|tk)\b", "ignore_case": True, "channel": []},
+                {"pattern": r"(?:\d[ -]?){13,16}", "ignore_case": False, "channel": []},
+            ]
+        },
+        "allowedextensionsrule": {
+            BLACKLIST_EXTENSIONS: [{"extensions": [".exe"], "channels": []}]
+        },
+    }
+    data = {"settings": {"announcement_channel": None, "is_announcement_enabled": False}}
+    for name, rule in cog.rules_map.items():
+        data[rule.rule_name] = {
+            "is_enabled": True,
+            "action_to_take": "third_party",
+            "delete_message": False,
+            **rule_options.get(name, {}),
+        }
+    cog.config.guilds[scenario.guild.id] = data
+    return cog
+
+
+def summarize(name: str, corpus: str, filter_size: int, timings: List[float]) -> dict:
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        "name": name,
+        "corpus": corpus,
+        "filter_size": filter_size,
+        "messages": len(timings),
+        "mean_us": round(total / len(timings) * 1e6, 2),
+        "median_us": round(statistics.median(timings) * 1e6, 2),
+        "p95_us": round(timings[int(len(timings) * 0.95) - 1] * 1e6, 2),
+        "max_us": round(timings[-1] * 1e6, 2),
+        "per_second": round(len(timings) / total, 1) if total else None,
+    }
+
+
+async def time_calls(call, messages: List[FakeMessage]) -> List[float]:
+    timings = []
+    for message in messages:
+        start = time.perf_counter()
+        await call(message)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def run_benchmarks(
+    rounds: int = DEFAULT_ROUNDS,
+    messages: int = DEFAULT_MESSAGES,
+    filter_sizes=DEFAULT_FILTER_SIZES,
+    corpora: Optional[List[str]] = None,
+    seed: int = 0,
+) -> dict:
+    """
+    Time every rule's `is_offensive` and the whole listener over each corpus
+    Parameters
+    ----------
+    rounds
+        How many times each corpus is replayed, fresh messages every round
+    messages
+        Messages per corpus per round
+    filter_sizes
+        Word filter list lengths to run with, only the word filter and listener vary with it
+    corpora
+        Corpus names to run, all of `CORPORA` by default
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as data_path:
+        for filter_size in filter_sizes:
+            scenario = Scenario(seed)
+            cog = build_cog(scenario, filter_size, Path(data_path))
+            pipeline = await cog.pipeline_cache.get(scenario.guild)
+
+            for corpus in corpora or CORPORA:
+                make_message = CORPORA[corpus]
+                rule_timings = {name: [] for name in cog.rules_map}
+                listener_timings = []
+                for _ in range(rounds):
+                    batch = [make_message(scenario) for _ in range(messages)]
+                    for name, rule in cog.rules_map.items():
+                        # rules that don't depend on the filter are only worth timing once
+                        if name != "wordfilterrule" and filter_size != filter_sizes[0]:
+                            continue
+                        snapshot = pipeline.rules[rule.rule_name]
+                        # a fresh analysis per call, so each rule pays for what it reads
+                        rule_timings[name] += await time_calls(
+                            lambda m, r=rule, s=snapshot: r.is_offensive(
+                                m, s, MessageAnalysis(m.content)
+                            ),
+                            batch,
+                        )
+                    listener_timings += await time_calls(cog._listen_for_infractions, batch)
+
+                for name, timings in rule_timings.items():
+                    if timings:
+                        results.append(summarize(f"rule/{name}", corpus, filter_size, timings))
+                results.append(summarize("listener", corpus, filter_size, listener_timings))
+            await cog.imagedetectionrule.close()
+            cog.spamrule.close()
+
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "rounds": rounds,
+        "messages": messages,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float = DEFAULT_TOLERANCE) -> List[dict]:
+    """Benchmarks whose median latency grew more than `tolerance` since the baseline"""
+    key = lambda result: (result["name"], result["corpus"], result["filter_size"])
+    before = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = before.get(key(result))
+        if old is None or not old["median_us"]:
+            continue
+        change = result["median_us"] / old["median_us"] - 1
+        if change > tolerance:
+            regressions.append(
+                {
+                    "name": result["name"],
+                    "corpus": result["corpus"],
+                    "filter_size": result["filter_size"],
+                    "before_us": old["median_us"],
+                    "after_us": result["median_us"],
+                    "change": round(change, 3),
+                }
+            )
+    return regressions
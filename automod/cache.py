@@ -0,0 +1,230 @@
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Iterator, Optional, Tuple
+
+_MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LRUCache:
+    """
+    Least recently used cache with an optional time to live.
+
+    Parameters
+    ----------
+    maxsize
+        The maximum amount of entries, the least recently used one is evicted first
+    ttl
+        Seconds an entry lives for, None to keep entries until evicted
+    timer
+        The clock used for expiry, `time.time` if entries are persisted between runs
+    """
+
+    def __init__(
+        self, maxsize: int = 1024, ttl: Optional[float] = None, timer: Callable = time.monotonic
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return self.peek(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.peek(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Get without touching recency or hit counters"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= self.timer():
+            del self._data[key]
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        if expires_at is None and self.ttl is not None:
+            expires_at = self.timer() + self.ttl
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = (expires_at, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize: int) -> None:
+        """Change the capacity, evicting the least recently used entries if shrinking"""
+        self.maxsize = maxsize
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def items(self) -> Iterator[Tuple[Hashable, Optional[float], Any]]:
+        """Yields (key, expires_at, value) from least to most recently used"""
+        for key, (expires_at, value) in list(self._data.items()):
+            yield key, expires_at, value
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            size=len(self._data),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+class VerdictMemo:
+    """
+    Verdicts of stateless rules per guild, keyed by message content.
+
+    Each guild's memo is tagged with the pipeline version it was filled under. Any settings
+    write bumps that version, so the first lookup after it starts the guild over with an
+    empty memo.
+
+    Parameters
+    ----------
+    maxsize
+        How many verdicts to keep per guild
+    ttl
+        Seconds a verdict lives for, bounds how stale a resolved invite can be
+    max_guilds
+        How many guilds to keep memos for, the least recently active is dropped first
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 60.0, max_guilds: int = 256):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # guild id -> (pipeline version, LRUCache)
+        self._guilds = LRUCache(maxsize=max_guilds)
+        self.hits = 0
+        self.misses = 0
+
+    def _memo(self, guild_id: int, version: int) -> LRUCache:
+        entry = self._guilds.get(guild_id)
+        if entry is None or entry[0] != version:
+            entry = (version, LRUCache(maxsize=self.maxsize, ttl=self.ttl))
+            self._guilds.set(guild_id, entry)
+        return entry[1]
+
+    def get(self, guild_id: int, version: int, key: Hashable, default: Any = None) -> Any:
+        verdict = self._memo(guild_id, version).get(key, _MISSING)
+        if verdict is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return verdict
+
+    def set(self, guild_id: int, version: int, key: Hashable, verdict: Any) -> None:
+        self._memo(guild_id, version).set(key, verdict)
+
+    def clear(self) -> None:
+        self._guilds.clear()
+
+    def stats(self) -> CacheStats:
+        memos = [memo for _, _, (_, memo) in self._guilds.items()]
+        return CacheStats(
+            size=sum(len(memo) for memo in memos),
+            maxsize=self.maxsize * self._guilds.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=sum(memo.evictions for memo in memos),
+        )
+
+
+class SettingsCache:
+    """
+    Raw rule settings keyed by (guild id, rule name).
+
+    Writing a rule's settings only drops that rule's entry for that guild, so busy guilds
+    don't push each other out the way a single shared function cache did.
+
+    Parameters
+    ----------
+    config
+        The cog's Config
+    maxsize
+        How many (guild, rule) entries to keep
+    """
+
+    def __init__(self, config, maxsize: int = 1024):
+        self.config = config
+        self._cache = LRUCache(maxsize=maxsize)
+        self._versions = defaultdict(int)
+
+    def __len__(self):
+        return len(self._cache)
+
+    async def get(self, guild, rule_name: str) -> dict:
+        key = (guild.id, rule_name)
+        settings = self._cache.get(key)
+        if settings is not None:
+            return settings
+
+        version = self._versions[guild.id]
+        try:
+            settings = await self.config.guild(guild).get_raw(rule_name)
+        except KeyError:
+            settings = {}
+
+        # a setter ran while we were reading config, don't store stale data
+        if self._versions[guild.id] == version:
+            self._cache.set(key, settings)
+        return settings
+
+    def invalidate(self, guild_id: int, rule_name: Optional[str] = None) -> None:
+        """Drop one rule's settings for a guild, or every rule's if no name is given"""
+        if rule_name is not None:
+            keys = [(guild_id, rule_name)]
+        else:
+            keys = [key for key, _, _ in self._cache.items() if key[0] == guild_id]
+        self._versions[guild_id] += 1
+        for key in keys:
+            self._cache.pop(key)
+
+    def resize(self, maxsize: int) -> None:
+        self._cache.resize(maxsize)
+
+    def clear(self) -> None:
+        for key, _, _ in self._cache.items():
+            self._versions[key[0]] += 1
+        self._cache.clear()
+
+    def stats(self) -> CacheStats:
+        return self._cache.stats()
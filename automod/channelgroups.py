@@ -0,0 +1,73 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import FrozenSet, Mapping, Optional
+
+import discord
+
+_NO_GROUPS = frozenset()
+
+
+@dataclass(frozen=True)
+class ChannelGroupIndex:
+    """
+    A guild's channel groups, compiled once with the pipeline.
+
+    Groups can hold categories, every channel in a category is in the groups the
+    category is in.
+    """
+
+    # group name -> channel and category ids
+    groups: Mapping[str, FrozenSet[int]]
+    # channel or category id -> group names
+    by_channel: Mapping[int, FrozenSet[str]]
+
+    def __contains__(self, group_name: str):
+        return group_name in self.groups
+
+    def channels(self, group_name: str) -> FrozenSet[int]:
+        return self.groups.get(group_name, _NO_GROUPS)
+
+    def groups_of(self, channel_id: int, category_id: Optional[int] = None) -> FrozenSet[str]:
+        """The groups a channel is in, directly or through its category"""
+        groups = self.by_channel.get(channel_id, _NO_GROUPS)
+        if category_id is None:
+            return groups
+        inherited = self.by_channel.get(category_id)
+        return groups | inherited if inherited else groups
+
+    def groups_of_channel(self, channel: discord.abc.GuildChannel) -> FrozenSet[str]:
+        return self.groups_of(channel.id, getattr(channel, "category_id", None))
+
+    def changed(self, other: "ChannelGroupIndex") -> FrozenSet[str]:
+        """Names of the groups that were added, removed or edited between the two"""
+        names = set(self.groups) | set(other.groups)
+        return frozenset(
+            name for name in names if self.groups.get(name) != other.groups.get(name)
+        )
+
+
+def compile_channel_groups(channel_groups: Optional[dict]) -> ChannelGroupIndex:
+    """
+    Build the index from the raw `channel_groups` setting
+    Parameters
+    ----------
+    channel_groups
+        { group_name: [channel_ids] }, as stored under `settings`
+    """
+    groups = {}
+    by_channel = defaultdict(set)
+    for group_name, channel_ids in (channel_groups or {}).items():
+        groups[group_name] = frozenset(channel_ids)
+        for channel_id in channel_ids:
+            by_channel[channel_id].add(group_name)
+
+    return ChannelGroupIndex(
+        groups=MappingProxyType(groups),
+        by_channel=MappingProxyType(
+            {channel_id: frozenset(names) for channel_id, names in by_channel.items()}
+        ),
+    )
+
+
+EMPTY_CHANNEL_GROUPS = compile_channel_groups({})
@@ -9,6 +9,19 @@ ACTION_CONFIRMATION = {
 }
 
 DEFAULT_ACTION = "third_party"
+DEFAULT_PRIORITY = 0
+# (guild, rule) entries kept by the settings cache
+SETTINGS_CACHE_SIZE = 4096
+
+# seconds edits to a message are collected for before it's checked again
+EDIT_DEBOUNCE = 2.0
+
+# attachments image rules download and inspect, anything else is left alone
+IMAGE_EXTENSIONS = frozenset({".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"})
+MAX_IMAGE_SIZE = 8 * 1024 * 1024  # bytes
+
+# once one of these is taken no other rule needs to look at the message
+TERMINATING_ACTIONS = ("kick", "ban")
 
 DEFAULT_OPTIONS = {
     "role_to_add": None,
@@ -21,6 +34,7 @@ DEFAULT_OPTIONS = {
     "delete_message": False,
     "send_dm": False,
     "rule_specific_announce": None,
+    "priority": DEFAULT_PRIORITY,
 }
 
 OPTIONS_MAP = {
@@ -34,4 +48,5 @@ OPTIONS_MAP = {
     "delete_message": "Delete message",
     "send_dm": "DM User",
     "rule_specific_announce": "Announcing special",
+    "priority": "Priority",
 }
@@ -1,11 +1,15 @@
 import discord
 from discord.ext.commands import Greedy
 from redbot.core import commands, checks
+from redbot.core.data_manager import cog_data_path
 from redbot.core.utils.chat_formatting import box
 from redbot.core.utils.menus import menu, DEFAULT_CONTROLS
 
 from .constants import ACTION_CONFIRMATION
 from .rules.config.models import BlackOrWhiteList
+from .rules.discordinvites import invite_code
+from .rules.imagedetection import VERDICT_FILE
+from .rules.perceptualhash import format_hash, parse_hash
 from .utils import (
     error_message,
     check_success,
@@ -27,8 +31,10 @@ groups = {
     "maxwordsrule": "maximum words",
     "maxcharsrule": "maximum characters",
     "wordfilterrule": "word filter",
+    "perceptualhashrule": "known images",
     "imagedetectionrule": "image detection",
     "allowedextensionsrule": "Allowed extensions",
+    "regexrule": "regex filter",
 }
 
 NEW_LINE = "\n"
@@ -40,6 +46,20 @@ class GroupCommands:
     def __init__(self, *args, **kwargs):
         self.bot = kwargs.get("bot")
 
+    @staticmethod
+    def _scope_lines(channels: [discord.TextChannel] = None, groups: [str] = None) -> str:
+        """Where something added applies, for a diff box"""
+        lines = ["+ {0}".format(channel) for channel in channels or []]
+        lines.extend("+ {0} (group)".format(group) for group in groups or [])
+        return NEW_LINE.join(lines) or "+ Global"
+
+    @staticmethod
+    def _entry_channels(guild: discord.Guild, entry: dict) -> str:
+        """The channels and groups a filtered word or pattern applies to"""
+        lines = ["#{0}".format(guild.get_channel(ch)) for ch in entry["channel"]]
+        lines.extend("{0} (group)".format(group) for group in entry.get("groups") or [])
+        return "\n".join(lines) or "[Global]"
+
     """
     Commands specific to allowedextensions
     """
@@ -50,12 +70,17 @@ class GroupCommands:
         channels: [discord.TextChannel],
         white_or_blacklist: BlackOrWhiteList,
         extensions: [str],
+        groups: [str] = None,
     ):
         extensions = [ex.lower() for ex in extensions]
         if white_or_blacklist == BlackOrWhiteList.Blacklist:
-            await self.allowedextensionsrule.set_blacklist_extensions(guild, extensions, channels)
+            await self.allowedextensionsrule.set_blacklist_extensions(
+                guild, extensions, channels, groups
+            )
         else:
-            await self.allowedextensionsrule.set_whitelist_extensions(guild, extensions, channels)
+            await self.allowedextensionsrule.set_whitelist_extensions(
+                guild, extensions, channels, groups
+            )
 
     @staticmethod
     async def clean_and_validate_extensions(extensions: str) -> []:
@@ -120,15 +145,18 @@ class GroupCommands:
         """
         try:
             extensions = await self.clean_and_validate_extensions(extensions)
+            group_name = group_name.lower()
             channel_groups = await self.get_channel_groups(ctx.guild)
             if group_name not in channel_groups:
                 return await ctx.send(error_message(f"`{group_name}` Could not find group."))
-            channels = [ctx.guild.get_channel(ch) for ch in channel_groups[group_name]]
+            # stored by name, so later changes to the group apply
             await self._handle_adding_extension(
-                ctx.guild, channels, BlackOrWhiteList.Whitelist, extensions
+                ctx.guild, [], BlackOrWhiteList.Whitelist, extensions, [group_name]
             )
             return await ctx.send(
-                embed=await self.allowedextensionsrule.extension_added_embed(extensions, channels)
+                embed=await self.allowedextensionsrule.extension_added_embed(
+                    extensions, [f"{group_name} (group)"]
+                )
             )
         except ValueError as e:
             await ctx.send(error_message(e.args[0]))
@@ -147,14 +175,7 @@ class GroupCommands:
                 title="Whitelisted extensions",
                 description=f"To delete run: `{ctx.prefix}allowedextensionsrule allowlist delete {index}`",
             )
-            value = box(
-                NEW_LINE.join(
-                    "+ {0}".format(str(ctx.guild.get_channel(ch))) for ch in extension.channels
-                )
-                if extension.channels
-                else "+ Global",
-                "diff",
-            )
+            value = self.allowedextensionsrule.channels_box(ctx.guild, extension)
             extensions = ", ".join(extension.extensions)
             embed.add_field(name=extensions, value=value)
             embeds.append(embed)
@@ -198,14 +219,7 @@ class GroupCommands:
                 title="Blacklisted extensions",
                 description=f"To delete run: `{ctx.prefix}allowedextensionsrule blacklist delete {index}`",
             )
-            value = box(
-                NEW_LINE.join(
-                    "+ {0}".format(str(ctx.guild.get_channel(ch))) for ch in extension.channels
-                )
-                if extension.channels
-                else "+ Global",
-                "diff",
-            )
+            value = self.allowedextensionsrule.channels_box(ctx.guild, extension)
             embed.add_field(name=", ".join(extension.extensions), value=value)
             embeds.append(embed)
 
@@ -261,14 +275,19 @@ class GroupCommands:
         """
         try:
             extensions = await self.clean_and_validate_extensions(extensions)
+            group_name = group_name.lower()
             channel_groups = await self.get_channel_groups(ctx.guild)
             if group_name not in channel_groups:
                 return await ctx.send(error_message(f"`{group_name}` Could not find group."))
-            channels = [ctx.guild.get_channel(ch) for ch in channel_groups[group_name]]
+            # stored by name, so later changes to the group apply
             await self._handle_adding_extension(
-                ctx.guild, channels, BlackOrWhiteList.Blacklist, extensions
+                ctx.guild, [], BlackOrWhiteList.Blacklist, extensions, [group_name]
+            )
+            return await ctx.send(
+                embed=await self.allowedextensionsrule.extension_added_embed(
+                    extensions, [f"{group_name} (group)"]
+                )
             )
-            return await ctx.send(embed=await self.extension_added_embed(extensions, channels))
         except ValueError as e:
             await ctx.send(error_message(e.args[0]))
 
@@ -279,6 +298,9 @@ class GroupCommands:
         """
         Detects if a word matches list of forbidden words.
 
+        Matching ignores case, accents, full width or styled letters and look-alike letters
+        from other alphabets.
+
         This has an optional attribute of `is_cleaned` which will attempt to remove all punctuation from the word
         in sentence. This can aid against people attempting to evade, example: `f.ilte.red`
         """
@@ -320,12 +342,7 @@ class GroupCommands:
                     text=f"Filtering {amount_filtered} words across {channels_filtering} channels"
                 )
                 for word in chunk:
-                    channels = word["channel"]
-                    chans = (
-                        "\n".join("#{0}".format(ctx.guild.get_channel(w)) for w in channels)
-                        if channels
-                        else "[Global]"
-                    )
+                    chans = self._entry_channels(ctx.guild, word)
                     table = [
                         [
                             (
@@ -347,12 +364,7 @@ class GroupCommands:
         else:
             try:
                 current_word = [x for x in current_filtered if x["word"] == word.lower()][0]
-                channels = current_word["channel"]
-                chans = (
-                    "\n".join("#{0}".format(ctx.guild.get_channel(w)) for w in channels)
-                    if channels
-                    else "[Global]"
-                )
+                chans = self._entry_channels(ctx.guild, current_word)
                 author = self.bot.get_user(current_word["author"]) or "Not found user."
                 embed = discord.Embed(
                     title="Word filtering",
@@ -400,14 +412,58 @@ class GroupCommands:
         `group`: the key name of the group of channels
         `is_cleaned`: an optional True/False argument that will remove punctuation from the message
         """
+        group_name = group_name.lower()
         channel_groups = await self.get_channel_groups(ctx.guild)
         if group_name not in channel_groups:
-            return await ctx.send(await error_message(f"`{group_name}` Could not find group."))
-        channels = [ctx.guild.get_channel(ch) for ch in channel_groups[group_name]]
-        await self.handle_adding_to_filter(ctx, word, channels, is_cleaned)
+            return await ctx.send(error_message(f"`{group_name}` Could not find group."))
+        # stored by name, so later changes to the group apply
+        await self.handle_adding_to_filter(ctx, word, is_cleaned=is_cleaned, groups=[group_name])
+
+    @add_word_to_filter.command(name="bulk")
+    async def _add_many_to_filter(self, ctx, *words: str):
+        """Add many words to the list of forbidden words at once
+
+        `words`: the words to add, or attach a text file with one word per line
+
+        Words added this way are filtered in every channel and are not cleaned.
+        """
+        words = list(words)
+        for attachment in ctx.message.attachments:
+            try:
+                words += (await attachment.read()).decode().split()
+            except UnicodeDecodeError:
+                return await ctx.send(error_message(f"`{attachment.filename}` isn't a text file."))
+        if not words:
+            return await ctx.send(error_message("Give some words or attach a file of them."))
+
+        added = await self.wordfilterrule.add_many_to_filter(ctx.guild, words, ctx.author)
+        return await ctx.send(
+            check_success(
+                f"`{len(added)}` words added to the filter, "
+                f"`{len(set(w.lower() for w in words)) - len(added)}` were already filtered."
+            )
+        )
+
+    @wordfilterrule.command(name="bulkremove", aliases=["bulkdel"])
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _remove_many_from_filter(self, ctx, *words: str):
+        """Remove many words from the list of filtered words at once"""
+        if not words:
+            return await ctx.send_help()
+        removed = await self.wordfilterrule.remove_many_from_filter(ctx.guild, words)
+        if not removed:
+            return await ctx.send(error_message("None of those words are being filtered."))
+        return await ctx.send(
+            check_success(f"`{len(removed)}` words removed from the list of filtered words.")
+        )
 
     async def handle_adding_to_filter(
-        self, ctx, word: str, channels: [discord.TextChannel] = None, is_cleaned: bool = False
+        self,
+        ctx,
+        word: str,
+        channels: [discord.TextChannel] = None,
+        is_cleaned: bool = False,
+        groups: [str] = None,
     ):
         word = word.lower()
         current_filtered = await self.wordfilterrule.get_filtered_words(ctx.guild)
@@ -415,11 +471,16 @@ class GroupCommands:
             if word in values["word"]:
                 return await ctx.send(error_message(f"`{word}` is already being filtered."))
         await self.wordfilterrule.add_to_filter(
-            guild=ctx.guild, word=word, author=ctx.author, channels=channels, is_cleaned=is_cleaned
+            guild=ctx.guild,
+            word=word,
+            author=ctx.author,
+            channels=channels,
+            is_cleaned=is_cleaned,
+            groups=groups,
         )
 
         nl = "\n"
-        chans = nl.join("+ {0}".format(w) for w in channels) if channels else "+ Global"
+        chans = self._scope_lines(channels, groups)
         fmt_box = box(f"Word       :  [{word}]\nCleaned    :  [{is_cleaned}]\n", "ini")
         embed = discord.Embed(
             title=f"Word added",
@@ -429,6 +490,143 @@ class GroupCommands:
         embed.add_field(name="Channels", value=box(chans, "diff"))
         return await ctx.send(embed=embed)
 
+    """
+    Commands specific to regex rule
+    """
+
+    @commands.group()
+    @checks.mod_or_permissions(manage_messages=True)
+    async def regexrule(self, ctx):
+        """
+        Detects messages matching admin supplied regular expressions.
+
+        Patterns that can backtrack for a long time, like `(a+)+`, `(a|aa)*` or `.*.*`,
+        are rejected, as are backreferences and named groups.
+        """
+        pass
+
+    @regexrule.group(name="add")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _add_pattern_group(self, ctx):
+        pass
+
+    @_add_pattern_group.command(name="channel")
+    async def _add_pattern_to_channels(
+        self,
+        ctx,
+        pattern: str,
+        channels: Greedy[discord.TextChannel] = None,
+        ignore_case: bool = False,
+    ):
+        """Add a pattern to the regex filter
+
+        `pattern`: the regular expression, wrap it in quotes if it contains spaces
+        `channels`: a list of channels to filter in, everywhere if none are given
+        `ignore_case`: an optional True/False argument to match regardless of case
+        """
+        await self.handle_adding_pattern(ctx, pattern, channels, ignore_case)
+
+    @_add_pattern_group.command(name="group")
+    async def _add_pattern_to_group(
+        self, ctx, pattern: str, group_name: str, ignore_case: bool = False
+    ):
+        """Add a pattern to a predefined group of channels
+
+        `pattern`: the regular expression, wrap it in quotes if it contains spaces
+        `group`: the key name of the group of channels
+        `ignore_case`: an optional True/False argument to match regardless of case
+        """
+        group_name = group_name.lower()
+        channel_groups = await self.get_channel_groups(ctx.guild)
+        if group_name not in channel_groups:
+            return await ctx.send(error_message(f"`{group_name}` Could not find group."))
+        # stored by name, so later changes to the group apply
+        await self.handle_adding_pattern(
+            ctx, pattern, ignore_case=ignore_case, groups=[group_name]
+        )
+
+    async def handle_adding_pattern(
+        self,
+        ctx,
+        pattern: str,
+        channels: [discord.TextChannel] = None,
+        ignore_case: bool = False,
+        groups: [str] = None,
+    ):
+        try:
+            await self.regexrule.add_pattern(
+                ctx.guild,
+                pattern,
+                ctx.author,
+                channels=channels,
+                ignore_case=ignore_case,
+                groups=groups,
+            )
+        except ValueError as e:
+            return await ctx.send(error_message(str(e)))
+
+        chans = self._scope_lines(channels, groups)
+        embed = discord.Embed(
+            title="Pattern added",
+            description=f"You can remove this pattern by running the command: `{ctx.prefix}regexrule remove {pattern}`",
+        )
+        embed.add_field(
+            name="Pattern details",
+            value=box(f"Pattern     :  [{pattern}]\nIgnore case :  [{ignore_case}]\n", "ini"),
+        )
+        embed.add_field(name="Channels", value=box(chans, "diff"))
+        return await ctx.send(embed=embed)
+
+    @regexrule.command(name="remove", aliases=["del"])
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _remove_pattern(self, ctx, pattern: str):
+        """Remove a pattern from the regex filter"""
+        try:
+            await self.regexrule.remove_pattern(ctx.guild, pattern)
+        except ValueError as e:
+            return await ctx.send(error_message(str(e)))
+        return await ctx.send(
+            check_success(f"`{pattern}` has been removed from the regex filter.")
+        )
+
+    @regexrule.command(name="list")
+    async def _show_all_patterns(self, ctx):
+        """Show all the filtered patterns"""
+        patterns = await self.regexrule.get_patterns(ctx.guild)
+        embeds = []
+        for chunk in chunks(patterns, 4):
+            embed = discord.Embed(title="Filtered patterns")
+            embed.set_footer(text=f"Filtering {len(patterns)} patterns")
+            for pattern in chunk:
+                chans = self._entry_channels(ctx.guild, pattern)
+                table = [
+                    [
+                        (
+                            f"Added by    : [{self.bot.get_user(pattern['author'])}]\n"
+                            f"Ignore case : [{pattern['ignore_case']}]\n"
+                        ),
+                        chans,
+                    ],
+                ]
+                tab = box(tabulate(table, ["Meta", "Channels"], tablefmt="presto"), "ini")
+                embed.add_field(name=f"`{pattern['pattern']}`", value=tab, inline=False)
+            embeds.append(embed)
+
+        if not embeds:
+            return await ctx.send("There are currently no patterns being filtered.")
+        return await menu(ctx, embeds, DEFAULT_CONTROLS)
+
+    @regexrule.command(name="test")
+    async def _test_patterns(self, ctx, *, text: str):
+        """Check which pattern, if any, would match some text in this channel"""
+        pipeline = await self.pipeline_cache.get(ctx.guild)
+        compiled = pipeline.rules[self.regexrule.rule_name].options["filter"]
+        found = compiled.search(text, ctx.channel.id)
+        if found is None:
+            return await ctx.send("No pattern matches that text here.")
+        pattern, matched = found
+        return await ctx.send(box(f"Pattern : [{pattern}]\nMatched : [{matched}]", "ini"))
+
     # commands specific to maxwords
     @commands.group()
     @checks.mod_or_permissions(manage_messages=True)
@@ -480,9 +678,93 @@ class GroupCommands:
 
         1) It checks if a user has spammed more than 10 times in 12 seconds
         2) It checks if the content has been spammed 15 times in 17 seconds.
+
+        When many members join or talk at once the server goes into raid mode,
+        both limits drop to 5 until it calms down again, see `[p]spamrule raid`.
         """
         pass
 
+    @spamrule.command(name="stats")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _spamrule_stats(self, ctx):
+        """Show how much spam tracking state is being held for this server"""
+        stats = self.spamrule.get_stats(ctx.guild)
+        if not stats:
+            return await ctx.send("No messages have been tracked in this server yet.")
+
+        raid = self.spamrule.get_raid(ctx.guild)
+        offenders = len(self.spamrule.offenders.get(ctx.guild.id, ()))
+        embed = discord.Embed(
+            title="Spam rule state",
+            description=f"Users collected during spam encounters: `{offenders}`\n"
+            f"Raid mode: `{raid.reason if raid else 'Off'}`",
+        )
+        for name, store in stats.items():
+            embed.add_field(
+                name=name,
+                value=box(
+                    f"Buckets : [{store.buckets}/{store.max_buckets}]\n"
+                    f"Evicted : [{store.evicted}]\n"
+                    f"Expired : [{store.expired}]\n"
+                    f"Memory  : [{store.bytes_used / 1024:.1f} KiB]",
+                    "ini",
+                ),
+            )
+        return await ctx.send(embed=embed)
+
+    @spamrule.command(name="offenders")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _spamrule_offenders(self, ctx, clear: bool = False):
+        """
+        Send the ids of everyone caught spamming, as a file
+
+        Pass `true` to clear the list once it's sent.
+        """
+        if not self.spamrule.offenders.get(ctx.guild.id):
+            return await ctx.send("Nobody has been caught spamming in this server.")
+
+        file = await self.spamrule.export_offenders(ctx.guild, clear=clear)
+        await ctx.send(file=file)
+
+    @spamrule.group(name="raid", invoke_without_command=True)
+    async def _raid_threshold_group(self, ctx):
+        """Show the raid mode thresholds.
+
+        Raid mode starts when any of these is reached:
+        `joins` - members joining
+        `messages` - messages sent
+        `authors` - different members talking
+
+        Each is a count within a number of seconds.
+        """
+        thresholds = await self.spamrule.get_raid_thresholds(ctx.guild)
+        table = [[name, count, f"{per:g}s"] for name, (count, per) in thresholds._asdict().items()]
+        await ctx.send(
+            box(tabulate(table, ["Threshold", "Count", "Within"], tablefmt="presto"), "ini")
+        )
+
+    @_raid_threshold_group.command(name="set")
+    async def _raid_threshold_set_command(self, ctx, name: str, count: int, seconds: float):
+        """Set a raid mode threshold
+
+        Example:
+        `[p]spamrule raid set joins 25 10` starts raid mode when 25 members join within 10 seconds
+        """
+        try:
+            await self.spamrule.set_raid_threshold(ctx.guild, name, count, seconds)
+        except ValueError as e:
+            return await ctx.send(error_message(str(e)))
+        await ctx.send(thumbs_up_success(f"Set `{name}` to `{count}` within `{seconds:g}s`."))
+
+    @_raid_threshold_group.command(name="reset")
+    async def _raid_threshold_reset_command(self, ctx, name: str):
+        """Reset a raid mode threshold to its default"""
+        try:
+            await self.spamrule.reset_raid_threshold(ctx.guild, name)
+        except ValueError as e:
+            return await ctx.send(error_message(str(e)))
+        await ctx.send(thumbs_up_success(f"Reset `{name}` to its default."))
+
     # commands specific to mention spam rule
     @commands.group()
     @checks.mod_or_permissions(manage_messages=True)
@@ -544,6 +826,52 @@ class GroupCommands:
         await self.wallspamrule.set_emptyline_threshold(ctx.guild, threshold)
         return await ctx.send(thumbs_up_success(f"Set the emptyline threshold to `{threshold}`"))
 
+    @wallspamrule.group(name="wallthreshold", invoke_without_command=True)
+    async def _wall_threshold_group(self, ctx):
+        """Show the wall text thresholds.
+
+        `long_word_threshold` - first word longer than this many characters
+        `repeated_word_threshold` - first word appearing more than this many times
+        `repetition_ratio` - share of words that are repeats, between 0 and 1
+        `word_run_threshold` - the same word this many times in a row
+        `char_run_threshold` - the same character this many times in a row
+        `min_entropy` - long messages made of too few different characters
+
+        A threshold of `None` means that check is off.
+        """
+        thresholds = await self.wallspamrule.get_wall_text_thresholds(ctx.guild)
+        table = [[name, value] for name, value in thresholds.items()]
+        await ctx.send(box(tabulate(table, ["Threshold", "Value"], tablefmt="presto"), "ini"))
+
+    @_wall_threshold_group.command(name="set")
+    async def _wall_threshold_set_command(self, ctx, name: str, value: float):
+        """Set a wall text threshold
+
+        Thresholds counting words or characters must be whole numbers."""
+        try:
+            value = await self.wallspamrule.set_wall_text_threshold(ctx.guild, name, value)
+        except ValueError as e:
+            return await ctx.send(error_message(str(e)))
+        await ctx.send(thumbs_up_success(f"Set `{name}` to `{value}`."))
+
+    @_wall_threshold_group.command(name="off")
+    async def _wall_threshold_off_command(self, ctx, name: str):
+        """Turn off a wall text check"""
+        try:
+            await self.wallspamrule.set_wall_text_threshold(ctx.guild, name, None)
+        except ValueError as e:
+            return await ctx.send(error_message(str(e)))
+        await ctx.send(thumbs_up_success(f"Turned off `{name}`."))
+
+    @_wall_threshold_group.command(name="reset")
+    async def _wall_threshold_reset_command(self, ctx, name: str):
+        """Reset a wall text threshold to its default"""
+        try:
+            await self.wallspamrule.reset_wall_text_threshold(ctx.guild, name)
+        except ValueError as e:
+            return await ctx.send(error_message(str(e)))
+        await ctx.send(thumbs_up_success(f"Reset `{name}` to its default."))
+
     """
     Commands specific to discord invite rule
     """
@@ -580,8 +908,8 @@ class GroupCommands:
         """
         try:
             await self.inviterule.add_allowed_link(ctx.guild, link)
-        except ValueError:
-            return await ctx.send("`👆` That link already exists.")
+        except ValueError as e:
+            return await ctx.send(error_message(e.args[0]))
 
         return await ctx.send(thumbs_up_success(f"Added `{link}` to the allowed links list."))
 
@@ -596,7 +924,9 @@ class GroupCommands:
         try:
             await self.inviterule.delete_allowed_link(ctx.guild, link)
         except ValueError as e:
-            await ctx.send(error_message(f"{e.args[0]}"))
+            return await ctx.send(error_message(f"{e.args[0]}"))
+
+        return await ctx.send(check_success(f"Removed `{link}` from the allowed links list."))
 
     @whitelistlink.command(name="show")
     @checks.mod_or_permissions(manage_messages=True)
@@ -614,6 +944,141 @@ class GroupCommands:
         else:
             await ctx.send(error_message("No links currently allowed."))
 
+    @inviterule.group()
+    @checks.mod_or_permissions(manage_messages=True)
+    async def allowserver(self, ctx):
+        """Add/remove/show servers whose invites are allowed
+
+        Any invite pointing to an allowed server is immune from automod actions,
+        including vanity links and invites created after it was added."""
+        pass
+
+    @allowserver.command(name="add")
+    async def _allow_server_add(self, ctx, invite_or_id: str):
+        """
+        Allow invites to a server.
+
+        Takes the server's id, or any invite to it.
+        """
+        if invite_or_id.isdigit():
+            guild_id = int(invite_or_id)
+        else:
+            code = invite_code(invite_or_id)
+            guild_id = await self.inviterule.resolver.resolve(code) if code else None
+            if guild_id is None:
+                return await ctx.send(error_message("Could not find the server for that invite."))
+
+        try:
+            await self.inviterule.add_allowed_guild(ctx.guild, guild_id)
+        except ValueError as e:
+            return await ctx.send(error_message(e.args[0]))
+        return await ctx.send(thumbs_up_success(f"Invites to `{guild_id}` are now allowed."))
+
+    @allowserver.command(name="delete", aliases=["remove"])
+    async def _allow_server_delete(self, ctx, guild_id: int):
+        """Stop allowing invites to a server"""
+        try:
+            await self.inviterule.remove_allowed_guild(ctx.guild, guild_id)
+        except ValueError as e:
+            return await ctx.send(error_message(e.args[0]))
+        return await ctx.send(check_success(f"Invites to `{guild_id}` are no longer allowed."))
+
+    @allowserver.command(name="show")
+    async def _allow_server_show(self, ctx):
+        """Show the servers whose invites are allowed"""
+        allowed_guilds = await self.inviterule.get_allowed_guilds(ctx.guild)
+        if not allowed_guilds:
+            return await ctx.send(error_message("No servers currently allowed."))
+        embed = discord.Embed(
+            title="Servers whose invites are not filtered by the rule",
+            description=", ".join("`{0}`".format(guild_id) for guild_id in allowed_guilds),
+        )
+        await ctx.send(embed=embed)
+
+    """
+    Commands specific to PerceptualHash
+    """
+
+    @commands.group()
+    @checks.mod_or_permissions(manage_messages=True)
+    async def perceptualhashrule(self, ctx):
+        """
+        Detects known images, even when resized or re-encoded
+
+        Works offline by comparing image fingerprints against a list of banned images.
+        """
+        pass
+
+    @perceptualhashrule.command(name="ban", aliases=["add"])
+    async def _ban_images(self, ctx, *, note: str = None):
+        """
+        Ban the images attached to this command
+
+        `note`: an optional note to remember why these images are banned
+        """
+        if not ctx.message.attachments:
+            return await ctx.send(error_message("Attach the images to ban to this command."))
+
+        hashes = [
+            await self.perceptualhashrule.hash_attachment(a) for a in ctx.message.attachments
+        ]
+        hashes = [h for h in hashes if h is not None]
+        if not hashes:
+            return await ctx.send(error_message("None of the attachments are readable images."))
+
+        added = await self.perceptualhashrule.add_banned_hashes(
+            ctx.guild, hashes, ctx.author, note
+        )
+        if not added:
+            return await ctx.send(error_message("Those images are already banned."))
+
+        fmt_box = box(NEW_LINE.join("+ {0}".format(format_hash(h)) for h in added), "diff")
+        return await ctx.send(check_success(f"Banned `{len(added)}` image(s).\n{fmt_box}"))
+
+    @perceptualhashrule.command(name="remove", aliases=["del"])
+    async def _unban_image(self, ctx, image_hash: str):
+        """Remove an image hash from the banlist"""
+        try:
+            await self.perceptualhashrule.remove_banned_hash(ctx.guild, parse_hash(image_hash))
+        except ValueError as e:
+            return await ctx.send(error_message(e.args[0]))
+        return await ctx.send(check_success(f"`{image_hash}` is no longer banned."))
+
+    @perceptualhashrule.command(name="list")
+    async def _list_banned_images(self, ctx):
+        """Show all banned image hashes"""
+        banned = await self.perceptualhashrule.get_banned_hashes(ctx.guild)
+        if not banned:
+            return await ctx.send("There are currently no images banned.")
+
+        embeds = []
+        for chunk in chunks(banned, 15):
+            table = [
+                [entry["hash"], self.bot.get_user(entry["author"]), entry["note"]]
+                for entry in chunk
+            ]
+            embed = discord.Embed(
+                title="Banned images",
+                description=box(tabulate(table, ["Hash", "Added by", "Note"], tablefmt="presto")),
+            )
+            embed.set_footer(text=f"{len(banned)} images banned")
+            embeds.append(embed)
+        return await menu(ctx, embeds, DEFAULT_CONTROLS)
+
+    @perceptualhashrule.command(name="distance")
+    async def _set_hash_distance(self, ctx, max_distance: int):
+        """
+        Set how different an image can be from a banned one and still match
+
+        This is the amount of differing bits out of 64, between 0 and 7, defaults to 6.
+        Higher catches more edits but risks false positives.
+        """
+        try:
+            await self.perceptualhashrule.set_max_distance(ctx.guild, max_distance)
+        except ValueError as e:
+            return await ctx.send(error_message(str(e)))
+        return await ctx.send(thumbs_up_success(f"Set the max distance to `{max_distance}`."))
+
     """
     Commands specific to ImageDetection
     """
@@ -626,6 +1091,70 @@ class GroupCommands:
         """
         pass
 
+    @imagedetectionrule.group(name="cache")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _image_cache_group(self, ctx):
+        """
+        Cached image verdicts
+
+        Images that have been seen before are answered from the cache instead of Azure.
+        """
+        pass
+
+    @_image_cache_group.command(name="stats")
+    async def _image_cache_stats(self, ctx):
+        """Show cache hits and misses"""
+        verdicts = self.imagedetectionrule.verdicts
+        embed = discord.Embed(
+            title="Image verdict cache",
+            description=f"Persisted to disk: `{verdicts.path is not None}`",
+        )
+        for name, stats in (
+            ("By filename and size", verdicts.by_attachment.stats()),
+            ("By content", verdicts.by_hash.stats()),
+        ):
+            embed.add_field(
+                name=name,
+                value=box(
+                    f"Cached    : [{stats.size}/{stats.maxsize}]\n"
+                    f"Hits      : [{stats.hits}]\n"
+                    f"Misses    : [{stats.misses}]\n"
+                    f"Hit rate  : [{stats.hit_rate:.1%}]\n"
+                    f"Evictions : [{stats.evictions}]",
+                    "ini",
+                ),
+            )
+        return await ctx.send(embed=embed)
+
+    @_image_cache_group.command(name="clear")
+    @checks.is_owner()
+    async def _image_cache_clear(self, ctx):
+        """Forget every cached verdict"""
+        self.imagedetectionrule.verdicts.clear()
+        await self.imagedetectionrule.save_verdicts()
+        return await ctx.send(check_success("Cleared the image verdict cache."))
+
+    @_image_cache_group.command(name="persist")
+    @checks.is_owner()
+    @docstring_parameter(ToggleBool.fmt_box)
+    async def _image_cache_persist(self, ctx, toggle: ToggleBool):
+        """
+        Toggle saving verdicts to disk so they survive restarts
+
+        {0}
+        """
+        await self.config.persist_image_verdicts.set(toggle)
+        if toggle:
+            loaded = await self.imagedetectionrule.load_verdicts(
+                cog_data_path(self) / VERDICT_FILE
+            )
+            return await ctx.send(
+                thumbs_up_success(f"Image verdicts will be saved, `{loaded}` loaded from disk.")
+            )
+
+        await self.imagedetectionrule.disable_verdict_persistence()
+        return await ctx.send(thumbs_up_success("Image verdicts will no longer be saved."))
+
     @imagedetectionrule.command(name="setendpoint")
     async def _set_endpoint(self, ctx, guild_id: int, endpoint: str):
         """Set the endpoint displayed in your Azure Portal"""
@@ -791,6 +1320,37 @@ def whitelistrole_delete_wrapper(group, name, friendly_name):
     return _whitelistrole_delete_command
 
 
+def whitelistrole_bulk_add_wrapper(group, name, friendly_name):
+    @group.command(name="bulkadd")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _whitelistrole_bulk_add_command(self, ctx, roles: Greedy[discord.Role]):
+        """Add many roles to be ignored by automod actions at once"""
+        if not roles:
+            return await ctx.send_help()
+        rule = getattr(self, name)
+        added = await rule.append_whitelist_roles(ctx.guild, roles)
+        await ctx.send(
+            f"`{len(added)}` roles added to the whitelist, "
+            f"`{len(set(roles)) - len(added)}` were already whitelisted."
+        )
+
+    return _whitelistrole_bulk_add_command
+
+
+def whitelistrole_bulk_delete_wrapper(group, name, friendly_name):
+    @group.command(name="bulkdelete")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _whitelistrole_bulk_delete_command(self, ctx, roles: Greedy[discord.Role]):
+        """Delete many roles from being ignored by automod actions at once"""
+        if not roles:
+            return await ctx.send_help()
+        rule = getattr(self, name)
+        removed = await rule.remove_whitelist_roles(ctx.guild, roles)
+        await ctx.send(f"Removed `{len(removed)}` roles from the whitelist.")
+
+    return _whitelistrole_bulk_delete_command
+
+
 def whitelistrole_show_wrapper(group, name, friendly_name):
     @group.command(name="show")
     @checks.mod_or_permissions(manage_messages=True)
@@ -810,6 +1370,132 @@ def whitelistrole_show_wrapper(group, name, friendly_name):
     return _whitelistrole_show_command
 
 
+def whitelistuser_wrapper(group, name, friendly_name):
+    @group.group(name="whitelistuser")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def whitelistuser(self, ctx):
+        """Whitelisting user settings
+
+        Adding a user to the whitelist means that they will be immune to this rule
+        """
+        pass
+
+    return whitelistuser
+
+
+def whitelistuser_add_wrapper(group, name, friendly_name):
+    @group.command(name="add")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _whitelistuser_add_command(self, ctx, user: discord.Member):
+        """Add a user to be ignored by this rule"""
+        rule = getattr(self, name)
+        try:
+            await rule.append_whitelist_user(ctx.guild, user)
+        except ValueError:
+            return await ctx.send(f"`{user}` is already whitelisted.")
+        await ctx.send(f"`{user}` added to the whitelist.")
+
+    return _whitelistuser_add_command
+
+
+def whitelistuser_delete_wrapper(group, name, friendly_name):
+    @group.command(name="delete")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _whitelistuser_delete_command(self, ctx, user: discord.Member):
+        """Delete a user from being ignored by this rule"""
+        rule = getattr(self, name)
+        try:
+            await rule.remove_whitelist_user(ctx.guild, user)
+            return await ctx.send(f"Removed `{user}` from the whitelist.")
+        except ValueError:
+            return await ctx.send(f"`{user}` is not whitelisted.")
+
+    return _whitelistuser_delete_command
+
+
+def whitelistuser_show_wrapper(group, name, friendly_name):
+    @group.command(name="show")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _whitelistuser_show_command(self, ctx):
+        """Show all whitelisted users"""
+        rule = getattr(self, name)
+        user_ids = await rule.get_all_whitelisted_users(ctx.guild)
+        if user_ids:
+            desc = ", ".join(
+                "`{0}`".format(ctx.guild.get_member(user_id) or user_id) for user_id in user_ids
+            )
+            em = discord.Embed(
+                title="Whitelisted users", description=desc, color=discord.Color.greyple(),
+            )
+            await ctx.send(embed=em)
+        else:
+            await ctx.send("`❌` No users currently whitelisted.")
+
+    return _whitelistuser_show_command
+
+
+def whitelistchannel_wrapper(group, name, friendly_name):
+    @group.group(name="whitelistchannel")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def whitelistchannel(self, ctx):
+        """Whitelisting channel settings
+
+        Messages in a whitelisted channel are never checked by this rule
+        """
+        pass
+
+    return whitelistchannel
+
+
+def whitelistchannel_add_wrapper(group, name, friendly_name):
+    @group.command(name="add")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _whitelistchannel_add_command(self, ctx, channel: discord.TextChannel):
+        """Add a channel to be ignored by this rule"""
+        rule = getattr(self, name)
+        try:
+            await rule.append_whitelist_channel(ctx.guild, channel)
+        except ValueError:
+            return await ctx.send(f"{channel.mention} is already whitelisted.")
+        await ctx.send(f"{channel.mention} added to the whitelist.")
+
+    return _whitelistchannel_add_command
+
+
+def whitelistchannel_delete_wrapper(group, name, friendly_name):
+    @group.command(name="delete")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _whitelistchannel_delete_command(self, ctx, channel: discord.TextChannel):
+        """Delete a channel from being ignored by this rule"""
+        rule = getattr(self, name)
+        try:
+            await rule.remove_whitelist_channel(ctx.guild, channel)
+            return await ctx.send(f"Removed {channel.mention} from the whitelist.")
+        except ValueError:
+            return await ctx.send(f"{channel.mention} is not whitelisted.")
+
+    return _whitelistchannel_delete_command
+
+
+def whitelistchannel_show_wrapper(group, name, friendly_name):
+    @group.command(name="show")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _whitelistchannel_show_command(self, ctx):
+        """Show all whitelisted channels"""
+        rule = getattr(self, name)
+        channel_ids = await rule.get_all_whitelisted_channels(ctx.guild)
+        if channel_ids:
+            desc = ", ".join(f"<#{channel_id}>" for channel_id in channel_ids)
+            em = discord.Embed(
+                title="Whitelisted channels", description=desc, color=discord.Color.greyple(),
+            )
+            await ctx.send(embed=em)
+        else:
+            await ctx.send("`❌` No channels currently whitelisted.")
+
+    return _whitelistchannel_show_command
+
+
 def add_role_wrapper(group, name, friendly_name):
     @group.command(name="role")
     @checks.mod_or_permissions(manage_messages=True)
@@ -827,6 +1513,27 @@ def add_role_wrapper(group, name, friendly_name):
     return _add_role_command
 
 
+def priority_wrapper(group, name, friendly_name):
+    @group.command(name="priority")
+    @checks.mod_or_permissions(manage_messages=True)
+    async def _priority_command(self, ctx, priority: int = None):
+        """
+        Set the order this rule is checked in, lower runs first.
+
+        Rules that need the network (image detection) always run after the others, all at once.
+        Once a rule kicks, bans or deletes the message the remaining rules are skipped.
+        """
+        rule = getattr(self, name)
+        if priority is None:
+            current = await rule.get_priority(ctx.guild)
+            return await ctx.send(f"{name} has a priority of `{current}`.")
+
+        before, after = await rule.set_priority(ctx.guild, priority)
+        await ctx.send(f"Priority set from `{before}` to `{after}`")
+
+    return _priority_command
+
+
 def add_channel_wrapper(group, name, friendly_name):
     @group.command(name="channels")
     @checks.mod_or_permissions(manage_messages=True)
@@ -931,6 +1638,21 @@ def settings_wrapper(group, name, friendly_name):
     return _invoke_settings
 
 
+whitelist_kind_wrappers = {
+    "user": (
+        whitelistuser_wrapper,
+        whitelistuser_add_wrapper,
+        whitelistuser_delete_wrapper,
+        whitelistuser_show_wrapper,
+    ),
+    "channel": (
+        whitelistchannel_wrapper,
+        whitelistchannel_add_wrapper,
+        whitelistchannel_delete_wrapper,
+        whitelistchannel_show_wrapper,
+    ),
+}
+
 for name, friendly_name in groups.items():
     group = getattr(GroupCommands, name)
 
@@ -966,11 +1688,31 @@ for name, friendly_name in groups.items():
     whitelistrole_add.__name__ = f"whitelistrole_add_{name}"
     setattr(GroupCommands, f"whitelistrole_add_{name}", whitelistrole_add)
 
+    # whitelist group
+    for sub_name, sub_wrapper in (
+        ("bulk_add", whitelistrole_bulk_add_wrapper),
+        ("bulk_delete", whitelistrole_bulk_delete_wrapper),
+    ):
+        command = sub_wrapper(whitelistrole, name, friendly_name)
+        command.__name__ = f"whitelistrole_{sub_name}_{name}"
+        setattr(GroupCommands, f"whitelistrole_{sub_name}_{name}", command)
+
     # whitelist group
     whitelistrole_show = whitelistrole_show_wrapper(whitelistrole, name, friendly_name)
     whitelistrole_show.__name__ = f"whitelistrole_show_{name}"
     setattr(GroupCommands, f"whitelistrole_show_{name}", whitelistrole_show)
 
+    # user and channel whitelists share the same add/delete/show layout
+    for kind, (kind_group_wrapper, *sub_wrappers) in whitelist_kind_wrappers.items():
+        whitelist_group = kind_group_wrapper(group, name, friendly_name)
+        whitelist_group.__name__ = f"whitelist{kind}_{name}"
+        setattr(GroupCommands, f"whitelist{kind}_{name}", whitelist_group)
+
+        for sub_name, sub_wrapper in zip(("add", "delete", "show"), sub_wrappers):
+            command = sub_wrapper(whitelist_group, name, friendly_name)
+            command.__name__ = f"whitelist{kind}_{sub_name}_{name}"
+            setattr(GroupCommands, f"whitelist{kind}_{sub_name}_{name}", command)
+
     """
     Rule specific announce Settings
     """
@@ -994,6 +1736,10 @@ for name, friendly_name in groups.items():
     add_role.__name__ = f"add_role_{name}"
     setattr(GroupCommands, f"add_role_{name}", add_role)
 
+    priority = priority_wrapper(group, name, friendly_name)
+    priority.__name__ = f"priority_{name}"
+    setattr(GroupCommands, f"priority_{name}", priority)
+
     add_channel = add_channel_wrapper(group, name, friendly_name)
     add_channel.__name__ = f"add_channel_{name}"
     setattr(GroupCommands, f"add_channel_{name}", add_channel)
@@ -0,0 +1,73 @@
+from collections import defaultdict
+from typing import Iterable, Optional, Set, Tuple
+
+HASH_BITS = 64
+# above this the chunks get narrower than a byte and nearly every chunk collides,
+# making lookups close to a linear scan
+MAX_DISTANCE = HASH_BITS // 8 - 1
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class HammingIndex:
+    """
+    Multi-index hash table for 64 bit hashes.
+
+    The hash is split into `max_distance + 1` chunks, by the pigeonhole principle two hashes
+    within `max_distance` bits of each other share at least one chunk exactly. So a lookup only
+    compares against hashes that collide on a chunk instead of the whole list.
+
+    Raises ValueError if `max_distance` is above `MAX_DISTANCE`.
+    """
+
+    def __init__(self, hashes: Iterable[int], max_distance: int):
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f"Distance must be between 0 and {MAX_DISTANCE}.")
+        self.max_distance = max_distance
+        self.hashes = frozenset(hashes)
+
+        chunks = max_distance + 1
+        size, extra = divmod(HASH_BITS, chunks)
+        self._chunks = []  # (shift, mask)
+        shift = 0
+        for index in range(chunks):
+            bits = size + (1 if index < extra else 0)
+            self._chunks.append((shift, (1 << bits) - 1))
+            shift += bits
+
+        self._tables = [defaultdict(set) for _ in self._chunks]
+        for value in self.hashes:
+            for table, (shift, mask) in zip(self._tables, self._chunks):
+                table[(value >> shift) & mask].add(value)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __bool__(self):
+        return bool(self.hashes)
+
+    def nearest(self, value: int) -> Optional[Tuple[int, int]]:
+        """
+        Find the closest indexed hash within `max_distance`
+        Returns
+        -------
+        (hash, distance) or None if nothing is close enough
+        """
+        if value in self.hashes:
+            return value, 0
+
+        best = None
+        for candidate in self.candidates(value):
+            distance = hamming_distance(value, candidate)
+            if distance <= self.max_distance and (best is None or distance < best[1]):
+                best = (candidate, distance)
+        return best
+
+    def candidates(self, value: int) -> Set[int]:
+        """Indexed hashes sharing a chunk with value, the only ones that can be close enough"""
+        found = set()
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            found.update(table.get((value >> shift) & mask, ()))
+        return found
@@ -4,19 +4,29 @@ __author__ = ("Bread#0007", 280730525960896513)
 __credits__ = ["xBlynd"]
 __status__ = "Production"
 
+import asyncio
 import dataclasses
+from typing import Optional
 
 import discord
 import logging
 
 from redbot.core.commands import Cog
 from redbot.core import Config
-from redbot.core.data_manager import bundled_data_path
+from redbot.core.data_manager import bundled_data_path, cog_data_path
 
 from .rules.allowedextensions import AllowedExtensionsRule
+from .rules.regexfilter import RegexRule
 
 from .rules.config.models import InfractionInformation
-from .rules.imagedetection import ImageDetectionRule
+from .actions import ActionExecutor, DryRunBackend
+from .announcements import AnnouncementBuffer, PendingAnnouncement
+from .analysis import MessageAnalysis, inserted_text
+from .cache import SettingsCache, VerdictMemo
+from .metrics import Metrics
+from .pipeline import PipelineCache, GuildPipeline, RuleSnapshot
+from .rules.imagedetection import ImageDetectionRule, VERDICT_FILE
+from .rules.perceptualhash import PerceptualHashRule
 from .rules.wordfilter import WordFilterRule
 from .rules.wallspam import WallSpamRule
 from .rules.mentionspam import MentionSpamRule
@@ -29,7 +39,6 @@ from .constants import *
 from .groupcommands import GroupCommands
 
 from .settings import Settings
-from .utils import maybe_add_role
 
 log = logging.getLogger(name="red.breadcogs.automod")
 
@@ -57,21 +66,33 @@ class AutoMod(
             MaxCharsRule.__class__.__name__: DEFAULT_OPTIONS,
             WordFilterRule.__class__.__name__: DEFAULT_OPTIONS,
             ImageDetectionRule.__class__.__name__: DEFAULT_OPTIONS,
+            PerceptualHashRule.__class__.__name__: DEFAULT_OPTIONS,
+            RegexRule.__class__.__name__: DEFAULT_OPTIONS,
         }
 
         self.config.register_guild(**self.guild_defaults)
+        self.config.register_global(
+            persist_image_verdicts=False,
+            settings_cache_size=SETTINGS_CACHE_SIZE,
+            dry_run_actions=False,
+        )
         self.data_path = bundled_data_path(self)
+        self.setup_rules()
 
+    def setup_rules(self):
+        """Build the rules, their caches and metrics, needs `config`, `bot` and `data_path` set"""
         # rules
         self.wallspamrule = WallSpamRule(self.config)
         self.mentionspamrule = MentionSpamRule(self.config)
-        self.inviterule = DiscordInviteRule(self.config)
+        self.inviterule = DiscordInviteRule(self.config, self.bot)
         self.spamrule = SpamRule(self.config, self.bot, self.data_path)
         self.maxwordsrule = MaxWordsRule(self.config)
         self.maxcharsrule = MaxCharsRule(self.config)
         self.wordfilterrule = WordFilterRule(self.config)
+        self.perceptualhashrule = PerceptualHashRule(self.config)
         self.imagedetectionrule = ImageDetectionRule(self.config)
         self.allowedextensionsrule = AllowedExtensionsRule(self.config)
+        self.regexrule = RegexRule(self.config)
 
         self.rules_map = {
             "wallspamrule": self.wallspamrule,
@@ -81,25 +102,69 @@ class AutoMod(
             "maxwordsrule": self.maxwordsrule,
             "maxcharsrule": self.maxcharsrule,
             "wordfilterrule": self.wordfilterrule,
+            "perceptualhashrule": self.perceptualhashrule,
             "imagedetectionrule": self.imagedetectionrule,
             "allowedextensionsrule": self.allowedextensionsrule,
+            "regexrule": self.regexrule,
         }
 
+        self.pipeline_cache = PipelineCache(self.config, self.rules_map)
+        self.settings_cache = SettingsCache(self.config, maxsize=SETTINGS_CACHE_SIZE)
+        self.verdict_memo = VerdictMemo()
+        # message id -> [content last checked, latest edit], see `on_message_edit`
+        self._pending_edits = {}
+        self._edit_tasks = {}
+        self.edit_debounce = EDIT_DEBOUNCE
+        for rule in self.rules_map.values():
+            rule.pipeline_cache = self.pipeline_cache
+            rule.settings_cache = self.settings_cache
+        self.metrics = Metrics()
+        self.action_executor = ActionExecutor(self.metrics)
+        self.announcements = AnnouncementBuffer(self.metrics)
+
+    async def initialize(self):
+        self.settings_cache.resize(await self.config.settings_cache_size())
+        if await self.config.dry_run_actions():
+            self.action_executor.backend = DryRunBackend()
+        if await self.config.persist_image_verdicts():
+            await self.imagedetectionrule.load_verdicts(cog_data_path(self) / VERDICT_FILE)
+
+    def cog_unload(self):
+        for task in self._edit_tasks.values():
+            task.cancel()
+        self.regexrule.close()
+        self.bot.loop.create_task(self.imagedetectionrule.close())
+        self.bot.loop.create_task(self._close_actions())
+
+    async def _close_actions(self):
+        self.spamrule.close()
+        await self.action_executor.close()
+        # announcements are queued by the executor's tasks, so they go last
+        await self.announcements.close()
+
     async def _take_action(
-        self, rule, message: discord.Message, is_offensive: InfractionInformation = None
+        self,
+        pipeline: GuildPipeline,
+        rule,
+        message: discord.Message,
+        is_offensive: InfractionInformation = None,
     ):
         guild: discord.Guild = message.guild
         author: discord.Member = message.author
         channel: discord.TextChannel = message.channel
 
-        action_to_take = await rule.get_action_to_take(guild)
+        snapshot: RuleSnapshot = pipeline.rules[rule.rule_name]
+        action_to_take = snapshot.action_to_take
         self.bot.dispatch(f"automod_{rule.rule_name}", author, message)
         self.bot.dispatch(
             f"bread_automod",
             rule.rule_name,
             author,
             message,
-            dataclasses.asdict(is_offensive) if is_offensive else None,
+            # the rule holds its caches, which can't be deep copied - its name is already sent
+            dataclasses.asdict(dataclasses.replace(is_offensive, rule=None))
+            if is_offensive
+            else None,
         )
         log.info(
             f"{rule.rule_name} - {author} ({author.id}) - {guild} ({guild.id}) - {channel} ({channel.id})"
@@ -107,106 +172,106 @@ class AutoMod(
 
         _action_reason = f"[AutoMod] {rule.rule_name}"
 
-        should_delete = await rule.get_should_delete(guild)
-        message_has_been_deleted = False
-        if should_delete:
-            try:
-                await message.delete()
-                message_has_been_deleted = True
-            except discord.errors.Forbidden:
-                log.warning(f"[AutoMod] {rule.rule_name} - Missing permissions to delete message")
-            except discord.errors.NotFound:
-                message_has_been_deleted = True
-                log.warning(
-                    f"[AutoMod] {rule.rule_name} - Could not delete message as it does not exist"
-                )
-        action_taken_success = True
-        if action_to_take == "kick":
-            try:
-                await author.kick(reason=_action_reason)
-                log.info(f"{rule.rule_name} - Kicked {author} ({author.id})")
-            except discord.errors.Forbidden:
-                log.warning(f"{rule.rule_name} - Failed to kick user, missing permissions")
-                action_taken_success = False
+        # queued, the executor sends them in the background so the listener can return
+        deleted = None
+        if snapshot.delete_message:
+            deleted = self.action_executor.delete(message, rule.rule_name)
 
+        punished = None
+        if action_to_take in ("kick", "ban"):
+            punished = self.action_executor.punish(
+                action_to_take, guild, author, rule.rule_name, _action_reason
+            )
         elif action_to_take == "add_role":
-            try:
-                role = guild.get_role(
-                    await self.config.guild(guild).get_raw(rule.rule_name, "role_to_add",)
-                )
-                await maybe_add_role(
-                    author, role,
-                )
-                log.info(f"{rule.rule_name} - Added Role (role) to {author} ({author.id})")
-            except KeyError:
+            role = guild.get_role(snapshot.role_to_add) if snapshot.role_to_add else None
+            if role is None:
                 # role to add not set
                 log.info(f"{rule.rule_name} No role set to add to offending user")
-                action_taken_success = False
-
-        elif action_to_take == "ban":
-            try:
-                await guild.ban(
-                    user=author, reason=_action_reason, delete_message_days=1,
+                punished = asyncio.get_event_loop().create_future()
+                punished.set_result(False)
+            else:
+                punished = self.action_executor.punish(
+                    action_to_take, guild, author, rule.rule_name, _action_reason, role=role
                 )
-                log.info(f"{rule.rule_name} - Banned {author} ({author.id})")
-            except discord.errors.Forbidden:
-                log.warning(f"{rule.rule_name} - Failed to ban user, missing permissions")
-                action_taken_success = False
-            except discord.errors.HTTPException:
-                log.warning(f"{rule.rule_name} - Failed to ban user [HTTP EXCEPTION]")
-                action_taken_success = False
-
-        announce_embed = await rule.get_announcement_embed(
-            message, message_has_been_deleted, action_taken_success, action_to_take, is_offensive,
-        )
-        await self.maybe_send_announcement(guild, rule, announce_embed)
-
-    async def maybe_send_announcement(
-        self, guild: discord.Guild, rule, announce_embed: discord.Embed
-    ) -> None:
-        """
-        Method to send announcements to channel depending on settings. Can be local to the rule, or global.
-        Parameters
-        ----------
-        guild
-            The guild where infraction was found.
-        rule
-            The rule triggered.
-        announce_embed
-            Announcement embed
-        """
-        try:
-            announce_channel = None
 
-            should_announce_global, announce_channel_id = await self.announcements_enabled(
-                guild=guild
+        announce_channel_id = pipeline.get_announce_channel_id(snapshot)
+        if announce_channel_id is not None:
+            self.action_executor.spawn(
+                self._announce_action(
+                    rule,
+                    message,
+                    action_to_take,
+                    announce_channel_id,
+                    is_offensive,
+                    deleted,
+                    punished,
+                )
             )
-            if should_announce_global and announce_channel_id is not None:
-                announce_channel = guild.get_channel(announce_channel_id)
-
-            rule_specific_announce_channel = await rule.get_specific_announce_channel(guild)
-            if rule_specific_announce_channel is not None:
-                announce_channel = rule_specific_announce_channel
 
-            if announce_channel is None:
-                return  # not Announcing
+    async def _announce_action(
+        self,
+        rule,
+        message: discord.Message,
+        action_to_take: str,
+        announce_channel_id: int,
+        is_offensive: Optional[InfractionInformation],
+        deleted: Optional[asyncio.Future],
+        punished: Optional[asyncio.Future],
+    ):
+        """Announce an infraction once the executor has finished acting on it"""
+        announcement = PendingAnnouncement(
+            rule=rule,
+            message=message,
+            action_to_take=action_to_take,
+            message_has_been_deleted=await deleted if deleted is not None else False,
+            action_taken_success=await punished if punished is not None else True,
+            infraction_information=is_offensive,
+        )
+        await self.announcements.announce(message.guild, announce_channel_id, announcement)
 
-            return await announce_channel.send(embed=announce_embed)
-        except discord.errors.Forbidden:
-            log.exception(f"Missing permissions to send messages")
-        except discord.errors.NotFound:
-            log.exception(f"Could not send announce embed as channel was deleted")
+    @Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        # joins only count towards the spam rule's raid detection
+        pipeline = await self.pipeline_cache.get(member.guild)
+        snapshot = pipeline.rules[self.spamrule.rule_name]
+        if snapshot.is_enabled:
+            self.spamrule.record_join(member, snapshot)
 
     @Cog.listener()
     async def on_message_edit(
         self, before: discord.Message, after: discord.Message,
     ):
-        await self._listen_for_infractions(after)
+        # embeds unfurling, pins and removed attachments are edits too, only new text matters
+        if before.content == after.content:
+            return
+
+        pending = self._pending_edits.get(after.id)
+        if pending is not None:
+            # still settling, only the latest version is checked
+            pending[1] = after
+            return
+        self._pending_edits[after.id] = [before.content, after]
+        self._edit_tasks[after.id] = asyncio.ensure_future(self._check_edit_later(after.id))
+
+    async def _check_edit_later(self, message_id: int):
+        await asyncio.sleep(self.edit_debounce)
+        self._edit_tasks.pop(message_id, None)
+        checked_content, after = self._pending_edits.pop(message_id)
+        if after.content != checked_content:
+            await self._listen_for_infractions(
+                after, inserted=inserted_text(checked_content, after.content)
+            )
 
     @Cog.listener(name="on_message_without_command")
     async def _listen_for_infractions(
-        self, message: discord.Message,
+        self, message: discord.Message, inserted: Optional[str] = None,
     ):
+        """
+        Run the enabled rules over a message
+
+        `inserted` is given for edits, only rules that look at the content run again
+        and the filters only look at the text that was inserted.
+        """
         guild = message.guild
         author = message.author
 
@@ -226,18 +291,151 @@ class AutoMod(
         if message.author.bot:
             return
 
-        for (rule_name, rule,) in self.rules_map.items():
-            if await rule.is_enabled(guild):
-                # check all if roles - if any are immune, then that's okay, we'll let them spam :)
-                is_whitelisted_role = await rule.role_is_whitelisted(guild, author.roles,)
-                is_channel_or_global = await rule.is_enforced_channel(guild, message.channel,)
-                if is_whitelisted_role or not is_channel_or_global:
-                    # user is whitelisted, channel is not whitelisted let's stop here
-                    return
-
-                is_offensive = await rule.is_offensive(message)
-                if is_offensive:
-                    if isinstance(is_offensive, InfractionInformation):
-                        await self._take_action(rule, message, is_offensive)
-                    else:
-                        await self._take_action(rule, message)
+        # compiled once per guild, no config reads from here on
+        pipeline = await self.pipeline_cache.get(guild)
+        role_ids = [role.id for role in author.roles]
+        # content is only scanned as far as the enabled rules need, and only once
+        analysis = MessageAnalysis(message.content)
+        inserted_analysis = None
+        if inserted is not None:
+            inserted_analysis = MessageAnalysis(inserted)
+
+        io_bound_rules = []
+        for (rule, snapshot,) in pipeline.enabled_rules:
+            # whitelisted user, role or channel, or the rule isn't enforced here - skip this rule
+            if snapshot.is_exempt(author.id, role_ids, message.channel.id):
+                continue
+
+            # attachments can't be added by an edit and rate limits already saw the message
+            if inserted is not None and not rule.is_stateless:
+                continue
+
+            if rule.is_io_bound:
+                io_bound_rules.append((rule, snapshot))
+                continue
+
+            # cheap rules run one by one, in priority order
+            is_offensive = await self._evaluate_for(
+                rule, snapshot, message, analysis, pipeline, inserted_analysis
+            )
+            if await self._handle_verdict(pipeline, rule, message, is_offensive):
+                return
+
+        if io_bound_rules:
+            await self._evaluate_concurrently(
+                pipeline, message, analysis, io_bound_rules, inserted_analysis
+            )
+
+    def _evaluate_for(
+        self,
+        rule,
+        snapshot: RuleSnapshot,
+        message: discord.Message,
+        analysis: MessageAnalysis,
+        pipeline: GuildPipeline,
+        inserted_analysis: Optional[MessageAnalysis] = None,
+    ):
+        """`_evaluate` for a new message, or an edit if `inserted_analysis` is given"""
+        if inserted_analysis is None:
+            return self._evaluate(rule, snapshot, message, analysis, pipeline)
+        # verdicts on part of a message aren't memoized
+        if rule.scans_inserted_text:
+            return self._evaluate(rule, snapshot, message, inserted_analysis)
+        return self._evaluate(rule, snapshot, message, analysis)
+
+    async def _evaluate(
+        self,
+        rule,
+        snapshot: RuleSnapshot,
+        message: discord.Message,
+        analysis: MessageAnalysis,
+        pipeline: GuildPipeline = None,
+    ):
+        """
+        Run a rule's check, recording how long it took and whether it fired or failed
+
+        Stateless rules are only run once per content until the guild's settings change,
+        pass the pipeline to use the memo.
+        """
+        start = self.metrics.timer()
+        memo_key = None
+        if pipeline is not None and rule.is_stateless:
+            memo_key = (rule.rule_name, rule.memo_key(message, analysis))
+            is_offensive = self.verdict_memo.get(pipeline.guild_id, pipeline.version, memo_key)
+            if is_offensive is not None:
+                self.metrics.record_evaluation(
+                    message.guild.id,
+                    rule.rule_name,
+                    self.metrics.timer() - start,
+                    bool(is_offensive),
+                )
+                return is_offensive
+
+        try:
+            is_offensive = await rule.is_offensive(message, snapshot, analysis)
+        except Exception:
+            self.metrics.record_evaluation(
+                message.guild.id, rule.rule_name, self.metrics.timer() - start, False, error=True
+            )
+            log.exception(f"{rule.rule_name} - Failed to check message")
+            return None
+
+        self.metrics.record_evaluation(
+            message.guild.id, rule.rule_name, self.metrics.timer() - start, bool(is_offensive)
+        )
+        if (
+            memo_key is not None
+            and is_offensive is not None
+            and rule.is_memoizable(message, snapshot, analysis)
+        ):
+            self.verdict_memo.set(pipeline.guild_id, pipeline.version, memo_key, is_offensive)
+        return is_offensive
+
+    async def _handle_verdict(self, pipeline: GuildPipeline, rule, message, is_offensive) -> bool:
+        """
+        Take action if the rule found the message offensive
+        Returns
+        -------
+        bool
+            True if the action taken means no other rule needs to run
+        """
+        if not is_offensive:
+            return False
+
+        if isinstance(is_offensive, InfractionInformation):
+            await self._take_action(pipeline, rule, message, is_offensive)
+        else:
+            await self._take_action(pipeline, rule, message)
+        return pipeline.rules[rule.rule_name].is_terminating
+
+    async def _evaluate_concurrently(
+        self,
+        pipeline: GuildPipeline,
+        message: discord.Message,
+        analysis: MessageAnalysis,
+        rules: [tuple],
+        inserted_analysis: Optional[MessageAnalysis] = None,
+    ) -> None:
+        """
+        Run slow rules at the same time, acting on each as it finishes.
+
+        Outstanding checks are cancelled as soon as a terminating action is taken.
+        """
+        tasks = {}
+        for priority, (rule, snapshot) in enumerate(rules):
+            task = asyncio.ensure_future(
+                self._evaluate_for(rule, snapshot, message, analysis, pipeline, inserted_analysis)
+            )
+            tasks[task] = (priority, rule)
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda t: tasks[t][0]):
+                    # errors are already logged and counted by _evaluate
+                    _, rule = tasks[task]
+                    if await self._handle_verdict(pipeline, rule, message, task.result()):
+                        return
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,247 @@
+import json
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# upper bounds in seconds, from a cheap regex up to a slow Azure request
+LATENCY_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    float("inf"),
+)
+
+
+class LatencyHistogram:
+    """Fixed bucket histogram, cumulative counts are only built when exported"""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Estimate, interpolated inside the bucket the quantile falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, bucket_count in zip(LATENCY_BUCKETS, self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return lower
+
+    def cumulative(self) -> Iterator[Tuple[float, int]]:
+        running = 0
+        for upper, bucket_count in zip(LATENCY_BUCKETS, self.counts):
+            running += bucket_count
+            yield upper, running
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.mean,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+@dataclass
+class RuleMetrics:
+    evaluations: int = 0
+    triggers: int = 0
+    errors: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+@dataclass
+class ActionMetrics:
+    successes: int = 0
+    failures: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+class ActionOutcome:
+    """Handed out by `Metrics.measure_action`, set `success` to False if the action failed"""
+
+    __slots__ = ("success",)
+
+    def __init__(self):
+        self.success = True
+
+
+class Metrics:
+    """
+    Counters and latency histograms per guild and rule.
+
+    Everything lives in memory and resets with the cog, export it with `to_json`
+    or `to_prometheus` to keep it.
+    """
+
+    def __init__(self, timer=time.perf_counter):
+        self.timer = timer
+        self.started_at = time.time()
+        self.rules: Dict[Tuple[int, str], RuleMetrics] = defaultdict(RuleMetrics)
+        # (guild id, rule name, action) -> metrics
+        self.actions: Dict[Tuple[int, str, str], ActionMetrics] = defaultdict(ActionMetrics)
+
+    def record_evaluation(
+        self, guild_id: int, rule_name: str, seconds: float, triggered: bool, error: bool = False
+    ) -> None:
+        metrics = self.rules[(guild_id, rule_name)]
+        metrics.evaluations += 1
+        metrics.latency.observe(seconds)
+        if error:
+            metrics.errors += 1
+        elif triggered:
+            metrics.triggers += 1
+
+    def record_action(
+        self, guild_id: int, rule_name: str, action: str, seconds: float, success: bool
+    ) -> None:
+        metrics = self.actions[(guild_id, rule_name, action)]
+        if success:
+            metrics.successes += 1
+        else:
+            metrics.failures += 1
+        metrics.latency.observe(seconds)
+
+    @contextmanager
+    def measure_action(self, guild_id: int, rule_name: str, action: str):
+        """Time an action, it counts as failed if it raises"""
+        outcome = ActionOutcome()
+        start = self.timer()
+        try:
+            yield outcome
+        except Exception:
+            outcome.success = False
+            raise
+        finally:
+            self.record_action(guild_id, rule_name, action, self.timer() - start, outcome.success)
+
+    def reset(self) -> None:
+        self.rules.clear()
+        self.actions.clear()
+        self.started_at = time.time()
+
+    def rule_rows(self, guild_id: Optional[int] = None) -> List[Tuple[int, str, RuleMetrics]]:
+        return sorted(
+            (key[0], key[1], metrics)
+            for key, metrics in self.rules.items()
+            if guild_id is None or key[0] == guild_id
+        )
+
+    def action_rows(
+        self, guild_id: Optional[int] = None
+    ) -> List[Tuple[int, str, str, ActionMetrics]]:
+        return sorted(
+            (*key, metrics)
+            for key, metrics in self.actions.items()
+            if guild_id is None or key[0] == guild_id
+        )
+
+    def snapshot(self, guild_id: Optional[int] = None) -> dict:
+        """Plain dict of everything recorded, for one guild or all of them"""
+        return {
+            "started_at": self.started_at,
+            "rules": [
+                {
+                    "guild_id": rule_guild_id,
+                    "rule": rule_name,
+                    "evaluations": metrics.evaluations,
+                    "triggers": metrics.triggers,
+                    "errors": metrics.errors,
+                    "latency": metrics.latency.to_dict(),
+                }
+                for rule_guild_id, rule_name, metrics in self.rule_rows(guild_id)
+            ],
+            "actions": [
+                {
+                    "guild_id": action_guild_id,
+                    "rule": rule_name,
+                    "action": action,
+                    "successes": metrics.successes,
+                    "failures": metrics.failures,
+                    "latency": metrics.latency.to_dict(),
+                }
+                for action_guild_id, rule_name, action, metrics in self.action_rows(guild_id)
+            ],
+        }
+
+    def to_json(self, guild_id: Optional[int] = None) -> str:
+        return json.dumps(self.snapshot(guild_id), indent=2)
+
+    def to_prometheus(self, guild_id: Optional[int] = None) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+
+        def header(name: str, kind: str, description: str):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name: str, labels: str, latency: LatencyHistogram):
+            for upper, running in latency.cumulative():
+                le = "+Inf" if upper == float("inf") else repr(upper)
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {running}')
+            lines.append(f"{name}_sum{{{labels}}} {latency.total!r}")
+            lines.append(f"{name}_count{{{labels}}} {latency.count}")
+
+        rule_rows = self.rule_rows(guild_id)
+        for name, attribute, description in (
+            ("automod_rule_evaluations_total", "evaluations", "Messages checked by the rule"),
+            ("automod_rule_triggers_total", "triggers", "Messages the rule found offensive"),
+            ("automod_rule_errors_total", "errors", "Checks that raised an exception"),
+        ):
+            header(name, "counter", description)
+            for rule_guild_id, rule_name, metrics in rule_rows:
+                labels = f'guild="{rule_guild_id}",rule="{rule_name}"'
+                lines.append(f"{name}{{{labels}}} {getattr(metrics, attribute)}")
+
+        header("automod_rule_latency_seconds", "histogram", "Time spent in is_offensive")
+        for rule_guild_id, rule_name, metrics in rule_rows:
+            labels = f'guild="{rule_guild_id}",rule="{rule_name}"'
+            histogram("automod_rule_latency_seconds", labels, metrics.latency)
+
+        action_rows = self.action_rows(guild_id)
+        header("automod_actions_total", "counter", "Actions taken, by outcome")
+        for action_guild_id, rule_name, action, metrics in action_rows:
+            labels = f'guild="{action_guild_id}",rule="{rule_name}",action="{action}"'
+            for outcome, value in (("success", metrics.successes), ("failure", metrics.failures)):
+                lines.append(f'automod_actions_total{{{labels},outcome="{outcome}"}} {value}')
+
+        header("automod_action_latency_seconds", "histogram", "Time spent taking an action")
+        for action_guild_id, rule_name, action, metrics in action_rows:
+            labels = f'guild="{action_guild_id}",rule="{rule_name}",action="{action}"'
+            histogram("automod_action_latency_seconds", labels, metrics.latency)
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,69 @@
+"""
+Views of message text with the usual filter evasions undone.
+
+`fold_text` undoes width and style tricks (full-width, 𝐛𝐨𝐥𝐝 and ⓒⓘⓡⓒⓛⓔⓓ letters), look-alike
+letters from other scripts, accents stacked on letters and invisible characters, keeping case.
+`normalize_text` is that, casefolded. The tables are built once at import and ASCII text,
+most messages, skips all of it.
+"""
+import unicodedata
+from itertools import chain
+
+# characters that render as nothing, dropped
+INVISIBLE_CHARS = "".join(
+    chain(
+        "\u00ad\u034f\u061c\u115f\u1160\u17b4\u17b5\u180e\u3164\ufeff\uffa0",
+        map(chr, range(0x200B, 0x2010)),  # zero width spaces, joiners and marks
+        map(chr, range(0x202A, 0x202F)),  # bidirectional embeddings and overrides
+        map(chr, range(0x2060, 0x2065)),  # word joiner and invisible operators
+        map(chr, range(0x2066, 0x206A)),  # bidirectional isolates
+        map(chr, range(0xFE00, 0xFE10)),  # variation selectors
+    )
+)
+
+# letters that look like latin ones in most fonts, and aren't folded by NFKC
+# fmt: off
+CONFUSABLES = {
+    # cyrillic
+    "а": "a", "в": "b", "с": "c", "ԁ": "d", "е": "e", "һ": "h", "і": "i", "ј": "j", "к": "k",
+    "ӏ": "l", "о": "o", "р": "p", "ԛ": "q", "ѕ": "s", "у": "y", "х": "x", "ԝ": "w",
+    "А": "A", "В": "B", "С": "C", "Е": "E", "Н": "H", "І": "I", "Ј": "J", "К": "K",
+    "М": "M", "О": "O", "Р": "P", "Ѕ": "S", "Т": "T", "Х": "X", "У": "Y",
+    # greek
+    "α": "a", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p", "τ": "t", "υ": "u",
+    "χ": "x", "ϲ": "c",
+    "Α": "A", "Β": "B", "Ε": "E", "Ζ": "Z", "Η": "H", "Ι": "I", "Κ": "K", "Μ": "M",
+    "Ν": "N", "Ο": "O", "Ρ": "P", "Τ": "T", "Υ": "Y", "Χ": "X",
+    # latin
+    "ı": "i", "ɑ": "a", "ɡ": "g",
+}
+# fmt: on
+
+# accents and other combining marks, there are none past U+1F000
+COMBINING_MARKS = (
+    chr(codepoint) for codepoint in range(0x300, 0x1F000) if unicodedata.combining(chr(codepoint))
+)
+CONFUSABLES_TABLE = str.maketrans(CONFUSABLES)
+FOLD_TABLE = str.maketrans(
+    {**CONFUSABLES, **dict.fromkeys(chain(INVISIBLE_CHARS, COMBINING_MARKS))}
+)
+
+
+def fold_text(text: str) -> str:
+    """NFKC, look-alikes mapped to latin, accents and invisible characters removed, case kept"""
+    if text.isascii():
+        return text
+    # decomposed so accents are separate characters that can be dropped
+    folded = unicodedata.normalize("NFKD", text).translate(FOLD_TABLE)
+    if folded.isascii():
+        return folded
+    return unicodedata.normalize("NFC", folded)
+
+
+def normalize_text(text: str) -> str:
+    """`fold_text` casefolded, what text filters match against"""
+    folded = fold_text(text)
+    if folded.isascii():
+        return folded.lower()
+    # casefolding can turn capitals the table doesn't cover into lowercase ones it does
+    return folded.casefold().translate(CONFUSABLES_TABLE)
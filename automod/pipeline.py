@@ -0,0 +1,205 @@
+from collections import defaultdict
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import Mapping, Optional, FrozenSet, Tuple, Iterable
+
+import discord
+
+from .channelgroups import EMPTY_CHANNEL_GROUPS, ChannelGroupIndex, compile_channel_groups
+from .constants import DEFAULT_ACTION, DEFAULT_PRIORITY, TERMINATING_ACTIONS
+
+
+@dataclass(frozen=True)
+class RuleSnapshot:
+    """Everything the listener needs to know about one rule in one guild, read once from config"""
+
+    rule_name: str
+    is_enabled: bool
+    enforced_channels: FrozenSet[int]
+    whitelisted_roles: FrozenSet[int]
+    whitelisted_users: FrozenSet[int]
+    whitelisted_channels: FrozenSet[int]
+    action_to_take: str
+    delete_message: bool
+    role_to_add: Optional[int]
+    announce_channel_id: Optional[int]
+    priority: int = DEFAULT_PRIORITY
+    options: Mapping = field(default_factory=lambda: MappingProxyType({}))
+    # channel groups the rule's settings refer to by name, resolved with `channel_groups`
+    groups: FrozenSet[str] = frozenset()
+    channel_groups: ChannelGroupIndex = EMPTY_CHANNEL_GROUPS
+
+    @property
+    def is_terminating(self) -> bool:
+        """Whether acting on this rule removes the message or the author"""
+        return self.delete_message or self.action_to_take in TERMINATING_ACTIONS
+
+    def is_enforced_channel(self, channel_id: int) -> bool:
+        # no channels set means the rule is global
+        return not self.enforced_channels or channel_id in self.enforced_channels
+
+    def role_is_whitelisted(self, role_ids: Iterable[int]) -> bool:
+        return not self.whitelisted_roles.isdisjoint(role_ids)
+
+    def is_exempt(self, author_id: int, role_ids: Iterable[int], channel_id: int) -> bool:
+        """Whether this rule should skip a message, set lookups only"""
+        return (
+            author_id in self.whitelisted_users
+            or channel_id in self.whitelisted_channels
+            or not self.is_enforced_channel(channel_id)
+            or self.role_is_whitelisted(role_ids)
+        )
+
+
+@dataclass(frozen=True)
+class GuildPipeline:
+    """Immutable, compiled view of a guild's AutoMod settings"""
+
+    guild_id: int
+    version: int
+    is_announcement_enabled: bool
+    announcement_channel_id: Optional[int]
+    rules: Mapping  # rule_name -> RuleSnapshot
+    # ((rule, RuleSnapshot), ...), cheap rules first then by priority, ties in rules_map order
+    enabled_rules: Tuple
+    channel_groups: ChannelGroupIndex = EMPTY_CHANNEL_GROUPS
+
+    def get_announce_channel_id(self, snapshot: RuleSnapshot) -> Optional[int]:
+        """Rule specific announce channel takes precedent over the global one"""
+        if snapshot.announce_channel_id is not None:
+            return snapshot.announce_channel_id
+        if self.is_announcement_enabled:
+            return self.announcement_channel_id
+        return None
+
+
+def compile_rule_snapshot(
+    rule,
+    rule_settings: dict,
+    guild_settings: dict,
+    channel_groups: ChannelGroupIndex = EMPTY_CHANNEL_GROUPS,
+) -> RuleSnapshot:
+    """
+    Build a snapshot for a single rule from its raw config blob
+    Parameters
+    ----------
+    rule
+        The rule instance, used for its name and `compile_options` hook
+    rule_settings
+        The raw config dict stored under the rule's name
+    guild_settings
+        The raw config dict stored under `settings`
+    channel_groups
+        The guild's compiled channel groups
+    """
+    return RuleSnapshot(
+        rule_name=rule.rule_name,
+        is_enabled=bool(rule_settings.get("is_enabled", False)),
+        enforced_channels=frozenset(rule_settings.get("enforced_channels") or []),
+        whitelisted_roles=frozenset(rule_settings.get("whitelist_roles") or []),
+        whitelisted_users=frozenset(rule_settings.get("whitelist_users") or []),
+        whitelisted_channels=frozenset(rule_settings.get("whitelist_channels") or []),
+        action_to_take=rule_settings.get("action_to_take") or DEFAULT_ACTION,
+        delete_message=bool(rule_settings.get("delete_message", False)),
+        role_to_add=rule_settings.get("role_to_add"),
+        announce_channel_id=rule_settings.get("rule_specific_announce"),
+        priority=rule_settings.get("priority", DEFAULT_PRIORITY),
+        options=MappingProxyType(rule.compile_options(rule_settings, guild_settings)),
+        groups=frozenset(rule.referenced_groups(rule_settings)),
+        channel_groups=channel_groups,
+    )
+
+
+class PipelineCache:
+    """
+    Holds one compiled `GuildPipeline` per guild.
+
+    Pipelines are built lazily with a single config read and dropped whenever
+    a setting for that guild is written, the next message rebuilds it.
+    """
+
+    def __init__(self, config, rules_map: dict):
+        self.config = config
+        self.rules_map = rules_map
+        self._pipelines = {}
+        self._versions = defaultdict(int)
+
+    def invalidate(self, guild: discord.Guild) -> None:
+        """Drop the compiled pipeline for a guild"""
+        self._versions[guild.id] += 1
+        self._pipelines.pop(guild.id, None)
+
+    def update_channel_groups(self, guild: discord.Guild, channel_groups: dict) -> None:
+        """
+        Swap in a guild's new channel groups, called after they are written to config.
+
+        Rules are compiled against group names, so nothing is recompiled. Only the
+        snapshots of rules that refer to a changed group are given the new groups.
+        """
+        self._versions[guild.id] += 1
+        pipeline = self._pipelines.get(guild.id)
+        if pipeline is None:
+            return
+
+        index = compile_channel_groups(channel_groups)
+        changed = pipeline.channel_groups.changed(index)
+        rules = {
+            rule_name: snapshot
+            if snapshot.groups.isdisjoint(changed)
+            else replace(snapshot, channel_groups=index)
+            for rule_name, snapshot in pipeline.rules.items()
+        }
+        self._pipelines[guild.id] = replace(
+            pipeline,
+            version=self._versions[guild.id],
+            rules=MappingProxyType(rules),
+            enabled_rules=tuple(
+                (rule, rules[rule.rule_name]) for rule, _ in pipeline.enabled_rules
+            ),
+            channel_groups=index,
+        )
+
+    def clear(self) -> None:
+        for guild_id in list(self._pipelines):
+            self._versions[guild_id] += 1
+        self._pipelines.clear()
+
+    async def get(self, guild: discord.Guild) -> GuildPipeline:
+        pipeline = self._pipelines.get(guild.id)
+        if pipeline is not None:
+            return pipeline
+
+        version = self._versions[guild.id]
+        data = await self.config.guild(guild).all()
+        pipeline = self.compile(guild.id, version, data)
+
+        # a setter ran while we were reading config, don't store stale data
+        if self._versions[guild.id] == version:
+            self._pipelines[guild.id] = pipeline
+        return pipeline
+
+    def compile(self, guild_id: int, version: int, data: dict) -> GuildPipeline:
+        """Compile raw guild config into a pipeline, does no I/O"""
+        guild_settings = data.get("settings") or {}
+        channel_groups = compile_channel_groups(guild_settings.get("channel_groups"))
+        rules = {}
+        enabled_rules = []
+        for rule in self.rules_map.values():
+            snapshot = compile_rule_snapshot(
+                rule, data.get(rule.rule_name) or {}, guild_settings, channel_groups
+            )
+            rules[rule.rule_name] = snapshot
+            if snapshot.is_enabled:
+                enabled_rules.append((rule, snapshot))
+
+        return GuildPipeline(
+            guild_id=guild_id,
+            version=version,
+            is_announcement_enabled=bool(guild_settings.get("is_announcement_enabled", False)),
+            announcement_channel_id=guild_settings.get("announcement_channel"),
+            rules=MappingProxyType(rules),
+            enabled_rules=tuple(
+                sorted(enabled_rules, key=lambda r: (r[0].is_io_bound, r[1].priority))
+            ),
+            channel_groups=channel_groups,
+        )
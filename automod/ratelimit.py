@@ -0,0 +1,167 @@
+import sys
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Hashable, Optional
+
+
+@dataclass
+class RateStoreStats:
+    buckets: int
+    max_buckets: int
+    evicted: int
+    expired: int
+    bytes_used: int
+
+
+class SlidingWindowStore:
+    """
+    Sliding window rate limiter with bounded memory.
+
+    Each key keeps at most `rate` timestamps, idle buckets are dropped once they are
+    older than `ttl` and the least recently used bucket is evicted when `max_buckets`
+    is reached.
+    """
+
+    def __init__(self, rate: int, per: float, max_buckets: int = 5000, ttl: float = None):
+        self.rate = rate
+        self.per = per
+        self.max_buckets = max_buckets
+        self.ttl = ttl if ttl is not None else per
+        # key -> deque of timestamps, ordered from least to most recently used
+        self._buckets = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __contains__(self, key: Hashable):
+        return key in self._buckets
+
+    def evict_expired(self, current: float) -> int:
+        """Drop buckets that have not been hit for `ttl` seconds, returns how many were dropped"""
+        dropped = 0
+        cutoff = current - self.ttl
+        buckets = self._buckets
+        while buckets:
+            key, timestamps = next(iter(buckets.items()))
+            if timestamps and timestamps[-1] > cutoff:
+                break
+            del buckets[key]
+            dropped += 1
+        self.expired += dropped
+        return dropped
+
+    def hit(self, key: Hashable, current: float) -> bool:
+        """
+        Record a hit for key
+        Parameters
+        ----------
+        key
+            The bucket key
+        current
+            Timestamp of the hit, in seconds
+
+        Returns
+        -------
+        bool
+            True if key already had `rate` hits inside the window, the hit is not recorded
+        """
+        self.evict_expired(current)
+
+        timestamps: Optional[deque] = self._buckets.get(key)
+        if timestamps is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+            timestamps = self._buckets[key] = deque(maxlen=self.rate)
+        else:
+            self._buckets.move_to_end(key)
+
+        window_start = current - self.per
+        while timestamps and timestamps[0] <= window_start:
+            timestamps.popleft()
+
+        if len(timestamps) >= self.rate:
+            return True
+
+        timestamps.append(current)
+        return False
+
+    def retry_after(self, key: Hashable, current: float) -> float:
+        """Seconds until key has room for another hit, 0 if it has room now"""
+        timestamps: Optional[deque] = self._buckets.get(key)
+        if timestamps is None or len(timestamps) < self.rate:
+            return 0.0
+        return max(0.0, timestamps[0] + self.per - current)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def bytes_used(self) -> int:
+        """Rough size of the store, counts the mapping, keys and timestamp deques"""
+        size = sys.getsizeof(self._buckets)
+        for key, timestamps in self._buckets.items():
+            size += sys.getsizeof(key) + sys.getsizeof(timestamps)
+            if isinstance(key, tuple):
+                size += sum(sys.getsizeof(part) for part in key)
+            size += sum(sys.getsizeof(ts) for ts in timestamps)
+        return size
+
+    def stats(self) -> RateStoreStats:
+        return RateStoreStats(
+            buckets=len(self._buckets),
+            max_buckets=self.max_buckets,
+            evicted=self.evicted,
+            expired=self.expired,
+            bytes_used=self.bytes_used(),
+        )
+
+
+class SlidingWindowCounter:
+    """
+    Counts distinct keys seen in the last `per` seconds, with bounded memory.
+
+    Key by message id to count messages, by author id to count distinct authors.
+    Hits are expected in roughly increasing time order, a hit already outside the
+    window of the latest one is not recorded.
+    """
+
+    def __init__(self, per: float, max_keys: int = 5000):
+        self.per = per
+        self.max_keys = max_keys
+        # key -> timestamp of its last hit, oldest first
+        self._seen = OrderedDict()
+        self._latest = float("-inf")
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _expire(self, current: float) -> None:
+        cutoff = current - self.per
+        seen = self._seen
+        while seen:
+            key, timestamp = next(iter(seen.items()))
+            if timestamp > cutoff:
+                break
+            del seen[key]
+
+    def hit(self, key: Hashable, current: float) -> int:
+        """Record key, returns how many distinct keys are inside the window"""
+        if current <= self._latest - self.per:
+            return len(self._seen)
+        self._latest = max(self._latest, current)
+        self._seen.pop(key, None)
+        self._seen[key] = current
+        self._expire(current)
+        while len(self._seen) > self.max_keys:
+            self._seen.popitem(last=False)
+        return len(self._seen)
+
+    def count(self, current: float) -> int:
+        self._expire(current)
+        return len(self._seen)
+
+    def clear(self) -> None:
+        self._seen.clear()
+        self._latest = float("-inf")
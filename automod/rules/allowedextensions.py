@@ -1,28 +1,90 @@
+from collections import defaultdict
 from os.path import splitext
-from typing import Optional
+from types import MappingProxyType
+from typing import FrozenSet, Iterable, Mapping, Optional
 
 import discord
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from redbot.core.utils.chat_formatting import box
 
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
 from .config.models import InfractionInformation, BlackOrWhiteList
 
 WHITELIST_EXTENSIONS = "whitelist_extensions"
 BLACKLIST_EXTENSIONS = "blacklist_extensions"
+# index key of the extensions set for every channel
+GLOBAL = None
 
 
 @dataclass
 class ExtensionsAndChannels:
     extensions: [str]
     channels: [int]
+    # channel group names, resolved when a message is checked
+    groups: [str] = field(default_factory=list)
+
+    @property
+    def is_global(self) -> bool:
+        return not self.channels and not self.groups
 
 
 def get_message_extensions(message: discord.Message) -> [str]:
-    """Get a list of all attachment extensions in a message"""
-    return [splitext(attachment.filename.lower())[1] for attachment in message.attachments]
+    """Get a list of all attachment extensions in a message, without the period"""
+    return [splitext(attachment.filename.lower())[1][1:] for attachment in message.attachments]
+
+
+@dataclass(frozen=True)
+class ExtensionIndex:
+    """Extensions per channel and per channel group, from one allow or deny list"""
+
+    # channel id -> extensions, `GLOBAL` holds the global ones and every channel includes them
+    channels: Mapping[Optional[int], FrozenSet[str]]
+    # group name -> extensions of the entries for that group
+    groups: Mapping[str, FrozenSet[str]]
+
+    def extensions_for(
+        self, channel_id: int, group_names: Iterable[str] = ()
+    ) -> Optional[FrozenSet[str]]:
+        """The extensions listed for a channel and its groups, None if no entry applies"""
+        extensions = self.channels.get(channel_id, self.channels.get(GLOBAL))
+        for group_name in group_names:
+            group_extensions = self.groups.get(group_name)
+            if group_extensions is not None:
+                extensions = (extensions or frozenset()) | group_extensions
+        return extensions
+
+
+def compile_extension_index(entries: [dict]) -> ExtensionIndex:
+    """Merge list entries into an `ExtensionIndex`"""
+    per_channel = defaultdict(set)
+    per_group = defaultdict(set)
+    for entry in entries:
+        entry = ExtensionsAndChannels(**entry)
+        extensions = {ext.lower().lstrip(".") for ext in entry.extensions}
+        if entry.is_global:
+            per_channel[GLOBAL] |= extensions
+            continue
+        for channel_id in entry.channels:
+            per_channel[channel_id] |= extensions
+        for group_name in entry.groups:
+            per_group[group_name] |= extensions
+
+    global_extensions = per_channel.get(GLOBAL, set())
+    return ExtensionIndex(
+        channels=MappingProxyType(
+            {
+                channel_id: frozenset(extensions | global_extensions)
+                for channel_id, extensions in per_channel.items()
+            }
+        ),
+        groups=MappingProxyType(
+            {group_name: frozenset(extensions) for group_name, extensions in per_group.items()}
+        ),
+    )
 
 
 class AllowedExtensionsRule(BaseRule):
@@ -35,6 +97,7 @@ class AllowedExtensionsRule(BaseRule):
         extensions: [str],
         channels: [discord.TextChannel],
         white_or_black_list: str,
+        groups: [str] = None,
     ):
         """
         Add extension(s) to the whitelist per channel
@@ -48,8 +111,14 @@ class AllowedExtensionsRule(BaseRule):
             The channels to apply this whitelist
         white_or_black_list
             The config KEY to use
+        groups
+            Channel group names, their channels are looked up when the list is used
         """
-        to_append = {"extensions": extensions, "channels": [ch.id for ch in channels]}
+        to_append = {
+            "extensions": extensions,
+            "channels": [ch.id for ch in channels],
+            "groups": groups or [],
+        }
         try:
             extensions = await self.config.guild(guild).get_raw(
                 self.rule_name, white_or_black_list
@@ -63,6 +132,7 @@ class AllowedExtensionsRule(BaseRule):
             await self.config.guild(guild).set_raw(
                 self.rule_name, white_or_black_list, value=[to_append]
             )
+        self.invalidate_pipeline(guild)
 
     async def _get_extensions(
         self, guild: discord.Guild, white_or_black_list: str
@@ -93,13 +163,32 @@ class AllowedExtensionsRule(BaseRule):
         await self.config.guild(guild).set_raw(
             self.rule_name, white_or_black_list, value=extensions
         )
+        self.invalidate_pipeline(guild)
 
         return ExtensionsAndChannels(**to_delete)
 
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        return {
+            key: compile_extension_index(rule_settings.get(key) or [])
+            for key in (WHITELIST_EXTENSIONS, BLACKLIST_EXTENSIONS)
+        }
+
+    def referenced_groups(self, rule_settings: dict) -> [str]:
+        return [
+            group_name
+            for key in (WHITELIST_EXTENSIONS, BLACKLIST_EXTENSIONS)
+            for entry in rule_settings.get(key) or []
+            for group_name in entry.get("groups") or []
+        ]
+
     async def set_whitelist_extensions(
-        self, guild: discord.Guild, extensions: [str], channels: [discord.TextChannel]
+        self,
+        guild: discord.Guild,
+        extensions: [str],
+        channels: [discord.TextChannel],
+        groups: [str] = None,
     ):
-        await self._set_extensions(guild, extensions, channels, WHITELIST_EXTENSIONS)
+        await self._set_extensions(guild, extensions, channels, WHITELIST_EXTENSIONS, groups)
 
     async def get_whitelist_extensions(self, guild: discord.Guild) -> [ExtensionsAndChannels]:
         return await self._get_extensions(guild, WHITELIST_EXTENSIONS)
@@ -111,23 +200,33 @@ class AllowedExtensionsRule(BaseRule):
         return await self._delete_extensions(guild, BLACKLIST_EXTENSIONS, index)
 
     async def set_blacklist_extensions(
-        self, guild: discord.Guild, extensions: [str], channels: [discord.TextChannel]
+        self,
+        guild: discord.Guild,
+        extensions: [str],
+        channels: [discord.TextChannel],
+        groups: [str] = None,
     ):
-        await self._set_extensions(guild, extensions, channels, BLACKLIST_EXTENSIONS)
+        await self._set_extensions(guild, extensions, channels, BLACKLIST_EXTENSIONS, groups)
 
     async def get_blacklist_extensions(self, guild: discord.Guild) -> [ExtensionsAndChannels]:
         return await self._get_extensions(guild, BLACKLIST_EXTENSIONS)
 
     @staticmethod
-    async def deleted_extensions_embed(guild: discord.Guild, extension: ExtensionsAndChannels):
+    def channels_box(guild: discord.Guild, extension: ExtensionsAndChannels) -> str:
+        """The channels and groups an entry applies to"""
+        if extension.is_global:
+            return box("+ Global", "diff")
+        lines = ["+ {0}".format(guild.get_channel(ch)) for ch in extension.channels]
+        lines.extend("+ {0} (group)".format(group) for group in extension.groups)
+        return box("\n".join(lines), "diff")
+
+    @classmethod
+    async def deleted_extensions_embed(
+        cls, guild: discord.Guild, extension: ExtensionsAndChannels
+    ):
         """Gets an embed for displaying deleted extensions"""
         nl = "\n"
-        chans = box(
-            nl.join("+ {0}".format(guild.get_channel(w)) for w in extension.channels)
-            if extension.channels
-            else "+ Global",
-            "diff",
-        )
+        chans = cls.channels_box(guild, extension)
         fmt_box = box(nl.join("+ {0}".format(ext) for ext in extension.extensions), "diff")
         embed = discord.Embed(color=discord.Color.red(), description="Extensions deleted.")
         embed.add_field(name="Channels", value=chans, inline=False)
@@ -149,18 +248,17 @@ class AllowedExtensionsRule(BaseRule):
         return embed
 
     @staticmethod
-    async def is_blacklist(message_exts: [str], blacklisted_exts: [str]):
+    def is_blacklist(message_exts: [str], blacklisted_exts: FrozenSet[str]) -> Optional[str]:
         for ext in message_exts:
-            ext = ext.replace(".", "")
             if ext in blacklisted_exts:
                 return ext
 
         return None
 
     @staticmethod
-    async def is_whitelist(message_exts: [str], whitelisted_exts: [str]):
+    def is_whitelist(message_exts: [str], whitelisted_exts: FrozenSet[str]) -> Optional[str]:
         for ext in message_exts:
-            ext = ext.replace(".", "")
+            # files without an extension aren't on any allow list, `""` is returned for them
             if ext not in whitelisted_exts:
                 return ext
 
@@ -184,7 +282,9 @@ class AllowedExtensionsRule(BaseRule):
         embed.description = infraction_information.embed_description
         return embed
 
-    async def is_offensive(self, message: discord.Message):
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
         content, guild, attachments, channel = (
             message.content,
             message.guild,
@@ -196,30 +296,37 @@ class AllowedExtensionsRule(BaseRule):
             return
 
         message_attachment_extensions = get_message_extensions(message)
+        group_names = snapshot.channel_groups.groups_of_channel(channel) if snapshot.groups else ()
 
         # Blacklist takes precedent
-        blacklist_extensions = await self.get_blacklist_extensions(guild)
-        for entry in blacklist_extensions:
-            if channel.id in entry.channels or entry.channels is None:
-                blacklisted_extension = await self.is_blacklist(
-                    message_attachment_extensions, entry.extensions
+        blacklisted_extensions = snapshot.options[BLACKLIST_EXTENSIONS].extensions_for(
+            channel.id, group_names
+        )
+        if blacklisted_extensions:
+            blacklisted_extension = self.is_blacklist(
+                message_attachment_extensions, blacklisted_extensions
+            )
+            if blacklisted_extension:
+                return InfractionInformation(
+                    message=content,
+                    rule=self,
+                    embed_description=f"Blacklisted extension found: `{blacklisted_extension}`",
                 )
-                if blacklisted_extension:
-                    return InfractionInformation(
-                        message=content,
-                        rule=self,
-                        embed_description=f"Blacklisted extension found: `{blacklisted_extension}`",
-                    )
-
-        whitelist_extensions = await self.get_whitelist_extensions(guild)
-        for entry in whitelist_extensions:
-            if channel.id in entry.channels or entry.channels is None:
-                whitelisted_extension = await self.is_whitelist(
-                    message_attachment_extensions, entry.extensions
+
+        # no allow list for the channel means everything is allowed
+        whitelisted_extensions = snapshot.options[WHITELIST_EXTENSIONS].extensions_for(
+            channel.id, group_names
+        )
+        if whitelisted_extensions is not None:
+            whitelisted_extension = self.is_whitelist(
+                message_attachment_extensions, whitelisted_extensions
+            )
+            if whitelisted_extension is not None:
+                return InfractionInformation(
+                    message=content,
+                    rule=self,
+                    embed_description=(
+                        "Extension found not in allowed whitelist: "
+                        f"`{whitelisted_extension or 'no extension'}`"
+                    ),
                 )
-                if whitelisted_extension:
-                    return InfractionInformation(
-                        message=content,
-                        rule=self,
-                        embed_description=f"Extension found not in allowed whitelist: `{whitelisted_extension}`",
-                    )
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, Union
+from typing import FrozenSet, Hashable, Iterable, Optional, Union
 
 import discord
 from abc import (
@@ -10,11 +10,14 @@ from datetime import datetime
 
 from ..converters import ToggleBool
 from ..constants import (
+    ACTION_CONFIRMATION,
     DEFAULT_ACTION,
+    DEFAULT_PRIORITY,
     DEFAULT_OPTIONS,
     OPTIONS_MAP,
 )
-from async_lru import alru_cache
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
 import timeit
 
 
@@ -31,15 +34,100 @@ class BaseRuleSettingsDisplay:
 
 
 class BaseRule:
+    # rules that wait on the network are run concurrently after the cheap ones
+    is_io_bound = False
+    # rules whose verdict only depends on the content and settings, memoized by the listener
+    is_stateless = False
+    # stateless rules that only need to look at the text an edit inserted
+    scans_inserted_text = False
+    # settings only the bot owner sets, like api keys, left out of exports
+    secret_settings: FrozenSet[str] = frozenset()
+
     def __init__(self, config, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.config = config
         self.rule_name = self.__class__.__name__
+        # set by the cog, see PipelineCache and SettingsCache
+        self.pipeline_cache = None
+        self.settings_cache = None
 
     @abstractmethod
-    async def is_offensive(self, message: discord.Message):
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
         pass
 
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        """
+        Pre-compute the rule specific settings `is_offensive` needs, called once per pipeline build.
+        Parameters
+        ----------
+        rule_settings
+            The raw config dict stored under this rule's name
+        guild_settings
+            The raw config dict stored under `settings`
+        """
+        return {}
+
+    def validate_settings(self, rule_settings: dict) -> None:
+        """
+        Check raw settings that didn't come through the setters, like an import.
+
+        Rules override this to run their setters' checks, calling super() for the options
+        every rule has.
+        Raises
+        ------
+        ValueError
+            With the reason the first refused value was refused
+        """
+        secrets = self.secret_settings & rule_settings.keys()
+        if secrets:
+            raise ValueError(f"{', '.join(sorted(secrets))} can't be imported, set it again.")
+        action = rule_settings.get("action_to_take", DEFAULT_ACTION)
+        if action not in ACTION_CONFIRMATION:
+            raise ValueError(f"`{action}` is not an action.")
+        priority = rule_settings.get("priority", DEFAULT_PRIORITY)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise ValueError("The priority must be a whole number.")
+
+    def referenced_groups(self, rule_settings: dict) -> Iterable[str]:
+        """
+        Names of the channel groups this rule's settings use.
+
+        Edits to these groups are passed on to the rule's snapshot, see
+        `PipelineCache.update_channel_groups`.
+        """
+        return ()
+
+    def memo_key(self, message: discord.Message, analysis: MessageAnalysis) -> Hashable:
+        """What a stateless rule's verdict depends on besides settings, the content by default"""
+        return analysis.content_hash
+
+    def is_memoizable(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ) -> bool:
+        """Whether the verdict a stateless rule just reached for a message can be memoized"""
+        return True
+
+    def invalidate_pipeline(self, guild: discord.Guild) -> None:
+        """Drop the compiled pipeline and this rule's cached settings, call after any write"""
+        if self.pipeline_cache is not None:
+            self.pipeline_cache.invalidate(guild)
+        if self.settings_cache is not None:
+            self.settings_cache.invalidate(guild.id, self.rule_name)
+
+    async def _get_setting(self, guild: discord.Guild, key: str, default=None):
+        """Read one of this rule's settings, through the settings cache when the cog set one"""
+        if self.settings_cache is None:
+            try:
+                return await self.config.guild(guild).get_raw(self.rule_name, key)
+            except KeyError:
+                return default
+
+        value = (await self.settings_cache.get(guild, self.rule_name)).get(key, default)
+        # cached lists are shared, hand out copies
+        return list(value) if isinstance(value, list) else value
+
     async def get_settings(self, guild: discord.Guild,) -> BaseRuleSettingsDisplay:
         return BaseRuleSettingsDisplay(
             rule_name=self.rule_name,
@@ -52,26 +140,13 @@ class BaseRule:
             muted_role=await self.get_mute_role(guild),
         )
 
-    async def _clear_cache(self, func):
-        """Function helper to clear cache"""
-        try:
-            await func.cache_clear()
-        except TypeError:
-            # cache probably cleared already
-            pass
-
     # enabling
-    @alru_cache(maxsize=32)
     async def is_enabled(self, guild: discord.Guild,) -> bool:
         """Helper to return the status of Rule"""
-        try:
-            return await self.config.guild(guild).get_raw(self.rule_name, "is_enabled",)
-        except KeyError:
-            return False
+        return await self._get_setting(guild, "is_enabled", False)
 
     async def toggle_enabled(self, guild: discord.Guild, toggle: ToggleBool) -> (bool, bool):
         """Toggles whether the rule is in effect"""
-        await self._clear_cache(self.is_enabled)
         before = False
         try:
             before = await self.config.guild(guild).get_raw(self.rule_name, "is_enabled")
@@ -79,13 +154,12 @@ class BaseRule:
             pass
 
         await self.config.guild(guild).set_raw(self.rule_name, "is_enabled", value=toggle)
+        self.invalidate_pipeline(guild)
 
         return before, toggle
 
     async def set_enforced_channels(self, guild: discord.Guild, channels: [discord.TextChannel]):
         """Setting a channel will disable global"""
-        await self._clear_cache(self.get_enforced_channels)
-
         config_channels = []
 
         for channel in channels:
@@ -95,19 +169,12 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "enforced_channels", value=config_channels
         )
+        self.invalidate_pipeline(guild)
         return config_channels
 
-    @alru_cache(maxsize=32)
     async def get_enforced_channels(self, guild: discord.Guild,) -> [discord.TextChannel]:
         """Returns enabled channels, empty list if none set"""
-
-        channels = []
-        try:
-            channels = await self.config.guild(guild).get_raw(self.rule_name, "enforced_channels",)
-        except KeyError:
-            pass
-
-        return channels
+        return await self._get_setting(guild, "enforced_channels") or []
 
     async def is_enforced_channel(
         self, guild: discord.Guild, channel: discord.TextChannel,
@@ -120,70 +187,57 @@ class BaseRule:
         return channel.id in enforced_channels
 
     # announcing
-    @alru_cache(maxsize=32)
     async def get_specific_announce_channel(
         self, guild: discord.Guild
     ) -> Union[discord.TextChannel, None]:
-        try:
-            channel_id = await self.config.guild(guild).get_raw(
-                self.rule_name, "rule_specific_announce"
-            )
-            return guild.get_channel(channel_id)
-        except KeyError:
+        channel_id = await self._get_setting(guild, "rule_specific_announce")
+        if channel_id is None:
             # not set, so is disabled
             return None
+        return guild.get_channel(channel_id)
 
     async def set_specific_announce_channel(
         self, guild: discord.Guild, channel: discord.TextChannel
     ) -> None:
         """Stores the channel ID inside of config"""
-        await self._clear_cache(self.get_specific_announce_channel)
         print(channel)
         await self.config.guild(guild).set_raw(
             self.rule_name, "rule_specific_announce", value=channel.id
         )
+        self.invalidate_pipeline(guild)
 
     async def clear_specific_announce_channel(self, guild: discord.Guild):
-        await self._clear_cache(self.get_specific_announce_channel)
         await self.config.guild(guild).set_raw(
             self.rule_name, "rule_specific_announce", value=None
         )
+        self.invalidate_pipeline(guild)
 
     # actions
-    @alru_cache(maxsize=32)
     async def get_action_to_take(self, guild: discord.Guild,) -> str:
         """Helper to return what action is currently set on offence"""
-        try:
-            return await self.config.guild(guild).get_raw(self.rule_name, "action_to_take",)
-        except KeyError:
+        action = await self._get_setting(guild, "action_to_take")
+        if action is None:
             await self.config.guild(guild).set_raw(
                 self.rule_name, "action_to_take", value=DEFAULT_ACTION,
             )
+            self.invalidate_pipeline(guild)
             return DEFAULT_ACTION
+        return action
 
     async def set_action_to_take(
         self, action: str, guild: discord.Guild,
     ):
         """Sets the action to take on an offence"""
-        try:
-            await self.get_action_to_take.cache_clear()
-        except TypeError:
-            # cache probably not exists or clear already
-            pass
         await self.config.guild(guild).set_raw(
             self.rule_name, "action_to_take", value=action,
         )
+        self.invalidate_pipeline(guild)
 
-    @alru_cache(maxsize=32)
     async def get_should_delete(self, guild: discord.Guild):
-        try:
-            return await self.config.guild(guild).get_raw(self.rule_name, "delete_message",)
-        except KeyError:
-            return False
+        return await self._get_setting(guild, "delete_message", False)
 
     async def toggle_to_delete_message(self, guild: discord.Guild) -> (bool, bool):
         """Toggles whether offending message should be deleted"""
-        await self._clear_cache(self.get_should_delete)
         try:
             before = await self.config.guild(guild).get_raw(self.rule_name, "delete_message")
         except KeyError:
@@ -191,28 +245,20 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "delete_message", value=not before,
         )
+        self.invalidate_pipeline(guild)
 
         return before, not before
 
     async def role_is_whitelisted(self, guild: discord.Guild, roles: [discord.Role],) -> bool:
         """Checks if role is whitelisted"""
-        try:
-            whitelist_roles = await self.config.guild(guild).get_raw(
-                self.rule_name, "whitelist_roles"
-            )
-        except KeyError:
+        whitelist_roles = await self._get_setting(guild, "whitelist_roles")
+        if not whitelist_roles:
             # no roles are whitelisted
             return False
-
-        # return any(role in whitelist_roles for role in [role.id for role in roles])
-        for role in roles:
-            if role.id in whitelist_roles:
-                return True
-        return False
+        return not set(whitelist_roles).isdisjoint(role.id for role in roles)
 
     async def append_whitelist_role(self, guild: discord.Guild, role: discord.Role):
         """Adds role to whitelist"""
-        await self._clear_cache(self.get_all_whitelisted_roles)
         try:
             roles = await self.config.guild(guild).get_raw(self.rule_name, "whitelist_roles",)
             if role.id in roles:
@@ -225,13 +271,13 @@ class BaseRule:
 
         except KeyError:
             # no roles added yet
-            return await self.config.guild(guild).set_raw(
+            await self.config.guild(guild).set_raw(
                 self.rule_name, "whitelist_roles", value=[role.id],
             )
+        self.invalidate_pipeline(guild)
 
     async def remove_whitelist_role(self, guild: discord.Guild, role: discord.Role):
         """Removes role from whitelist"""
-        await self._clear_cache(self.get_all_whitelisted_roles)
         roles = await self.config.guild(guild).get_raw(self.rule_name, "whitelist_roles",)
         if role.id not in roles:
             raise ValueError("That role is not whitelisted")
@@ -241,15 +287,101 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "whitelist_roles", value=roles,
         )
+        self.invalidate_pipeline(guild)
 
-    @alru_cache(maxsize=32)
-    async def get_all_whitelisted_roles(self, guild: discord.Guild):
+    async def append_whitelist_roles(self, guild: discord.Guild, roles: [discord.Role]) -> [int]:
+        """Adds roles to the whitelist at once, returns the ids that weren't whitelisted yet"""
+        return await self._extend_list(guild, "whitelist_roles", [role.id for role in roles])
+
+    async def remove_whitelist_roles(self, guild: discord.Guild, roles: [discord.Role]) -> [int]:
+        """Removes roles from the whitelist at once, returns the ids that were whitelisted"""
+        return await self._remove_many_from_list(
+            guild, "whitelist_roles", [role.id for role in roles]
+        )
+
+    async def _append_to_list(self, guild: discord.Guild, key: str, value: int) -> None:
+        """Adds an id to a list setting, raises ValueError if it's already there"""
         try:
-            roles = await self.config.guild(guild).get_raw(self.rule_name, "whitelist_roles")
+            values = await self.config.guild(guild).get_raw(self.rule_name, key)
         except KeyError:
-            # no roles added
-            return None
-        return roles
+            values = []
+        if value in values:
+            raise ValueError("Already whitelisted")
+
+        values.append(value)
+        await self.config.guild(guild).set_raw(self.rule_name, key, value=values)
+        self.invalidate_pipeline(guild)
+
+    async def _remove_from_list(self, guild: discord.Guild, key: str, value: int) -> None:
+        """Removes an id from a list setting, raises ValueError if it's not there"""
+        try:
+            values = await self.config.guild(guild).get_raw(self.rule_name, key)
+        except KeyError:
+            values = []
+        if value not in values:
+            raise ValueError("Not whitelisted")
+
+        values.remove(value)
+        await self.config.guild(guild).set_raw(self.rule_name, key, value=values)
+        self.invalidate_pipeline(guild)
+
+    async def _get_list(self, guild: discord.Guild, key: str) -> [int]:
+        return await self._get_setting(guild, key) or []
+
+    async def _extend_list(self, guild: discord.Guild, key: str, values: [int]) -> [int]:
+        """Adds ids to a list setting in a single write, returns the ones that weren't there"""
+        try:
+            current = await self.config.guild(guild).get_raw(self.rule_name, key)
+        except KeyError:
+            current = []
+        seen = set(current)
+        added = []
+        for value in values:
+            if value not in seen:
+                seen.add(value)
+                added.append(value)
+
+        if added:
+            await self.config.guild(guild).set_raw(self.rule_name, key, value=current + added)
+            self.invalidate_pipeline(guild)
+        return added
+
+    async def _remove_many_from_list(self, guild: discord.Guild, key: str, values: [int]) -> [int]:
+        """Removes ids from a list setting in a single write, returns the ones that were there"""
+        try:
+            current = await self.config.guild(guild).get_raw(self.rule_name, key)
+        except KeyError:
+            return []
+        to_remove = set(values)
+        removed = [value for value in current if value in to_remove]
+
+        if removed:
+            kept = [value for value in current if value not in to_remove]
+            await self.config.guild(guild).set_raw(self.rule_name, key, value=kept)
+            self.invalidate_pipeline(guild)
+        return removed
+
+    async def append_whitelist_user(self, guild: discord.Guild, user: discord.Member):
+        await self._append_to_list(guild, "whitelist_users", user.id)
+
+    async def remove_whitelist_user(self, guild: discord.Guild, user: discord.Member):
+        await self._remove_from_list(guild, "whitelist_users", user.id)
+
+    async def get_all_whitelisted_users(self, guild: discord.Guild) -> [int]:
+        return await self._get_list(guild, "whitelist_users")
+
+    async def append_whitelist_channel(self, guild: discord.Guild, channel: discord.TextChannel):
+        await self._append_to_list(guild, "whitelist_channels", channel.id)
+
+    async def remove_whitelist_channel(self, guild: discord.Guild, channel: discord.TextChannel):
+        await self._remove_from_list(guild, "whitelist_channels", channel.id)
+
+    async def get_all_whitelisted_channels(self, guild: discord.Guild) -> [int]:
+        return await self._get_list(guild, "whitelist_channels")
+
+    async def get_all_whitelisted_roles(self, guild: discord.Guild):
+        # None when no roles were ever added
+        return await self._get_setting(guild, "whitelist_roles")
 
     async def toggle_sending_message(self, guild: discord.Guild) -> (bool, bool):
         try:
@@ -262,13 +394,21 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "send_dm", value=(not before),
         )
+        self.invalidate_pipeline(guild)
         return before, not before
 
+    async def get_priority(self, guild: discord.Guild) -> int:
+        return await self._get_setting(guild, "priority", DEFAULT_PRIORITY)
+
+    async def set_priority(self, guild: discord.Guild, priority: int) -> (int, int):
+        """Sets the order this rule is evaluated in, lower runs first"""
+        before = await self.get_priority(guild)
+        await self.config.guild(guild).set_raw(self.rule_name, "priority", value=priority)
+        self.invalidate_pipeline(guild)
+        return before, priority
+
     async def get_mute_role(self, guild: discord.Guild,) -> str or None:
-        try:
-            return await self.config.guild(guild).get_raw(self.rule_name, "role_to_add",)
-        except KeyError:
-            return None
+        return await self._get_setting(guild, "role_to_add")
 
     async def set_mute_role(self, guild: discord.Guild, role: discord.Role,) -> tuple:
 
@@ -282,6 +422,7 @@ class BaseRule:
         await self.config.guild(guild).set_raw(
             self.rule_name, "role_to_add", value=role.id,
         )
+        self.invalidate_pipeline(guild)
 
         before_role = None
         if before:
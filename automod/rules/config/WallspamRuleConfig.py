@@ -1,3 +1,10 @@
 class WallspamRuleConfig:
     emptyline_enabled = "emptyline_wallspam_enabled"
     emptyline_threshold = "emptyline_wallspam_threshold"
+    # wall text thresholds, None turns a check off
+    long_word_threshold = "long_word_threshold"
+    repeated_word_threshold = "repeated_word_threshold"
+    repetition_ratio = "repetition_ratio"
+    word_run_threshold = "word_run_threshold"
+    char_run_threshold = "char_run_threshold"
+    min_entropy = "min_entropy"
@@ -1,24 +1,133 @@
+import asyncio
+import logging
 from abc import ABCMeta, ABC
+from typing import Awaitable, Callable, Dict, Iterable, Optional
 
 import discord
-import re
 
 from .base import BaseRule
+from ..analysis import INVITE_RE, MessageAnalysis
+from ..cache import LRUCache
+from ..pipeline import RuleSnapshot
+
+log = logging.getLogger("red.breadcogs.automod")
+
+ALLOWED_LINKS_KEY = "allowed_links"
+ALLOWED_GUILDS_KEY = "allowed_guilds"
+
+# Invite resolution
+INVITE_CACHE_SIZE = 10000
+INVITE_TTL = 60 * 60  # an hour, invites can be deleted and vanity codes moved
+INVALID_INVITE_TTL = 60 * 5
+MAX_CONCURRENT_LOOKUPS = 4
+# cached for codes that don't point to a guild, a miss is None
+NO_GUILD = 0
+
+
+def invite_code(link: str) -> Optional[str]:
+    """The code of a discord invite link, or the link itself if it's already a bare code"""
+    match = INVITE_RE.search(link)
+    if match is not None:
+        return match.group(1)
+    return link if link and "/" not in link and "." not in link else None
+
+
+class InviteResolver:
+    """
+    Resolves invite codes to the id of the guild they point to.
+
+    Results are kept in a TTL cache and lookups for the same code share one request, so a
+    raid posting the same invite costs one lookup in total.
+
+    Parameters
+    ----------
+    fetch
+        Coroutine taking an invite code, returning the guild id or None if the invite doesn't
+        point to a guild. It raises `discord.HTTPException` if the lookup failed
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[Optional[int]]],
+        maxsize: int = INVITE_CACHE_SIZE,
+        ttl: float = INVITE_TTL,
+    ):
+        self.fetch = fetch
+        self.cache = LRUCache(maxsize, ttl)
+        self.lookups = 0
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOOKUPS)
+        # code -> pending lookup
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def _lookup(self, code: str) -> Optional[int]:
+        async with self._semaphore:
+            self.lookups += 1
+            try:
+                guild_id = await self.fetch(code)
+            except discord.HTTPException as e:
+                # not cached, the next message with this invite tries again
+                log.warning(f"Failed to resolve invite {code}: {e}")
+                return None
+
+        if guild_id is None:
+            self.cache.set(code, NO_GUILD, expires_at=self.cache.timer() + INVALID_INVITE_TTL)
+        else:
+            self.cache.set(code, guild_id)
+        return guild_id
+
+    async def resolve(self, code: str) -> Optional[int]:
+        guild_id = self.cache.get(code)
+        if guild_id is not None:
+            return guild_id or None
+
+        pending = self._in_flight.get(code)
+        if pending is None:
+            pending = asyncio.ensure_future(self._lookup(code))
+            self._in_flight[code] = pending
+            pending.add_done_callback(lambda _: self._in_flight.pop(code, None))
+        return await asyncio.shield(pending)
+
+    def is_resolved(self, code: str) -> bool:
+        """Whether the code was looked up successfully, failed lookups aren't kept"""
+        return code in self.cache
+
+    async def resolve_many(self, codes: Iterable[str]) -> Dict[str, Optional[int]]:
+        """Resolve every code at once, each distinct code is looked up at most once"""
+        codes = list(dict.fromkeys(codes))
+        guild_ids = await asyncio.gather(*(self.resolve(code) for code in codes))
+        return dict(zip(codes, guild_ids))
 
 
 class DiscordInviteRule(BaseRule, ABC):
+    # resolving invites to their guild may need a request to discord
+    is_io_bound = True
+    # resolved invites are cached by the resolver anyway, the memo's ttl bounds staleness,
+    # verdicts from failed lookups aren't memoized, see `is_memoizable`
+    is_stateless = True
+    scans_inserted_text = True
+
     def __init__(
-        self, config,
+        self, config, bot=None,
     ):
         super().__init__(config)
         self.name = "discordinvite"
+        self.bot = bot
+        self.resolver = InviteResolver(self.fetch_invite_guild_id)
+
+    async def fetch_invite_guild_id(self, code: str) -> Optional[int]:
+        try:
+            invite = await self.bot.fetch_invite(code, with_counts=False)
+        except discord.NotFound:
+            return None
+        guild = getattr(invite, "guild", None)
+        return guild.id if guild is not None else None
 
     async def get_allowed_links(
         self, guild: discord.Guild,
     ):
         try:
             allowed_links = await self.config.guild(guild).get_raw(
-                self.rule_name, "allowed_links",
+                self.rule_name, ALLOWED_LINKS_KEY,
             )
         except KeyError:
             # no links have been added
@@ -29,18 +138,22 @@ class DiscordInviteRule(BaseRule, ABC):
     async def add_allowed_link(
         self, guild: discord.Guild, link: str,
     ):
+        if invite_code(link) is None:
+            raise ValueError("That isn't a discord invite link.")
+
         current_links = await self.get_allowed_links(guild)
         if current_links is not None:
             if link in current_links:
                 raise ValueError("Link already exists.")
             current_links.append(link)
             await self.config.guild(guild).set_raw(
-                self.rule_name, "allowed_links", value=current_links,
+                self.rule_name, ALLOWED_LINKS_KEY, value=current_links,
             )
         else:
             await self.config.guild(guild).set_raw(
-                self.rule_name, "allowed_links", value=[link],
+                self.rule_name, ALLOWED_LINKS_KEY, value=[link],
             )
+        self.invalidate_pipeline(guild)
 
     async def delete_allowed_link(
         self, guild: discord.Guild, link: str,
@@ -49,27 +162,70 @@ class DiscordInviteRule(BaseRule, ABC):
         if current_links is None or link not in current_links:
             raise ValueError("Link provided is not in the allowed list.")
 
-        current_links.pop(link)
+        current_links.remove(link)
         await self.config.guild(guild).set_raw(
-            self.rule_name, "allowed_links", value=current_links,
+            self.rule_name, ALLOWED_LINKS_KEY, value=current_links,
         )
+        self.invalidate_pipeline(guild)
 
-    async def is_offensive(
-        self, message: discord.Message,
-    ):
-        guild = message.guild
-        content = message.content
+    async def add_allowed_guild(self, guild: discord.Guild, guild_id: int) -> None:
+        """Allow every invite pointing to a guild, raises ValueError if it's already allowed"""
+        try:
+            await self._append_to_list(guild, ALLOWED_GUILDS_KEY, guild_id)
+        except ValueError:
+            raise ValueError("That server is already allowed.")
 
-        allowed_links = await self.get_allowed_links(guild)
+    async def remove_allowed_guild(self, guild: discord.Guild, guild_id: int) -> None:
+        try:
+            await self._remove_from_list(guild, ALLOWED_GUILDS_KEY, guild_id)
+        except ValueError:
+            raise ValueError("That server is not in the allowed list.")
 
-        r = re.compile(r"(discord\.(?:gg|io|me|li)|discord(?:app)?\.com\/invite)\/(\S+)", re.I)
+    async def get_allowed_guilds(self, guild: discord.Guild) -> [int]:
+        return await self._get_list(guild, ALLOWED_GUILDS_KEY)
 
-        if allowed_links:
-            filter_content = [x for x in content.split() if x not in allowed_links]
-        else:
-            filter_content = content.split()
+    def validate_settings(self, rule_settings: dict) -> None:
+        super().validate_settings(rule_settings)
+        for link in rule_settings.get(ALLOWED_LINKS_KEY) or []:
+            if not isinstance(link, str) or invite_code(link) is None:
+                raise ValueError(f"`{link}` isn't a discord invite link.")
+        for guild_id in rule_settings.get(ALLOWED_GUILDS_KEY) or []:
+            if not isinstance(guild_id, int) or isinstance(guild_id, bool):
+                raise ValueError(f"`{guild_id}` isn't a guild id.")
 
-        has_offensive = list(filter(r.match, filter_content,))
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        allowed_codes = (invite_code(link) for link in rule_settings.get(ALLOWED_LINKS_KEY) or [])
+        return {
+            "allowed_codes": frozenset(code for code in allowed_codes if code is not None),
+            "allowed_guilds": frozenset(rule_settings.get(ALLOWED_GUILDS_KEY) or []),
+        }
+
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
+        allowed_codes = snapshot.options["allowed_codes"]
+        codes = [code for code in analysis.invite_codes if code not in allowed_codes]
+        if not codes:
+            return False
 
-        if has_offensive:
+        allowed_guilds = snapshot.options["allowed_guilds"]
+        if not allowed_guilds:
+            # nothing to resolve against
             return True
+
+        guild_ids = await self.resolver.resolve_many(codes)
+        # invites that couldn't be resolved are treated as not allowed
+        return any(guild_id not in allowed_guilds for guild_id in guild_ids.values())
+
+    def is_memoizable(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ) -> bool:
+        if not snapshot.options["allowed_guilds"]:
+            return True  # nothing was resolved
+        # the next message with an invite that failed to resolve tries again
+        allowed_codes = snapshot.options["allowed_codes"]
+        return all(
+            self.resolver.is_resolved(code)
+            for code in analysis.invite_codes
+            if code not in allowed_codes
+        )
@@ -1,22 +1,43 @@
 import aiohttp
+import asyncio
 import discord
+import hashlib
+import json
 import re
 import logging
+import time
 
-from typing import Optional
+from pathlib import Path
+from typing import Optional, Union
 from .base import BaseRule
+from ..cache import LRUCache
+from ..constants import MAX_IMAGE_SIZE
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
 from .config.models import InfractionInformation, EmbedField
-from ..utils import transform_bool_to_emoji
+from ..utils import is_image, transform_bool_to_emoji
 
 log = logging.getLogger(name="red.breadcogs.automod.imagedetection")
 
-AZURE_URL_RE = "https?://([a-z0-9-]+[.])*cognitiveservices.azure[.]com"
+AZURE_URL_RE = re.compile(r"https?://([a-z0-9-]+[.])*cognitiveservices.azure[.]com")
 VISION_URL = "/vision/v3.0/analyze/?visualFeatures=Adult,Description"
 
 # Config Constants
 AZURE_KEY = "azure_key"
 AZURE_ENDPOINT = "azure_endpoint"
 
+KEY_NOT_SET = "No endpoint secret key has been set, you can access this from the Azure Portal"
+ENDPOINT_NOT_SET = "No endpoint URL has been set, you can access this from the Azure Portal"
+
+# Request pipeline
+MAX_CONCURRENT_REQUESTS = 8
+REQUEST_TIMEOUT = 10  # seconds
+
+# Verdict cache
+VERDICT_CACHE_SIZE = 10000
+VERDICT_TTL = 60 * 60 * 24 * 7  # a week
+VERDICT_FILE = "image_verdicts.json"
+
 
 class EndpointNotSetException(Exception):
     pass
@@ -26,16 +47,156 @@ class SecretKeyNotSetException(Exception):
     pass
 
 
+class ImageVerdictCache:
+    """
+    Azure verdicts keyed by the sha256 of the attachment's content.
+
+    A cheap `filename:size` pre-key is kept alongside so re-posts of a known offensive image
+    are answered without downloading it. Optionally persisted to disk, see `load` and `save`.
+    """
+
+    def __init__(self, maxsize: int = VERDICT_CACHE_SIZE, ttl: float = VERDICT_TTL):
+        # wall clock, so expiry survives being saved to disk
+        self.by_hash = LRUCache(maxsize, ttl, timer=time.time)
+        self.by_attachment = LRUCache(maxsize, ttl, timer=time.time)
+        self.path: Optional[Path] = None
+
+    @staticmethod
+    def attachment_key(attachment: discord.Attachment) -> str:
+        return f"{attachment.filename}:{attachment.size}"
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def is_flagged(verdict: dict) -> bool:
+        adult = verdict["adult"]
+        return adult["isAdultContent"] or adult["isRacyContent"] or adult["isGoryContent"]
+
+    def get_by_attachment(self, attachment: discord.Attachment) -> Optional[dict]:
+        """
+        The verdict of an offensive image seen before with the same filename and size.
+
+        Anyone can upload other content under a name and size seen before, so clean verdicts
+        are only trusted once the download's hash matches, see `get_by_hash`.
+        """
+        key = self.attachment_key(attachment)
+        content_hash = self.by_attachment.peek(key)
+        verdict = self.by_hash.peek(content_hash) if content_hash is not None else None
+        if verdict is None or not self.is_flagged(verdict):
+            self.by_attachment.misses += 1
+            return None
+        # only counted as a hit when the verdict is used
+        self.by_attachment.get(key)
+        return verdict
+
+    def get_by_hash(self, content_hash: str) -> Optional[dict]:
+        return self.by_hash.get(content_hash)
+
+    def set(self, attachment: discord.Attachment, content_hash: str, image_details: dict) -> dict:
+        """Store the parts of an Azure response `get_infraction` needs"""
+        verdict = {k: image_details[k] for k in ("adult", "description") if k in image_details}
+        self.by_hash.set(content_hash, verdict)
+        self.alias(attachment, content_hash)
+        return verdict
+
+    def alias(self, attachment: discord.Attachment, content_hash: str) -> None:
+        self.by_attachment.set(self.attachment_key(attachment), content_hash)
+
+    def clear(self) -> None:
+        self.by_hash.clear()
+        self.by_attachment.clear()
+
+    def load(self, path: Path) -> int:
+        """
+        Enable persistence at path, loading anything saved there before
+        Returns
+        -------
+        int
+            The amount of verdicts loaded
+        """
+        self.path = path
+        try:
+            with path.open("r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError):
+            log.exception(f"Could not load image verdicts from {path}")
+            return 0
+
+        now = time.time()
+        for cache, name in ((self.by_hash, "by_hash"), (self.by_attachment, "by_attachment")):
+            for key, expires_at, value in data.get(name, []):
+                if expires_at is None or expires_at > now:
+                    cache.set(key, value, expires_at=expires_at)
+        return len(self.by_hash)
+
+    def save(self) -> None:
+        """Write the cache to disk, does nothing if persistence is not enabled"""
+        if self.path is None:
+            return
+        data = {
+            "by_hash": list(self.by_hash.items()),
+            "by_attachment": list(self.by_attachment.items()),
+        }
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as fp:
+            json.dump(data, fp)
+        tmp_path.replace(self.path)
+
+
 class ImageDetectionRule(BaseRule):
+    is_io_bound = True
+    # set in DMs by the owner, the endpoint receives every attachment
+    secret_settings = frozenset({AZURE_KEY, AZURE_ENDPOINT})
+
     def __init__(
         self, config,
     ):
         super().__init__(config)
         self.name = "imagedetection"
+        # one pooled session for the lifetime of the cog, see `close`
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self.verdicts = ImageVerdictCache()
+        # (key, endpoint, content hash) -> pending analysis, so a raid of one image only asks
+        # Azure once, with the credentials of the guild it's posted in
+        self._in_flight = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS),
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """Close the pooled session and save verdicts, called on cog unload"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        await self.save_verdicts()
+
+    async def load_verdicts(self, path: Path) -> int:
+        """Enable verdict persistence at path"""
+        return await asyncio.get_event_loop().run_in_executor(None, self.verdicts.load, path)
+
+    async def save_verdicts(self) -> None:
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self.verdicts.save)
+        except OSError:
+            log.exception("Could not save image verdicts")
+
+    async def disable_verdict_persistence(self) -> None:
+        await self.save_verdicts()
+        self.verdicts.path = None
 
     async def set_endpoint(self, guild: discord.Guild, endpoint: str) -> None:
         """Set the azure cognitive services endpoint"""
-        if not re.match(AZURE_URL_RE, endpoint):
+        if not AZURE_URL_RE.match(endpoint):
             raise ValueError(
                 "Invalid azure endpoint, must be: `https://[name].cognitiveservices.azure.com"
             )
@@ -44,28 +205,45 @@ class ImageDetectionRule(BaseRule):
             endpoint = endpoint[:-1]  # strip the last / off the url
 
         await self.config.guild(guild).set_raw(self.rule_name, AZURE_ENDPOINT, value=endpoint)
+        self.invalidate_pipeline(guild)
 
     async def set_key(self, guild: discord.Guild, key: str):
         """Set the key associated with the endpoint"""
         await self.config.guild(guild).set_raw(self.rule_name, AZURE_KEY, value=key)
+        self.invalidate_pipeline(guild)
 
     async def get_key(self, guild: discord.Guild):
         """Get key from config, throws Key Error if not set"""
         try:
             return await self.config.guild(guild).get_raw(self.rule_name, AZURE_KEY)
         except KeyError:
-            raise SecretKeyNotSetException(
-                "No endpoint secret key has been set, you can access this from the Azure Portal"
-            )
+            raise SecretKeyNotSetException(KEY_NOT_SET)
 
     async def get_endpoint(self, guild: discord.Guild):
         try:
             base_endpoint = await self.config.guild(guild).get_raw(self.rule_name, AZURE_ENDPOINT)
             return f"{base_endpoint}{VISION_URL}"
         except KeyError:
-            raise EndpointNotSetException(
-                "No endpoint URL has been set, you can access this from the Azure Portal"
-            )
+            raise EndpointNotSetException(ENDPOINT_NOT_SET)
+
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        return {
+            AZURE_KEY: rule_settings.get(AZURE_KEY),
+            AZURE_ENDPOINT: rule_settings.get(AZURE_ENDPOINT),
+        }
+
+    @staticmethod
+    def get_credentials(snapshot: RuleSnapshot) -> (str, str):
+        """Get the key and full vision url from a snapshot, raises if either is not set"""
+        subscription_key = snapshot.options[AZURE_KEY]
+        if subscription_key is None:
+            raise SecretKeyNotSetException(KEY_NOT_SET)
+
+        base_endpoint = snapshot.options[AZURE_ENDPOINT]
+        if base_endpoint is None:
+            raise EndpointNotSetException(ENDPOINT_NOT_SET)
+
+        return subscription_key, f"{base_endpoint}{VISION_URL}"
 
     async def get_announcement_embed(
         self,
@@ -87,60 +265,150 @@ class ImageDetectionRule(BaseRule):
             embed.add_field(name=field.name, value=field.value)
         return embed
 
+    async def analyze_image(
+        self, image: Union[str, bytes], subscription_key: str, url: str
+    ) -> Optional[dict]:
+        """
+        Send a single image to Azure
+        Parameters
+        ----------
+        image
+            The attachment url, or its content if it has already been downloaded
+        subscription_key
+            The Azure key
+        url
+            The full vision endpoint
+
+        Returns
+        -------
+        The json response, None if the request failed
+        """
+        if isinstance(image, bytes):
+            content_type, payload = "application/octet-stream", {"data": image}
+        else:
+            content_type, payload = "application/json", {"json": {"url": image}}
+        headers = {
+            "Ocp-Apim-Subscription-Key": subscription_key,
+            "Content-Type": content_type,
+        }
+        try:
+            async with self._semaphore:
+                async with self._get_session().post(url, headers=headers, **payload) as response:
+                    json_response = await response.json()
+        except asyncio.TimeoutError:
+            log.warning(f"Timed out analyzing image after {REQUEST_TIMEOUT}s. Skipping image.")
+            return None
+        except aiohttp.ClientError as e:
+            log.warning(f"Failed to analyze image: {e}")
+            return None
+
+        if "error" in json_response:
+            if json_response["error"]["code"] == "429":
+                log.warning("Being rate-limited by Azure Cognitive services. Skipping image.")
+            if json_response["error"]["code"] == "InvalidImageSize":
+                log.warning(f"InvalidImageSize: {json_response['error']['message']}")
+            return None
+
+        return json_response
+
+    async def check_attachment(
+        self, attachment: discord.Attachment, subscription_key: str, url: str
+    ) -> Optional[dict]:
+        """
+        Get the verdict for an attachment, from cache if this image has been seen before
+        Returns
+        -------
+        The Azure verdict, None if the attachment isn't an image or could not be analyzed
+        """
+        if not is_image(attachment):
+            return None
+
+        verdict = self.verdicts.get_by_attachment(attachment)
+        if verdict is not None:
+            return verdict
+
+        if attachment.size > MAX_IMAGE_SIZE:
+            # too big to download, let Azure fetch it instead
+            return await self.analyze_image(attachment.url, subscription_key, url)
+
+        try:
+            data = await attachment.read()
+        except discord.HTTPException:
+            # can't hash it, let Azure fetch it instead
+            return await self.analyze_image(attachment.url, subscription_key, url)
+
+        content_hash = self.verdicts.content_hash(data)
+        verdict = self.verdicts.get_by_hash(content_hash)
+        if verdict is not None:
+            self.verdicts.alias(attachment, content_hash)
+            return verdict
+
+        in_flight_key = (subscription_key, url, content_hash)
+        pending = self._in_flight.get(in_flight_key)
+        if pending is None:
+            pending = asyncio.ensure_future(self.analyze_image(data, subscription_key, url))
+            self._in_flight[in_flight_key] = pending
+            pending.add_done_callback(lambda _: self._in_flight.pop(in_flight_key, None))
+
+        image_details = await asyncio.shield(pending)
+        if image_details is None:
+            return None
+        return self.verdicts.set(attachment, content_hash, image_details)
+
+    def get_infraction(
+        self, image_details: dict, attachment: discord.Attachment
+    ) -> Optional[InfractionInformation]:
+        """Turns an Azure response into an infraction, None if the image is fine"""
+        adult = image_details["adult"]
+        adult_content, racy_content, gory_content = (
+            adult["isAdultContent"],
+            adult["isRacyContent"],
+            adult["isGoryContent"],
+        )
+        if not (adult_content or racy_content or gory_content):
+            return None
+
+        message = ""
+        if "description" in image_details:
+            caption = image_details["description"]["captions"][0]["text"]
+            message += f"**Image description:**\n`{caption}`\n\n"
+            if "tags" in image_details["description"]:
+                message += "**Tags:**\n"
+                message += ", ".join(
+                    "`{0}`".format(w) for w in image_details["description"]["tags"]
+                )
+
+        extra_fields = [
+            EmbedField("Adult Content", transform_bool_to_emoji(adult_content)),
+            EmbedField("Racy Content", transform_bool_to_emoji(racy_content)),
+            EmbedField("Gory Content", transform_bool_to_emoji(gory_content)),
+            EmbedField("Attachment", f"`{attachment.filename}`"),
+        ]
+        return InfractionInformation(message=message, rule=self, extra_fields=extra_fields)
+
     async def is_offensive(
-        self, message: discord.Message,
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
     ):
         if not message.attachments:
             return  # we don't care about non-image messages
 
         try:
-            author, guild, content = message.author, message.guild, message.content
-            subscription_key, url = await self.get_key(guild), await self.get_endpoint(guild)
-            headers = {
-                "Ocp-Apim-Subscription-Key": subscription_key,
-                "Content-Type": "application/json",
-            }
-            data = {"url": message.attachments[0].url}
-
-            image_details = {}
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=data, headers=headers) as response:
-                    json_response = await response.json()
-
-                    if "error" in json_response:
-                        if json_response["error"]["code"] == "429":
-                            log.warning(
-                                "Being rate-limited by Azure Cognitive services. Skipping image."
-                            )
-                        if json_response["error"]["code"] == "InvalidImageSize":
-                            log.warning(f"InvalidImageSize: {json_response['error']['message']}")
-                    image_details = json_response
-
-            adult = image_details["adult"]
-            adult_content, racy_content, gory_content = (
-                adult["isAdultContent"],
-                adult["isRacyContent"],
-                adult["isGoryContent"],
-            )
-            if adult_content or racy_content or gory_content:
-                message = ""
-                if "description" in image_details:
-                    caption = image_details["description"]["captions"][0]["text"]
-                    message += f"**Image description:**\n`{caption}`\n\n"
-                    if "tags" in image_details["description"]:
-                        message += "**Tags:**\n"
-                        message += ", ".join(
-                            "`{0}`".format(w) for w in image_details["description"]["tags"]
-                        )
-
-                extra_fields = [
-                    EmbedField("Adult Content", transform_bool_to_emoji(adult_content)),
-                    EmbedField("Racy Content", transform_bool_to_emoji(racy_content)),
-                    EmbedField("Gory Content", transform_bool_to_emoji(gory_content)),
-                ]
-                return InfractionInformation(message=message, rule=self, extra_fields=extra_fields)
-
+            subscription_key, url = self.get_credentials(snapshot)
         except EndpointNotSetException as e:
-            log.exception(e.args[0], exc_info=e)
+            return log.exception(e.args[0], exc_info=e)
         except SecretKeyNotSetException as e:
-            log.exception(e.args[0], exc_info=e)
+            return log.exception(e.args[0], exc_info=e)
+
+        # every attachment is analyzed at the same time, bounded by the semaphore
+        results = await asyncio.gather(
+            *(
+                self.check_attachment(attachment, subscription_key, url)
+                for attachment in message.attachments
+            )
+        )
+        for attachment, image_details in zip(message.attachments, results):
+            if image_details is None:
+                continue
+            infraction = self.get_infraction(image_details, attachment)
+            if infraction is not None:
+                return infraction
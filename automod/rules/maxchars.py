@@ -1,11 +1,15 @@
 import discord
 
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
 
 MAX_CHARS_KEY = "max_chars"
 
 
 class MaxCharsRule(BaseRule):
+    is_stateless = True
+
     def __init__(
         self, config,
     ):
@@ -13,6 +17,7 @@ class MaxCharsRule(BaseRule):
 
     async def set_max_chars_length(self, guild: discord.Guild, max_length: int):
         await self.config.guild(guild).set_raw(self.rule_name, MAX_CHARS_KEY, value=max_length)
+        self.invalidate_pipeline(guild)
 
     async def get_max_chars(self, guild: discord.Guild):
         try:
@@ -24,10 +29,15 @@ class MaxCharsRule(BaseRule):
     async def message_is_max_chars(message_content: str, threshold: int):
         return len(message_content) >= threshold
 
-    async def is_offensive(self, message: discord.Message):
-        max_chars = await self.get_max_chars(message.guild)
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        return {MAX_CHARS_KEY: rule_settings.get(MAX_CHARS_KEY)}
+
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
+        max_chars = snapshot.options[MAX_CHARS_KEY]
 
         if max_chars is None:
             return False
 
-        return await self.message_is_max_chars(message.content, max_chars)
+        return analysis.char_count >= max_chars
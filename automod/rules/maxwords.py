@@ -1,10 +1,14 @@
 import discord
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
 
 MAX_WORDS_KEY = "max_words"
 
 
 class MaxWordsRule(BaseRule):
+    is_stateless = True
+
     def __init__(
         self, config,
     ):
@@ -23,6 +27,7 @@ class MaxWordsRule(BaseRule):
     async def set_max_words_length(self, guild: discord.Guild, max_length: int):
         """Set the max words length into config - this overrides :)"""
         await self.config.guild(guild).set_raw(self.rule_name, MAX_WORDS_KEY, value=max_length)
+        self.invalidate_pipeline(guild)
 
     @staticmethod
     async def message_is_max_length(message_content: str, max_length) -> bool:
@@ -38,10 +43,14 @@ class MaxWordsRule(BaseRule):
         message_content = message_content.split()
         return len(message_content) >= max_length
 
-    async def is_offensive(self, message: discord.Message):
-        guild = message.guild
-        max_length = await self.get_max_words_length(guild)
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        return {MAX_WORDS_KEY: rule_settings.get(MAX_WORDS_KEY)}
+
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
+        max_length = snapshot.options[MAX_WORDS_KEY]
         if not max_length:
             return False
 
-        return await self.message_is_max_length(message.content, max_length)
+        return analysis.word_count >= max_length
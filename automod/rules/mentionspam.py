@@ -1,45 +1,57 @@
 import discord
 from .base import BaseRule
+from ..analysis import MENTION_RE, MessageAnalysis
+from ..pipeline import RuleSnapshot
 
 from ..utils import *
 import logging
-import re
 
 log = logging.getLogger("red.breadcogs.automod")
 
+MENTION_THRESHOLD_KEY = "mention_threshold"
+DEFAULT_MENTION_THRESHOLD = 4
+
 
 class MentionSpamRule(BaseRule):
+    is_stateless = True
+
     def __init__(
         self, config,
     ):
         super().__init__(config)
         self.name = "mentionspam"
 
+    def memo_key(self, message: discord.Message, analysis: MessageAnalysis) -> tuple:
+        # mentioning yourself doesn't count, so the author matters if they did
+        if str(message.author.id) in analysis.content:
+            return analysis.content_hash, message.author.id
+        return analysis.content_hash, None
+
     @staticmethod
     async def mentions_greater_than_threshold(
         message_content: str, allowed_mentions: [str], threshold: int
     ):
-        content_filtered = [
-            word for word in message_content.split() if word not in allowed_mentions
-        ]
-        mention = re.compile(r"<@!?(\d+)>")
-        mention_count = len(list(filter(mention.match, content_filtered)))
-        return mention_count >= threshold
+        mentions = [word for word in message_content.split() if MENTION_RE.match(word)]
+        return MentionSpamRule.count_mentions(mentions, allowed_mentions) >= threshold
+
+    @staticmethod
+    def count_mentions(mention_tokens: [str], allowed_mentions: [str]) -> int:
+        return sum(1 for word in mention_tokens if word not in allowed_mentions)
+
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        return {
+            MENTION_THRESHOLD_KEY: guild_settings.get(
+                MENTION_THRESHOLD_KEY, DEFAULT_MENTION_THRESHOLD
+            )
+        }
 
     async def is_offensive(
-        self, message: discord.Message,
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
     ):
-        try:
-            mention_threshold = await self.config.guild(message.guild).get_raw(
-                "settings", "mention_threshold",
-            )
-        except KeyError:
-            mention_threshold = 4
+        mention_threshold = snapshot.options[MENTION_THRESHOLD_KEY]
 
         allowed_mentions = [message.author.mention]
-        return await self.mentions_greater_than_threshold(
-            message.content, allowed_mentions, mention_threshold
-        )
+        return self.count_mentions(analysis.mention_tokens, allowed_mentions) >= mention_threshold
 
     async def set_threshold(
         self, ctx, threshold,
@@ -54,6 +66,7 @@ class MentionSpamRule(BaseRule):
         await self.config.guild(guild).set_raw(
             "settings", "mention_threshold", value=threshold,
         )
+        self.invalidate_pipeline(guild)
         log.info(
             f"{ctx.author} ({ctx.author.id}) changed mention threshold from {before} to {threshold}"
         )
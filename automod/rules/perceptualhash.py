@@ -0,0 +1,212 @@
+import asyncio
+import logging
+from functools import lru_cache
+from io import BytesIO
+from typing import Optional
+
+import discord
+from PIL import Image
+
+from .base import BaseRule
+from .config.models import InfractionInformation, EmbedField
+from ..constants import MAX_IMAGE_SIZE
+from ..hamming import MAX_DISTANCE, HammingIndex
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
+from ..utils import is_image
+
+log = logging.getLogger(name="red.breadcogs.automod.perceptualhash")
+
+# Config Constants
+BANNED_HASHES_KEY = "banned_hashes"
+MAX_DISTANCE_KEY = "max_distance"
+
+DEFAULT_MAX_DISTANCE = 6
+HASH_SIZE = 8
+
+
+def dhash(data: bytes) -> int:
+    """
+    Difference hash of an image, 64 bits.
+
+    The image is shrunk to 9x8 greyscale and each bit is whether a pixel is brighter than
+    its right neighbour, so re-encodes, resizes and small edits keep almost the same hash.
+    """
+    with Image.open(BytesIO(data)) as image:
+        # lets JPEG decode at a fraction of the size, no-op for other formats
+        image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+        small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        pixels = small.tobytes()
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def format_hash(value: int) -> str:
+    return f"{value:016x}"
+
+
+def parse_hash(value: str) -> int:
+    """Raises ValueError if value is not a 64 bit hex hash"""
+    try:
+        parsed = int(value, 16)
+    except ValueError:
+        parsed = -1
+    if not 0 <= parsed < 1 << (HASH_SIZE * HASH_SIZE):
+        raise ValueError(f"`{value}` is not a valid image hash.")
+    return parsed
+
+
+def validate_max_distance(max_distance: int) -> None:
+    """Raises ValueError if the distance is out of the range the index supports"""
+    if not isinstance(max_distance, int) or isinstance(max_distance, bool):
+        raise ValueError("Distance must be a whole number.")
+    if not 0 <= max_distance <= MAX_DISTANCE:
+        raise ValueError(f"Distance must be between 0 and {MAX_DISTANCE}.")
+
+
+@lru_cache(maxsize=128)
+def compile_hash_index(hashes: tuple, max_distance: int) -> HammingIndex:
+    return HammingIndex(hashes, max_distance)
+
+
+class PerceptualHashRule(BaseRule):
+    is_io_bound = True
+
+    def __init__(
+        self, config,
+    ):
+        super().__init__(config)
+        self.name = "perceptualhash"
+
+    async def get_banned_hashes(self, guild: discord.Guild) -> [dict]:
+        return await self._get_setting(guild, BANNED_HASHES_KEY, [])
+
+    async def add_banned_hashes(
+        self, guild: discord.Guild, hashes: [int], author: discord.Member, note: str = None
+    ) -> [int]:
+        """
+        Add image hashes to the banlist
+        Returns
+        -------
+        The hashes that were added, ones already banned are skipped
+        """
+        banned = await self.get_banned_hashes(guild)
+        existing = {entry["hash"] for entry in banned}
+        added = []
+        for value in hashes:
+            formatted = format_hash(value)
+            if formatted in existing:
+                continue
+            existing.add(formatted)
+            banned.append({"hash": formatted, "author": author.id, "note": note})
+            added.append(value)
+
+        if added:
+            await self.config.guild(guild).set_raw(self.rule_name, BANNED_HASHES_KEY, value=banned)
+            self.invalidate_pipeline(guild)
+        return added
+
+    async def remove_banned_hash(self, guild: discord.Guild, value: int) -> None:
+        """Raises ValueError if the hash is not banned"""
+        banned = await self.get_banned_hashes(guild)
+        formatted = format_hash(value)
+        remaining = [entry for entry in banned if entry["hash"] != formatted]
+        if len(remaining) == len(banned):
+            raise ValueError(f"`{formatted}` is not banned.")
+
+        await self.config.guild(guild).set_raw(self.rule_name, BANNED_HASHES_KEY, value=remaining)
+        self.invalidate_pipeline(guild)
+
+    async def get_max_distance(self, guild: discord.Guild) -> int:
+        return await self._get_setting(guild, MAX_DISTANCE_KEY, DEFAULT_MAX_DISTANCE)
+
+    async def set_max_distance(self, guild: discord.Guild, max_distance: int) -> None:
+        """Raises ValueError if the distance is out of the range the index supports"""
+        validate_max_distance(max_distance)
+        await self.config.guild(guild).set_raw(
+            self.rule_name, MAX_DISTANCE_KEY, value=max_distance
+        )
+        self.invalidate_pipeline(guild)
+
+    def validate_settings(self, rule_settings: dict) -> None:
+        super().validate_settings(rule_settings)
+        if MAX_DISTANCE_KEY in rule_settings:
+            validate_max_distance(rule_settings[MAX_DISTANCE_KEY])
+        for entry in rule_settings.get(BANNED_HASHES_KEY) or []:
+            if not isinstance(entry, dict) or not isinstance(entry.get("hash"), str):
+                raise ValueError("Malformed banned hash entry.")
+            parse_hash(entry["hash"])
+
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        hashes = tuple(
+            parse_hash(entry["hash"]) for entry in rule_settings.get(BANNED_HASHES_KEY) or []
+        )
+        # distances set before the cap are clamped to it
+        max_distance = min(rule_settings.get(MAX_DISTANCE_KEY, DEFAULT_MAX_DISTANCE), MAX_DISTANCE)
+        return {"index": compile_hash_index(hashes, max_distance)}
+
+    @staticmethod
+    async def hash_attachment(attachment: discord.Attachment) -> Optional[int]:
+        """Download and hash an image attachment, None if it isn't an image we can read"""
+        if not is_image(attachment) or attachment.size > MAX_IMAGE_SIZE:
+            return None
+
+        try:
+            data = await attachment.read()
+            # decoding is cpu bound, keep it off the event loop
+            return await asyncio.get_event_loop().run_in_executor(None, dhash, data)
+        except discord.HTTPException:
+            log.warning(f"Could not download {attachment.filename} to hash it.")
+        except (OSError, Image.DecompressionBombError):
+            log.warning(f"Could not decode {attachment.filename} as an image.")
+        return None
+
+    async def get_announcement_embed(
+        self,
+        message: discord.Message,
+        message_has_been_deleted: bool,
+        action_taken_success: bool,
+        action_taken: Optional[str],
+        infraction_information=None,
+    ) -> discord.Embed:
+        embed = await super().get_announcement_embed(
+            message,
+            message_has_been_deleted,
+            action_taken_success,
+            action_taken,
+            infraction_information,
+        )
+        for field in infraction_information.extra_fields:
+            embed.add_field(name=field.name, value=field.value)
+        return embed
+
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
+        index: HammingIndex = snapshot.options["index"]
+        if not message.attachments or not index:
+            return
+
+        hashes = await asyncio.gather(*(self.hash_attachment(a) for a in message.attachments))
+        for attachment, value in zip(message.attachments, hashes):
+            if value is None:
+                continue
+            match = index.nearest(value)
+            if match is None:
+                continue
+
+            banned_hash, distance = match
+            return InfractionInformation(
+                message=message.content,
+                rule=self,
+                extra_fields=[
+                    EmbedField("Attachment", f"`{attachment.filename}`"),
+                    EmbedField("Banned image", f"`{format_hash(banned_hash)}`"),
+                    EmbedField("Distance", f"`{distance}` bits"),
+                ],
+            )
@@ -0,0 +1,627 @@
+import asyncio
+import logging
+import multiprocessing
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import FrozenSet, Iterable, List, Mapping, Optional, Pattern, Sequence, Tuple
+
+import discord
+
+from .base import BaseRule
+from .config.models import InfractionInformation, EmbedField
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # python < 3.11
+    import sre_parse
+    import sre_constants
+
+try:
+    # linear time matching, used for every pattern when installed
+    import re2
+except ImportError:
+    re2 = None
+
+log = logging.getLogger("red.breadcogs.automod")
+
+PATTERNS_KEY = "patterns"
+MAX_PATTERNS = 50
+MAX_PATTERN_LENGTH = 300
+# bounded repeats above this are treated like unbounded ones when looking for overlaps
+MAX_BOUNDED_REPEAT = 100
+# seconds a search can run without re2 before its worker process is killed
+REGEX_TIMEOUT = 1.0
+# repeats of a class matching at least this share of characters are `.*`-like wildcards
+WILDCARD_SHARE = 0.9
+
+REPEAT_OPS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, "POSSESSIVE_REPEAT"):
+    REPEAT_OPS.add(sre_constants.POSSESSIVE_REPEAT)
+BACKREFERENCE_OPS = {sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS}
+CHAR_OPS = {
+    sre_constants.LITERAL,
+    sre_constants.NOT_LITERAL,
+    sre_constants.ANY,
+    sre_constants.IN,
+    sre_constants.CATEGORY,
+}
+ATOMIC_GROUP = getattr(sre_constants, "ATOMIC_GROUP", None)
+
+# characters overlaps between parts of a pattern are worked out on: ascii, latin and a few others
+SAMPLE_CHARS = frozenset(map(chr, range(0x250))) | frozenset("\u0430\u03b1\u0663\u2028\u3000")
+CATEGORY_CHARS = {
+    category: frozenset(filter(re.compile(pattern).fullmatch, SAMPLE_CHARS))
+    for category, pattern in (
+        (sre_constants.CATEGORY_DIGIT, r"\d"),
+        (sre_constants.CATEGORY_NOT_DIGIT, r"\D"),
+        (sre_constants.CATEGORY_SPACE, r"\s"),
+        (sre_constants.CATEGORY_NOT_SPACE, r"\S"),
+        (sre_constants.CATEGORY_WORD, r"\w"),
+        (sre_constants.CATEGORY_NOT_WORD, r"\W"),
+    )
+}
+
+
+def _repeat_depth(parsed) -> int:
+    """
+    How deeply repeats are nested in a parsed pattern, raises ValueError on backreferences.
+
+    A repeat is a level when it varies in length, like `a+` or `a{1,100}`, or repeats something
+    that does, like `(a?){25}`. Anything above 1 can backtrack exponentially with python's engine.
+    """
+    depth = 0
+    for op, av in parsed:
+        if op in BACKREFERENCE_OPS:
+            raise ValueError("Backreferences aren't supported.")
+        if op in REPEAT_OPS:
+            low, high, subpattern = av
+            inner = _repeat_depth(subpattern)
+            if inner and high > 1:
+                depth = max(depth, inner + 1)
+            else:
+                depth = max(depth, inner, int(high > low))
+        elif op == sre_constants.SUBPATTERN:
+            depth = max(depth, _repeat_depth(av[-1]))
+        elif op == sre_constants.BRANCH:
+            depth = max([depth] + [_repeat_depth(branch) for branch in av[1]])
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            depth = max(depth, _repeat_depth(av[1]))
+        elif op == ATOMIC_GROUP:
+            depth = max(depth, _repeat_depth(av))
+    return depth
+
+
+def _is_large(high: int) -> bool:
+    return high == sre_constants.MAXREPEAT or high > MAX_BOUNDED_REPEAT
+
+
+def _chars_of(op, av) -> FrozenSet[str]:
+    """Characters a single character item, or a member of a character class, can match"""
+    if op == sre_constants.LITERAL:
+        return frozenset(chr(av))
+    if op == sre_constants.NOT_LITERAL:
+        return SAMPLE_CHARS - {chr(av)}
+    if op == sre_constants.RANGE:
+        low, high = av
+        return frozenset(char for char in SAMPLE_CHARS if low <= ord(char) <= high)
+    if op == sre_constants.CATEGORY:
+        return CATEGORY_CHARS.get(av, SAMPLE_CHARS)
+    if op == sre_constants.IN:
+        chars = frozenset().union(*(_chars_of(*member) for member in av))
+        negated = any(member_op == sre_constants.NEGATE for member_op, _ in av)
+        return SAMPLE_CHARS - chars if negated else chars
+    return SAMPLE_CHARS  # ANY
+
+
+def _children(op, av) -> list:
+    """The sequences an item consuming text is made of, lookarounds excluded"""
+    if op in REPEAT_OPS:
+        return [av[2]]
+    if op == sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_constants.BRANCH:
+        return av[1]
+    if op == ATOMIC_GROUP:
+        return [av]
+    return []
+
+
+def _first(parsed) -> Tuple[FrozenSet[str], bool]:
+    """Characters a match of the sequence can start with, and whether the match can be empty"""
+    first = frozenset()
+    for op, av in parsed:
+        if op in CHAR_OPS:
+            return first | _chars_of(op, av), False
+        children = [_first(child) for child in _children(op, av)]
+        first = first.union(*(chars for chars, _ in children))
+        can_be_empty = any(empty for _, empty in children) or not children
+        if op in REPEAT_OPS:
+            can_be_empty = can_be_empty or av[0] == 0
+        if not can_be_empty:
+            return first, False
+    return first, True
+
+
+def _chars(parsed) -> FrozenSet[str]:
+    """Every character a match of the sequence can contain"""
+    chars = frozenset()
+    for op, av in parsed:
+        if op in CHAR_OPS:
+            chars |= _chars_of(op, av)
+        for child in _children(op, av):
+            chars |= _chars(child)
+    return chars
+
+
+def _edge_repeats(parsed, from_end: bool = False) -> List[FrozenSet[str]]:
+    """Characters of each large repeat a match of the sequence can start, or end, with"""
+    repeats = []
+    for op, av in reversed(parsed) if from_end else parsed:
+        if op in REPEAT_OPS and _is_large(av[1]):
+            repeats.append(_chars(av[2]))
+        elif op not in REPEAT_OPS:
+            for child in _children(op, av):
+                repeats += _edge_repeats(child, from_end)
+        if not _first([(op, av)])[1]:
+            break
+    return repeats
+
+
+def _wildcards(parsed) -> int:
+    """
+    Most `.*`-like repeats a match of the sequence goes through.
+
+    Each can take any share of the text, so with more than one the ways to split it between
+    them grow polynomially with its length, `.*x.*x.*y` is cubic.
+    """
+    count = 0
+    for op, av in parsed:
+        if op == sre_constants.BRANCH:
+            count += max(_wildcards(branch) for branch in av[1])
+            continue
+        if op in REPEAT_OPS:
+            low, high, subpattern = av
+            chars = _chars(subpattern)
+            if high - low > 1 and len(chars) >= WILDCARD_SHARE * len(SAMPLE_CHARS):
+                count += 1
+        for child in _children(op, av):
+            count += _wildcards(child)
+        if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            count += _wildcards(av[1])
+    return count
+
+
+def _overlap(char_sets: List[FrozenSet[str]]) -> bool:
+    return any(a & b for i, a in enumerate(char_sets) for b in char_sets[i + 1 :])
+
+
+def _check_overlaps(parsed, follow: FrozenSet[str] = frozenset(), repeated: bool = False):
+    """
+    Raises ValueError on parts of a pattern that can match the same text in many ways.
+
+    Alternatives that overlap inside a repeat, like `(a|aa)*`, backtrack exponentially and
+    large repeats of overlapping characters next to each other, like `.*.*`, polynomially.
+    `follow` is what can come after the sequence, where an empty alternative carries on.
+    """
+    for i, (op, av) in enumerate(parsed):
+        rest = parsed[i + 1 :]
+        ending = _edge_repeats([(op, av)], from_end=True)
+        if ending and any(a & b for a in ending for b in _edge_repeats(rest)):
+            raise ValueError(
+                "Repeats of the same characters next to each other, like `\\w+\\d+` or `.*.*`,"
+                " can take a very long time, rewrite the pattern."
+            )
+        rest_first, rest_can_be_empty = _first(rest)
+        item_follow = rest_first | follow if rest_can_be_empty else rest_first
+        if op in REPEAT_OPS:
+            body = av[2]
+            if _is_large(av[1]):
+                # the body can be followed by another pass through it
+                _check_overlaps(body, _first(body)[0] | item_follow, repeated=True)
+            else:
+                _check_overlaps(body, item_follow, repeated)
+        elif op == sre_constants.BRANCH:
+            branches = [_first(branch) for branch in av[1]]
+            starts = [first | item_follow if empty else first for first, empty in branches]
+            if repeated and _overlap(starts):
+                raise ValueError(
+                    "Alternatives that can match the same text, like `(a|aa)*`, can take"
+                    " exponential time when repeated, rewrite the pattern."
+                )
+            for branch in av[1]:
+                _check_overlaps(branch, item_follow, repeated)
+        elif op == sre_constants.IN and repeated:
+            # `(\w|\d)` is parsed into a character class
+            members = [_chars_of(*member) for member in av if member[0] != sre_constants.NEGATE]
+            if len(members) == len(av) and _overlap(members):
+                raise ValueError(
+                    "Alternatives that can match the same text, like `(\\w|\\d)+`, can take"
+                    " exponential time when repeated, rewrite the pattern."
+                )
+        elif op in (sre_constants.SUBPATTERN, ATOMIC_GROUP):
+            _check_overlaps(_children(op, av)[0], item_follow, repeated)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _check_overlaps(av[1], repeated=repeated)
+
+
+def validate_pattern(pattern: str) -> None:
+    """
+    Check a pattern is safe to run on every message
+    Raises
+    ------
+    ValueError
+        With the reason the pattern was rejected
+    """
+    if not pattern:
+        raise ValueError("The pattern can't be empty.")
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise ValueError(f"Patterns can't be longer than {MAX_PATTERN_LENGTH} characters.")
+    try:
+        # wrapped the way `compile_regex_filter` combines it, catches global inline flags
+        compiled = re.compile(f"(?:{pattern})")
+    except re.error as e:
+        raise ValueError(f"Invalid pattern: {e}.")
+    if compiled.groupindex:
+        raise ValueError("Named groups aren't supported.")
+    if compiled.search(""):
+        raise ValueError("The pattern matches empty messages, it would match everything.")
+    parsed = sre_parse.parse(pattern)
+    if _repeat_depth(parsed) > 1:
+        raise ValueError(
+            "Nested quantifiers like `(a+)+` can take exponential time, rewrite the pattern."
+        )
+    if _wildcards(parsed) > 1:
+        raise ValueError(
+            "Only one `.*`-like repeat is allowed per pattern, more can take a very long time."
+        )
+    _check_overlaps(parsed)
+    if re2 is not None:
+        try:
+            re2.compile(pattern)
+        except Exception as e:
+            raise ValueError(f"Pattern isn't supported by re2: {e}.")
+
+
+@dataclass(frozen=True)
+class CompiledRegexFilter:
+    """Every pattern combined into one alternation, globally and per channel"""
+
+    patterns: Tuple[str, ...]
+    pattern: Optional[Pattern]
+    # channel id -> combined pattern, already includes the global patterns
+    channels: Mapping[int, Pattern]
+    # group name -> combined pattern of only the patterns added for that group
+    groups: Mapping[str, Pattern]
+
+    def __bool__(self):
+        return self.pattern is not None or bool(self.channels) or bool(self.groups)
+
+    def combined_for(self, channel_id: int, group_names: Iterable[str] = ()) -> List[Pattern]:
+        """The combined patterns to search, in order, for a message in the channel"""
+        combined = [self.channels.get(channel_id, self.pattern)]
+        combined += [self.groups.get(group_name) for group_name in group_names]
+        return [pattern for pattern in combined if pattern is not None]
+
+    def search(
+        self, content: str, channel_id: int, group_names: Iterable[str] = ()
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Single search over the content, and one per group of the channel with patterns
+        Returns
+        -------
+        The pattern that matched and the text it matched, None if nothing did
+        """
+        for combined in self.combined_for(channel_id, group_names):
+            match = combined.search(content)
+            if match is not None:
+                return self.found(combined, match.groups())
+        return None
+
+    def found(self, combined: Pattern, groups: Sequence[Optional[str]]) -> Tuple[str, str]:
+        """The pattern that matched and the text it matched, from the groups of a match"""
+        for name, index in combined.groupindex.items():
+            if groups[index - 1] is not None:
+                return self.patterns[int(name[1:])], groups[index - 1]
+
+
+class RegexWorker:
+    """
+    Searches in a separate process, for when re2 isn't installed.
+
+    Python's engine can't be interrupted, so a search that runs past the timeout is stopped by
+    killing the process, the next search starts a new one.
+    """
+
+    def __init__(self, timeout: float = REGEX_TIMEOUT):
+        self.timeout = timeout
+        self._pool = None
+
+    async def search(
+        self,
+        compiled: CompiledRegexFilter,
+        content: str,
+        channel_id: int,
+        group_names: Iterable[str] = (),
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Same as `CompiledRegexFilter.search`
+        Raises
+        ------
+        asyncio.TimeoutError
+            If the search didn't finish in time
+        """
+        if self._pool is None:
+            # spawned, the bot's threads make forking unsafe
+            self._pool = multiprocessing.get_context("spawn").Pool(1)
+        pool = self._pool
+        try:
+            return await asyncio.wait_for(
+                self._search(pool, compiled, content, channel_id, group_names), self.timeout
+            )
+        except asyncio.TimeoutError:
+            if self._pool is pool:
+                self._pool = None
+                await asyncio.get_running_loop().run_in_executor(None, pool.terminate)
+            raise
+
+    @staticmethod
+    async def _search(pool, compiled, content, channel_id, group_names):
+        loop = asyncio.get_running_loop()
+        for combined in compiled.combined_for(channel_id, group_names):
+            result = loop.create_future()
+
+            def resolve(value, result=result):
+                if not result.done():
+                    result.set_result(value)
+
+            def fail(error, result=result):
+                if not result.done():
+                    result.set_exception(error)
+
+            # only the cog imports this module, the worker gets a bound method of the pattern,
+            # splitting once returns the groups of the first match between the text around it
+            pool.apply_async(
+                combined.split,
+                (content, 1),
+                callback=lambda value: loop.call_soon_threadsafe(resolve, value),
+                error_callback=lambda error: loop.call_soon_threadsafe(fail, error),
+            )
+            parts = await result
+            if len(parts) > 1:
+                return compiled.found(combined, parts[1:-1])
+        return None
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+def regex_key(patterns: [dict]) -> tuple:
+    """Hashable form of the stored patterns, used to only recompile when the list changes"""
+    return tuple(
+        (
+            pattern["pattern"],
+            bool(pattern.get("ignore_case")),
+            tuple(pattern.get("channel") or ()),
+            tuple(pattern.get("groups") or ()),
+        )
+        for pattern in patterns
+    )
+
+
+def _combine(alternatives: [str]) -> Optional[Pattern]:
+    if not alternatives:
+        return None
+    combined = "|".join(alternatives)
+    return re2.compile(combined) if re2 is not None else re.compile(combined)
+
+
+@lru_cache(maxsize=128)
+def compile_regex_filter(key: tuple) -> CompiledRegexFilter:
+    """
+    Build the combined patterns for a list of stored patterns
+    Parameters
+    ----------
+    key
+        The output of `regex_key`
+
+    Returns
+    -------
+    CompiledRegexFilter
+    """
+    patterns = []
+    global_alternatives = []
+    scoped_alternatives = {}
+    group_alternatives = {}
+    for pattern, ignore_case, channels, groups in key:
+        try:
+            validate_pattern(pattern)
+        except ValueError as e:
+            # only possible if the engine changed since the pattern was added
+            log.warning(f"Skipping regex pattern {pattern!r}: {e}")
+            continue
+        # each pattern gets a named group so a match can be traced back to it
+        alternative = f"(?P<p{len(patterns)}>{'(?i:' if ignore_case else '(?:'}{pattern}))"
+        patterns.append(pattern)
+        if not channels and not groups:
+            global_alternatives.append(alternative)
+        for channel_id in channels:
+            scoped_alternatives.setdefault(channel_id, []).append(alternative)
+        for group_name in groups:
+            group_alternatives.setdefault(group_name, []).append(alternative)
+
+    return CompiledRegexFilter(
+        patterns=tuple(patterns),
+        pattern=_combine(global_alternatives),
+        channels={
+            channel_id: _combine(global_alternatives + alternatives)
+            for channel_id, alternatives in scoped_alternatives.items()
+        },
+        groups={
+            group_name: _combine(alternatives)
+            for group_name, alternatives in group_alternatives.items()
+        },
+    )
+
+
+class RegexRule(BaseRule):
+    is_stateless = True
+    scans_inserted_text = True
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.worker = RegexWorker()
+
+    def close(self) -> None:
+        self.worker.close()
+
+    def validate_settings(self, rule_settings: dict) -> None:
+        super().validate_settings(rule_settings)
+        patterns = rule_settings.get(PATTERNS_KEY) or []
+        if len(patterns) > MAX_PATTERNS:
+            raise ValueError(f"You can't filter more than {MAX_PATTERNS} patterns.")
+        for entry in patterns:
+            if not isinstance(entry, dict) or not isinstance(entry.get("pattern"), str):
+                raise ValueError("Malformed regex pattern entry.")
+            validate_pattern(entry["pattern"])
+
+    def memo_key(self, message: discord.Message, analysis: MessageAnalysis) -> tuple:
+        # some entries only apply to some channels, or the groups of their category
+        channel = message.channel
+        return channel.id, getattr(channel, "category_id", None), analysis.content_hash
+
+    async def add_pattern(
+        self,
+        guild: discord.Guild,
+        pattern: str,
+        author: discord.Member,
+        channels: [discord.TextChannel] = None,
+        ignore_case: bool = False,
+        groups: [str] = None,
+    ) -> None:
+        """
+        Add a pattern to the guild's regex filter
+        Parameters
+        ----------
+        pattern
+            The regular expression to look for in messages
+        author
+            The person who added the pattern
+        channels
+            The channels to filter in, everywhere if empty
+        ignore_case
+            Match regardless of case
+        groups
+            Channel groups to filter in, by name so later changes to them apply
+
+        Raises
+        ------
+        ValueError
+            If the pattern is unsafe, invalid, already added or there are too many patterns
+        """
+        validate_pattern(pattern)
+        patterns = await self.get_patterns(guild)
+        if any(existing["pattern"] == pattern for existing in patterns):
+            raise ValueError(f"`{pattern}` is already being filtered.")
+        if len(patterns) >= MAX_PATTERNS:
+            raise ValueError(f"You can't filter more than {MAX_PATTERNS} patterns.")
+
+        patterns.append(
+            {
+                "pattern": pattern,
+                "author": author.id,
+                "ignore_case": ignore_case,
+                "channel": [channel.id for channel in channels] if channels else [],
+                "groups": groups or [],
+            }
+        )
+        await self.config.guild(guild).set_raw(self.rule_name, PATTERNS_KEY, value=patterns)
+        self.invalidate_pipeline(guild)
+
+    async def remove_pattern(self, guild: discord.Guild, pattern: str) -> None:
+        """
+        Remove a pattern from the guild's regex filter
+        Raises
+        ------
+        ValueError
+            If the pattern isn't being filtered
+        """
+        patterns = await self.get_patterns(guild)
+        remaining = [existing for existing in patterns if existing["pattern"] != pattern]
+        if len(remaining) == len(patterns):
+            raise ValueError(f"`{pattern}` is not being filtered.")
+
+        await self.config.guild(guild).set_raw(self.rule_name, PATTERNS_KEY, value=remaining)
+        self.invalidate_pipeline(guild)
+
+    async def get_patterns(self, guild: discord.Guild) -> [dict]:
+        return await self._get_setting(guild, PATTERNS_KEY) or []
+
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        patterns = rule_settings.get(PATTERNS_KEY) or []
+        return {"filter": compile_regex_filter(regex_key(patterns))}
+
+    def referenced_groups(self, rule_settings: dict) -> [str]:
+        return [
+            group_name
+            for pattern in rule_settings.get(PATTERNS_KEY) or []
+            for group_name in pattern.get("groups") or []
+        ]
+
+    async def get_announcement_embed(
+        self,
+        message: discord.Message,
+        message_has_been_deleted: bool,
+        action_taken_success: bool,
+        action_taken: Optional[str],
+        infraction_information=None,
+    ) -> discord.Embed:
+        embed = await super().get_announcement_embed(
+            message,
+            message_has_been_deleted,
+            action_taken_success,
+            action_taken,
+            infraction_information,
+        )
+        for field in infraction_information.extra_fields:
+            embed.add_field(name=field.name, value=field.value)
+        return embed
+
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
+        compiled: CompiledRegexFilter = snapshot.options["filter"]
+        if not compiled:
+            return False
+
+        channel = message.channel
+        group_names = snapshot.channel_groups.groups_of_channel(channel) if compiled.groups else ()
+        if re2 is not None:
+            found = compiled.search(analysis.content, channel.id, group_names)
+        else:
+            try:
+                found = await self.worker.search(
+                    compiled, analysis.content, channel.id, group_names
+                )
+            except asyncio.TimeoutError:
+                log.warning(
+                    f"Regex search in {message.guild} took over {REGEX_TIMEOUT:g}s and was"
+                    " stopped, install re2 to search in linear time"
+                )
+                return False
+        if found is None:
+            return False
+
+        pattern, matched = found
+        return InfractionInformation(
+            message=message.content,
+            rule=self,
+            extra_fields=[
+                EmbedField("Pattern", f"`{pattern}`"),
+                EmbedField("Matched", f"`{matched}`"),
+            ],
+        )
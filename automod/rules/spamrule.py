@@ -1,58 +1,217 @@
 import datetime
 import logging
+import time
 import discord
 import asyncio
 
-from redbot.core.data_manager import bundled_data_path
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import NamedTuple, Optional, Set, Tuple
+
 from .base import BaseRule
-from redbot.core import commands
+from .config.models import InfractionInformation, EmbedField
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
+from ..ratelimit import SlidingWindowCounter, SlidingWindowStore
 from collections import defaultdict
-from ..utils import send_to_paste, chunks
+from ..utils import chunks
 
 
 log = logging.getLogger("red.breadcogs.automod.spamrule")
 
+# (rate, per seconds)
+BY_USER_RATE = (10, 12.0)
+BY_CONTENT_RATE = (15, 17.0)
+# stricter limits used while a guild is being raided
+RAID_BY_USER_RATE = (5, 12.0)
+RAID_BY_CONTENT_RATE = (5, 17.0)
+# upper bound of buckets kept per guild, per store
+MAX_BUCKETS = 5000
+
+# any of these being reached in a guild starts raid mode, (count, per seconds)
+# defaults, each guild can set its own, see `SpamRule.set_raid_threshold`
+RAID_JOIN_RATE = (10, 10.0)
+RAID_MESSAGE_RATE = (60, 10.0)
+RAID_AUTHOR_RATE = (20, 10.0)
+MIN_RAID_COUNT = 2
+# keys a raid counter tracks, a threshold above it could never be reached
+MAX_RAID_COUNT = 5000
+MAX_RAID_WINDOW = 300.0  # seconds
+# raid mode ends once no threshold has been reached for this long
+RAID_COOLDOWN = 120.0
+RAID_CHECK_INTERVAL = 10.0
+# upper bound of offender ids kept per guild, and per raid
+MAX_OFFENDERS = 10000
 
-# Inspiration and some logic taken from RoboDanny
-class CooldownByContent(commands.CooldownMapping):
-    def _bucket_key(self, message: discord.Message,) -> tuple:
-        return (
-            message.channel.id,
-            message.content,
-        )
 
+def timestamp(dt: datetime.datetime) -> float:
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp()
 
+
+# Inspiration and some logic taken from RoboDanny
 class SpamChecker:
-    def __init__(self,):
-        self.by_content = CooldownByContent.from_cooldown(15, 17.0, commands.BucketType.member,)
-        self.by_user = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.user,)
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        self.by_content = SlidingWindowStore(*BY_CONTENT_RATE, max_buckets=max_buckets)
+        self.by_user = SlidingWindowStore(*BY_USER_RATE, max_buckets=max_buckets)
+        self.raid_by_content = SlidingWindowStore(*RAID_BY_CONTENT_RATE, max_buckets=max_buckets)
+        self.raid_by_user = SlidingWindowStore(*RAID_BY_USER_RATE, max_buckets=max_buckets)
 
-    def is_spamming(self, message: discord.Message,) -> bool:
-        current = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+    def is_spamming(self, message: discord.Message, is_raid: bool = False) -> bool:
+        current = timestamp(message.created_at)
+        # hash the content so we never hold on to walls of text
+        content_key = (message.channel.id, hash(message.content))
 
-        user_bucket = self.by_user.get_bucket(message)
-        if user_bucket.update_rate_limit(current):
-            return True
+        # both sets of stores are kept up to date, so switching into raid mode is instant
+        by_user = self.by_user.hit(message.author.id, current)
+        raid_by_user = self.raid_by_user.hit(message.author.id, current)
+        by_content = self.by_content.hit(content_key, current)
+        raid_by_content = self.raid_by_content.hit(content_key, current)
+        if is_raid:
+            return raid_by_user or raid_by_content
+        return by_user or by_content
+
+
+class RaidRates(NamedTuple):
+    """Raid thresholds of a guild, the field names are the settings they're stored under"""
+
+    joins: Tuple[int, float] = RAID_JOIN_RATE
+    messages: Tuple[int, float] = RAID_MESSAGE_RATE
+    # distinct members talking
+    authors: Tuple[int, float] = RAID_AUTHOR_RATE
+
+
+DEFAULT_RAID_RATES = RaidRates()
+
+
+def validate_raid_threshold(name: str, count: int, per: float) -> None:
+    """
+    Raises
+    ------
+    ValueError
+        If the name is not a threshold or the count or window is out of range
+    """
+    if name not in RaidRates._fields:
+        raise ValueError(f"`{name}` is not a raid threshold.")
+    for value in (count, per):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError(f"`{name}` must be a count and a window in seconds.")
+    if not MIN_RAID_COUNT <= count <= MAX_RAID_COUNT or count != int(count):
+        raise ValueError(f"The count must be between `{MIN_RAID_COUNT}` and `{MAX_RAID_COUNT}`.")
+    if not 0 < per <= MAX_RAID_WINDOW:
+        raise ValueError(f"The window must be between `0` and `{MAX_RAID_WINDOW:g}` seconds.")
+
+
+@dataclass
+class RaidState:
+    started_at: float
+    # last time a raid threshold was reached
+    last_seen: float
+    reason: str
+    offenders: Set[int] = field(default_factory=set)
+
+    def add_offender(self, member_id: int) -> None:
+        if len(self.offenders) < MAX_OFFENDERS:
+            self.offenders.add(member_id)
+
+
+class RaidDetector:
+    """
+    Guild wide join, message and distinct author rates in sliding windows.
+
+    Reaching any of the thresholds puts the guild in raid mode, which ends once none
+    of them has been reached for `cooldown` seconds.
+    """
+
+    def __init__(self, cooldown: float = RAID_COOLDOWN, rates: RaidRates = DEFAULT_RAID_RATES):
+        self.cooldown = cooldown
+        self.rates = rates
+        self.joins = SlidingWindowCounter(rates.joins[1], MAX_RAID_COUNT)
+        self.messages = SlidingWindowCounter(rates.messages[1], MAX_RAID_COUNT)
+        self.authors = SlidingWindowCounter(rates.authors[1], MAX_RAID_COUNT)
+        self.raid: Optional[RaidState] = None
+
+    def set_rates(self, rates: RaidRates) -> None:
+        """Switch to new thresholds, counters whose window changed start over"""
+        if rates == self.rates:
+            return
+        # the counters are named after the thresholds
+        for name, (_, per) in zip(rates._fields, rates):
+            if per != getattr(self.rates, name)[1]:
+                setattr(self, name, SlidingWindowCounter(per, MAX_RAID_COUNT))
+        self.rates = rates
+
+    @property
+    def is_raid(self) -> bool:
+        return self.raid is not None
+
+    def _reached(self, reason: str, current: float) -> bool:
+        """Returns True if this started raid mode"""
+        if self.raid is not None:
+            self.raid.last_seen = current
+            return False
+        self.raid = RaidState(started_at=current, last_seen=current, reason=reason)
+        return True
 
-        content_bucket = self.by_content.get_bucket(message)
-        return bool(content_bucket.update_rate_limit(current))
+    def record_join(self, member_id: int, current: float) -> bool:
+        """Returns True if this join started raid mode"""
+        joins = self.joins.hit(member_id, current)
+        count, per = self.rates.joins
+        if joins >= count:
+            return self._reached(f"{joins} joins in {per:g}s", current)
+        return False
+
+    def record_message(self, message_id: int, author_id: int, current: float) -> bool:
+        """Returns True if this message started raid mode"""
+        messages = self.messages.hit(message_id, current)
+        authors = self.authors.hit(author_id, current)
+        (message_count, message_per), (author_count, author_per) = self.rates[1:]
+        if messages >= message_count:
+            return self._reached(f"{messages} messages in {message_per:g}s", current)
+        if authors >= author_count:
+            return self._reached(f"{authors} people talking in {author_per:g}s", current)
+        return False
+
+    def should_end(self, current: float) -> bool:
+        return self.raid is not None and current - self.raid.last_seen >= self.cooldown
+
+    def end(self) -> Optional[RaidState]:
+        raid, self.raid = self.raid, None
+        return raid
 
 
 class SpamRule(BaseRule):
     """
     1) It checks if a user has spammed more than 10 times in 12 seconds
     2) It checks if the content has been spammed 15 times in 17 seconds.
+
+    During a raid both drop to 5 times, see `RaidDetector`.
     """
 
     def __init__(self, config, bot, data_path, *args, **kwargs):
         super().__init__(config, *args, **kwargs)
         self._spam_check = defaultdict(SpamChecker)
-        self.user_cache = []
+        self._raids = defaultdict(RaidDetector)
+        # guild id -> ids of members caught spamming since the last export
+        self.offenders = defaultdict(set)
         self.bot = bot
         self.data_path = data_path
-        self.is_sleeping = False
+        self.raid_check_interval = RAID_CHECK_INTERVAL
+        # guild id -> task ending raid mode once it's quiet
+        self._raid_watchers = {}
 
-    async def make_nice_string(self, list_of_ids) -> str:
+    def get_stats(self, guild: discord.Guild) -> dict:
+        """Bucket stats for a guild, this does not create a checker if there is none"""
+        checker = self._spam_check.get(guild.id)
+        if checker is None:
+            return {}
+        return {"by_user": checker.by_user.stats(), "by_content": checker.by_content.stats()}
+
+    def get_raid(self, guild: discord.Guild) -> Optional[RaidState]:
+        detector = self._raids.get(guild.id)
+        return detector.raid if detector is not None else None
+
+    @staticmethod
+    def format_offenders(list_of_ids) -> str:
         users_chunked = chunks(list_of_ids, 3)
         string_to_return = (
             f"# {str(datetime.date.today())}\n# {len(list_of_ids)} total users.\n" f"----\n\n"
@@ -63,27 +222,150 @@ class SpamRule(BaseRule):
 
         return string_to_return
 
-    async def finish_collecting(self, message):
-        if not self.is_sleeping:
-            channel = await self.config.guild(message.guild).get_raw(
-                "settings", "announcement_channel"
+    async def export_offenders(self, guild: discord.Guild, clear: bool = False) -> discord.File:
+        """The ids collected in a guild as a file"""
+        offender_ids = self.offenders[guild.id]
+        if clear:
+            self.offenders.pop(guild.id, None)
+        return await self._offenders_file(guild, offender_ids)
+
+    async def _offenders_file(self, guild: discord.Guild, offender_ids: Set[int]) -> discord.File:
+        """Formatted in an executor as raids can be big"""
+        offender_ids = sorted(offender_ids)
+        data = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: self.format_offenders(offender_ids).encode()
+        )
+        return discord.File(BytesIO(data), filename=f"spam-offenders-{guild.id}.md")
+
+    def _add_offender(self, guild_id: int, member_id: int) -> None:
+        offenders = self.offenders[guild_id]
+        if len(offenders) < MAX_OFFENDERS:
+            offenders.add(member_id)
+
+    async def get_raid_thresholds(self, guild: discord.Guild) -> RaidRates:
+        """The guild's raid thresholds, defaults filled in"""
+        return RaidRates(
+            *[
+                tuple(await self._get_setting(guild, name, default))
+                for name, default in zip(RaidRates._fields, DEFAULT_RAID_RATES)
+            ]
+        )
+
+    async def set_raid_threshold(
+        self, guild: discord.Guild, name: str, count: int, per: float
+    ) -> None:
+        """
+        Set one of the `RaidRates` thresholds
+        Raises
+        ------
+        ValueError
+            If the name is not a threshold or the count or window is out of range
+        """
+        validate_raid_threshold(name, count, per)
+        await self.config.guild(guild).set_raw(self.rule_name, name, value=[count, per])
+        self.invalidate_pipeline(guild)
+
+    async def reset_raid_threshold(self, guild: discord.Guild, name: str) -> None:
+        if name not in RaidRates._fields:
+            raise ValueError(f"`{name}` is not a raid threshold.")
+        await self.config.guild(guild).clear_raw(self.rule_name, name)
+        self.invalidate_pipeline(guild)
+
+    def validate_settings(self, rule_settings: dict) -> None:
+        super().validate_settings(rule_settings)
+        for name in RaidRates._fields:
+            if name not in rule_settings:
+                continue
+            threshold = rule_settings[name]
+            if not isinstance(threshold, list) or len(threshold) != 2:
+                raise ValueError(f"`{name}` must be a count and a window in seconds.")
+            validate_raid_threshold(name, *threshold)
+
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        return {
+            "announcement_channel": guild_settings.get("announcement_channel"),
+            "raid_rates": RaidRates(
+                *[
+                    tuple(rule_settings.get(name, default))
+                    for name, default in zip(RaidRates._fields, DEFAULT_RAID_RATES)
+                ]
+            ),
+        }
+
+    def _detector(self, guild_id: int, snapshot: RuleSnapshot) -> RaidDetector:
+        detector = self._raids[guild_id]
+        detector.set_rates(snapshot.options["raid_rates"])
+        return detector
+
+    def record_join(self, member: discord.Member, snapshot: RuleSnapshot) -> None:
+        """Count a member joining towards raid detection"""
+        detector = self._detector(member.guild.id, snapshot)
+        if detector.record_join(member.id, timestamp(member.joined_at)):
+            self._start_raid(member.guild, snapshot)
+
+    def _start_raid(self, guild: discord.Guild, snapshot: RuleSnapshot) -> None:
+        raid = self._raids[guild.id].raid
+        log.warning(f"Raid mode started in {guild} ({guild.id}): {raid.reason}")
+        self.bot.dispatch("automod_raid", guild, True)
+        channel_id = snapshot.announce_channel_id or snapshot.options["announcement_channel"]
+        channel = guild.get_channel(channel_id) if channel_id else None
+        self._raid_watchers[guild.id] = asyncio.ensure_future(self._watch_raid(guild, channel))
+
+    async def _watch_raid(self, guild: discord.Guild, channel) -> None:
+        """Announce raid mode, then end it once the guild is quiet again and send the offenders"""
+        detector = self._raids[guild.id]
+        if channel is not None:
+            await self._send(
+                channel,
+                f"`🚨` Raid mode enabled: {detector.raid.reason}. Spam limits are now stricter.",
+            )
+
+        while not detector.should_end(time.time()):
+            await asyncio.sleep(self.raid_check_interval)
+
+        raid = detector.end()
+        self._raid_watchers.pop(guild.id, None)
+        log.warning(f"Raid mode ended in {guild} ({guild.id})")
+        self.bot.dispatch("automod_raid", guild, False)
+        if channel is not None:
+            await self._send(
+                channel,
+                f"`✅` Raid mode ended. `{len(raid.offenders)}` members were caught spamming.",
+                # only the raid's, the guild wide list is left for `[p]spamrule offenders`
+                file=await self._offenders_file(guild, raid.offenders) if raid.offenders else None,
             )
-            channel = message.guild.get_channel(channel)
-            self.is_sleeping = True
-            await asyncio.sleep(
-                300
-            )  # wait 5 minutes before we send the file to allow the cacheing to catch up
-            st = await self.make_nice_string(list(set(self.user_cache)))
-            paste = await send_to_paste(st, "md")
-            await channel.send(f"ID's found during most recent spamrule encounter: {paste}")
-
-    async def is_offensive(self, message: discord.Message,) -> bool:
-        checker = self._spam_check[message.guild.id]
-        if not checker.is_spamming(message):
+
+    @staticmethod
+    async def _send(channel, content: str, file: discord.File = None) -> None:
+        try:
+            await channel.send(content, file=file)
+        except discord.HTTPException as e:
+            log.warning(f"Could not send raid announcement: {e}")
+
+    def close(self) -> None:
+        for task in self._raid_watchers.values():
+            task.cancel()
+        self._raid_watchers.clear()
+
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
+        guild = message.guild
+        detector = self._detector(guild.id, snapshot)
+        if detector.record_message(message.id, message.author.id, timestamp(message.created_at)):
+            self._start_raid(guild, snapshot)
+
+        checker = self._spam_check[guild.id]
+        if not checker.is_spamming(message, is_raid=detector.is_raid):
             return False
 
-        if message.author.id not in self.user_cache:
-            self.user_cache.append(message.author.id)
-        await self.finish_collecting(message)
+        self._add_offender(guild.id, message.author.id)
+        if not detector.is_raid:
+            return True
 
-        return True
+        detector.raid.add_offender(message.author.id)
+        return InfractionInformation(
+            message=message.content,
+            rule=self,
+            extra_fields=[EmbedField("Raid mode", detector.raid.reason)],
+        )
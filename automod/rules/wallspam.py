@@ -1,12 +1,175 @@
-from typing import Union
+import math
+import re
+from collections import Counter
+from typing import Optional, Union
 
 import discord
 
 from .config.WallspamRuleConfig import WallspamRuleConfig
+from .config.models import InfractionInformation, EmbedField
 from .base import BaseRule
+from ..analysis import MessageAnalysis
+from ..pipeline import RuleSnapshot
+
+DEFAULT_EMPTYLINE_THRESHOLD = 5
+
+# setting -> (default, type, minimum, maximum), a default of None means the check is off until set
+WALL_TEXT_THRESHOLDS = {
+    WallspamRuleConfig.long_word_threshold: (500, int, 1, None),
+    WallspamRuleConfig.repeated_word_threshold: (25, int, 1, None),
+    WallspamRuleConfig.repetition_ratio: (None, float, 0.0, 1.0),
+    WallspamRuleConfig.word_run_threshold: (None, int, 2, None),
+    WallspamRuleConfig.char_run_threshold: (None, int, 2, None),
+    WallspamRuleConfig.min_entropy: (None, float, 0.0, None),
+}
+
+# short messages are too small for these to mean anything
+MIN_WORDS_FOR_RATIO = 20
+MIN_CHARS_FOR_ENTROPY = 100
+
+
+def validate_wall_text_threshold(
+    name: str, value: Optional[Union[int, float]]
+) -> Optional[Union[int, float]]:
+    """
+    Check a value for one of `WALL_TEXT_THRESHOLDS`
+    Returns
+    -------
+    The value cast to the threshold's type
+    Raises
+    ------
+    ValueError
+        If the name is not a threshold, the value is out of range or isn't a whole number
+        for a count
+    """
+    if name not in WALL_TEXT_THRESHOLDS:
+        raise ValueError(f"`{name}` is not a wall text threshold.")
+    if value is None:
+        return None
+    _, cast, minimum, maximum = WALL_TEXT_THRESHOLDS[name]
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise ValueError(f"`{name}` must be a number.")
+    if cast is int and value != int(value):
+        raise ValueError(f"`{name}` must be a whole number.")
+    value = cast(value)
+    if value < minimum or (maximum is not None and value > maximum):
+        if maximum is None:
+            raise ValueError(f"`{name}` must be at least `{minimum}`.")
+        raise ValueError(f"`{name}` must be between `{minimum}` and `{maximum}`.")
+    return value
+
+
+def char_entropy(content: str) -> float:
+    """Shannon entropy in bits per character, walls of the same few characters score low"""
+    length = len(content)
+    return -sum(
+        count / length * math.log2(count / length) for count in Counter(content).values()
+    )
+
+
+def longest_word_run(tokens: [str]) -> int:
+    """Most times the same word appears back to back"""
+    longest = run = 0
+    previous = None
+    for token in tokens:
+        run = run + 1 if token == previous else 1
+        previous = token
+        if run > longest:
+            longest = run
+    return longest
+
+
+class WallTextDetector:
+    """
+    Wall text checks for one guild's thresholds, built once per pipeline.
+
+    Every check is a single pass over the content or its tokens and checks that are
+    turned off cost nothing.
+    """
+
+    __slots__ = (
+        "emptyline_threshold",
+        "long_word",
+        "repeated_word",
+        "repetition_ratio",
+        "word_run",
+        "char_run",
+        "min_entropy",
+        "_char_run_re",
+    )
+
+    def __init__(
+        self,
+        emptyline_threshold: Optional[int] = None,
+        long_word: Optional[int] = 500,
+        repeated_word: Optional[int] = 25,
+        repetition_ratio: Optional[float] = None,
+        word_run: Optional[int] = None,
+        char_run: Optional[int] = None,
+        min_entropy: Optional[float] = None,
+    ):
+        self.emptyline_threshold = emptyline_threshold
+        self.long_word = long_word
+        self.repeated_word = repeated_word
+        self.repetition_ratio = repetition_ratio
+        self.word_run = word_run
+        self.char_run = char_run
+        self.min_entropy = min_entropy
+        # the regex engine finds the run, no python loop over every character
+        self._char_run_re = (
+            re.compile(r"(.)\1{%d,}" % (char_run - 1), re.S) if char_run is not None else None
+        )
+
+    def check(self, analysis: MessageAnalysis) -> Optional[str]:
+        """The reason the message is a wall of text, None if it isn't"""
+        content = analysis.content
+        if (
+            self.emptyline_threshold is not None
+            and analysis.longest_newline_run >= self.emptyline_threshold
+        ):
+            return f"{analysis.longest_newline_run} empty lines in a row"
+
+        tokens = analysis.tokens
+        if not tokens:
+            return None
+
+        first = tokens[0]
+        if self.long_word is not None and len(first) > self.long_word:
+            return f"First word is {len(first)} characters long"
+
+        # the first word has no whitespace so it can't match across words,
+        # counting over the whole content is the same as counting per word
+        if self.repeated_word is not None:
+            repeats = content.count(first)
+            if repeats > self.repeated_word:
+                return f"First word repeated {repeats} times"
+
+        if self.repetition_ratio is not None and len(tokens) >= MIN_WORDS_FOR_RATIO:
+            ratio = 1 - len(set(tokens)) / len(tokens)
+            if ratio >= self.repetition_ratio:
+                return f"{ratio:.0%} of words are repeats"
+
+        if self.word_run is not None:
+            run = longest_word_run(tokens)
+            if run >= self.word_run:
+                return f"The same word {run} times in a row"
+
+        if self._char_run_re is not None:
+            match = self._char_run_re.search(content)
+            if match is not None:
+                return f"`{match.group(1)}` repeated {len(match.group(0))} times in a row"
+
+        if self.min_entropy is not None and len(content) >= MIN_CHARS_FOR_ENTROPY:
+            entropy = char_entropy(content)
+            if entropy < self.min_entropy:
+                return f"Character entropy of {entropy:.2f} bits"
+
+        return None
 
 
 class WallSpamRule(BaseRule):
+    is_stateless = True
+
     def __init__(self, config):
         super().__init__(config)
         self.name = "wallspamrule"
@@ -24,6 +187,7 @@ class WallSpamRule(BaseRule):
         await self.config.guild(guild).set_raw(
             self.rule_name, WallspamRuleConfig.emptyline_enabled, value=is_enabled
         )
+        self.invalidate_pipeline(guild)
 
     async def get_is_emptyline_offensive(self, guild: discord.Guild) -> bool:
         """
@@ -54,6 +218,7 @@ class WallSpamRule(BaseRule):
         await self.config.guild(guild).set_raw(
             self.rule_name, WallspamRuleConfig.emptyline_threshold, value=number_of_lines
         )
+        self.invalidate_pipeline(guild)
 
     async def get_emptyline_threshold(self, guild: discord.Guild) -> int:
         """
@@ -69,7 +234,7 @@ class WallSpamRule(BaseRule):
             )
         except KeyError:
             # not set, default to 5
-            return 5
+            return DEFAULT_EMPTYLINE_THRESHOLD
 
     @staticmethod
     async def is_emptyline_spam(message_content: str, threshold: int) -> bool:
@@ -78,28 +243,99 @@ class WallSpamRule(BaseRule):
 
     @staticmethod
     async def first_character_repeating(message_content: str) -> bool:
-        message_content = message_content.split()
-        return len(message_content[0]) > 500
+        return len(message_content.split(maxsplit=1)[0]) > 500
 
     @staticmethod
     async def is_wall_text(message_content: str) -> bool:
-        message_content = message_content.split()
-        return sum((item.count(message_content[0]) for item in message_content)) > 25
+        return message_content.count(message_content.split(maxsplit=1)[0]) > 25
+
+    async def get_wall_text_thresholds(self, guild: discord.Guild) -> dict:
+        """Every wall text threshold, defaults filled in"""
+        return {
+            name: await self._get_setting(guild, name, default)
+            for name, (default, *_) in WALL_TEXT_THRESHOLDS.items()
+        }
+
+    async def set_wall_text_threshold(
+        self, guild: discord.Guild, name: str, value: Optional[Union[int, float]]
+    ) -> Optional[Union[int, float]]:
+        """
+        Set one of `WALL_TEXT_THRESHOLDS`, None turns the check off
+        Returns
+        -------
+        The value stored
+        Raises
+        ------
+        ValueError
+            If the name is not a threshold, the value is out of range or isn't a whole number
+            for a count
+        """
+        value = validate_wall_text_threshold(name, value)
+        await self.config.guild(guild).set_raw(self.rule_name, name, value=value)
+        self.invalidate_pipeline(guild)
+        return value
+
+    async def reset_wall_text_threshold(self, guild: discord.Guild, name: str) -> None:
+        if name not in WALL_TEXT_THRESHOLDS:
+            raise ValueError(f"`{name}` is not a wall text threshold.")
+        await self.config.guild(guild).clear_raw(self.rule_name, name)
+        self.invalidate_pipeline(guild)
+
+    def validate_settings(self, rule_settings: dict) -> None:
+        super().validate_settings(rule_settings)
+        for name in WALL_TEXT_THRESHOLDS.keys() & rule_settings.keys():
+            validate_wall_text_threshold(name, rule_settings[name])
+
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        thresholds = {
+            name: rule_settings.get(name, default)
+            for name, (default, *_) in WALL_TEXT_THRESHOLDS.items()
+        }
+        emptyline_threshold = None
+        if rule_settings.get(WallspamRuleConfig.emptyline_enabled, False):
+            emptyline_threshold = rule_settings.get(
+                WallspamRuleConfig.emptyline_threshold, DEFAULT_EMPTYLINE_THRESHOLD
+            )
+        return {
+            "detector": WallTextDetector(
+                emptyline_threshold=emptyline_threshold,
+                long_word=thresholds[WallspamRuleConfig.long_word_threshold],
+                repeated_word=thresholds[WallspamRuleConfig.repeated_word_threshold],
+                repetition_ratio=thresholds[WallspamRuleConfig.repetition_ratio],
+                word_run=thresholds[WallspamRuleConfig.word_run_threshold],
+                char_run=thresholds[WallspamRuleConfig.char_run_threshold],
+                min_entropy=thresholds[WallspamRuleConfig.min_entropy],
+            )
+        }
+
+    async def get_announcement_embed(
+        self,
+        message: discord.Message,
+        message_has_been_deleted: bool,
+        action_taken_success: bool,
+        action_taken: Optional[str],
+        infraction_information=None,
+    ) -> discord.Embed:
+        embed = await super().get_announcement_embed(
+            message,
+            message_has_been_deleted,
+            action_taken_success,
+            action_taken,
+            infraction_information,
+        )
+        if infraction_information is not None:
+            for field in infraction_information.extra_fields:
+                embed.add_field(name=field.name, value=field.value)
+        return embed
 
     async def is_offensive(
-        self, message,
+        self, message, snapshot: RuleSnapshot, analysis: MessageAnalysis,
     ):
-        try:
-            is_checking_for_emptylines = await self.get_is_emptyline_offensive(message.guild)
-            if is_checking_for_emptylines:
-                threshold = await self.get_emptyline_threshold(message.guild)
-                return await self.is_emptyline_spam(message.content, threshold)
-
-            first_character_repeating = await self.first_character_repeating(message.content)
-            is_wall_text = await self.is_wall_text(message.content)
-
-            if is_wall_text or first_character_repeating:
-                return True
-        except IndexError:
-            # probably one word message.
-            pass
+        detector: WallTextDetector = snapshot.options["detector"]
+        reason = detector.check(analysis)
+        if reason is None:
+            return False
+
+        return InfractionInformation(
+            message=message.content, rule=self, extra_fields=[EmbedField("Reason", reason)],
+        )
@@ -1,18 +1,109 @@
 import discord
 from .base import BaseRule
-import re
+from .config.models import InfractionInformation, EmbedField
+from ..ahocorasick import AhoCorasick
+from ..analysis import MENTION_RE, PUNCTUATION_TABLE, MessageAnalysis
+from ..normalize import normalize_text
+from ..pipeline import RuleSnapshot
 
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Mapping, Optional, Tuple
 from ..utils import *
 import logging
 
 log = logging.getLogger("red.breadcogs.automod")
 
 
+@dataclass(frozen=True)
+class CompiledWordFilter:
+    """Automata for raw and cleaned words, globally and per channel"""
+
+    raw: AhoCorasick
+    cleaned: AhoCorasick
+    # channel id -> (raw, cleaned), already includes the global words
+    channels: Mapping[int, Tuple[AhoCorasick, AhoCorasick]]
+    # group name -> (raw, cleaned), only the words added for that group
+    groups: Mapping[str, Tuple[AhoCorasick, AhoCorasick]]
+
+    def __bool__(self):
+        return bool(self.raw or self.cleaned or self.channels or self.groups)
+
+    def automata_for(self, channel_id: int) -> Tuple[AhoCorasick, AhoCorasick]:
+        return self.channels.get(channel_id, (self.raw, self.cleaned))
+
+
+def filter_key(filtered_words: [dict], with_channels: bool = True) -> tuple:
+    """Hashable form of the filtered words, used to only recompile when the list changes"""
+    return tuple(
+        (
+            word["word"],
+            bool(word["is_cleaned"]),
+            tuple(word.get("channel") or ()) if with_channels else (),
+            tuple(word.get("groups") or ()) if with_channels else (),
+        )
+        for word in filtered_words
+    )
+
+
+@lru_cache(maxsize=128)
+def compile_word_filter(key: tuple) -> CompiledWordFilter:
+    """
+    Build the automata for a list of filtered words
+    Parameters
+    ----------
+    key
+        The output of `filter_key`
+
+    Returns
+    -------
+    CompiledWordFilter
+    """
+    global_words = ([], [])  # (raw, cleaned)
+    scoped_words = defaultdict(lambda: ([], []))
+    group_words = defaultdict(lambda: ([], []))
+    for word, is_cleaned, channels, groups in key:
+        # matched against `MessageAnalysis.normalized`
+        word = normalize_text(word)
+        if not channels and not groups:
+            global_words[is_cleaned].append(word)
+        for channel_id in channels:
+            scoped_words[channel_id][is_cleaned].append(word)
+        for group_name in groups:
+            group_words[group_name][is_cleaned].append(word)
+
+    channels = {
+        channel_id: (
+            AhoCorasick(global_words[0] + raw),
+            AhoCorasick(global_words[1] + cleaned),
+        )
+        for channel_id, (raw, cleaned) in scoped_words.items()
+    }
+    return CompiledWordFilter(
+        raw=AhoCorasick(global_words[0]),
+        cleaned=AhoCorasick(global_words[1]),
+        channels=channels,
+        groups={
+            group_name: (AhoCorasick(raw), AhoCorasick(cleaned))
+            for group_name, (raw, cleaned) in group_words.items()
+        },
+    )
+
+
 class WordFilterRule(BaseRule):
+    is_stateless = True
+    scans_inserted_text = True
+
     def __init__(self, config):
         super().__init__(config)
         self.name = "filterword"
 
+    def memo_key(self, message: discord.Message, analysis: MessageAnalysis) -> tuple:
+        # some entries only apply to some channels, or the groups of their category
+        channel = message.channel
+        return channel.id, getattr(channel, "category_id", None), analysis.content_hash
+
     async def add_to_filter(
         self,
         guild: discord.Guild,
@@ -20,6 +111,7 @@ class WordFilterRule(BaseRule):
         author: discord.Member,
         channels: [discord.TextChannel] = None,
         is_cleaned: bool = False,
+        groups: [str] = None,
     ) -> None:
         """
         Add a word to the filter list
@@ -40,6 +132,9 @@ class WordFilterRule(BaseRule):
         guild: discord.Guild
             The guild where the filtered word applies
 
+        groups: [str], Optional
+            Channel groups where to filter, by name so later changes to them apply
+
         Returns
         -------
         None
@@ -49,15 +144,15 @@ class WordFilterRule(BaseRule):
             "author": author.id,
             "is_cleaned": is_cleaned,
             "channel": [channel.id for channel in channels] if channels else [],
+            "groups": groups or [],
         }
         try:
             words = await self.config.guild(guild).get_raw(self.rule_name, "words")
             words.append(to_append)
             await self.config.guild(guild).set_raw(self.rule_name, "words", value=words)
         except KeyError:
-            return await self.config.guild(guild).set_raw(
-                self.rule_name, "words", value=[to_append]
-            )
+            await self.config.guild(guild).set_raw(self.rule_name, "words", value=[to_append])
+        self.invalidate_pipeline(guild)
 
     async def remove_filter(self, guild: discord.Guild, word: str) -> None:
         """
@@ -76,12 +171,75 @@ class WordFilterRule(BaseRule):
         -------
             ValueError if word is not found
         """
+        await self.remove_many_from_filter(guild, [word])
+
+    async def add_many_to_filter(
+        self,
+        guild: discord.Guild,
+        words: [str],
+        author: discord.Member,
+        channels: [discord.TextChannel] = None,
+        is_cleaned: bool = False,
+    ) -> [str]:
+        """
+        Add many words to the filter list with a single config write
+        Parameters
+        ----------
+        words: [str]
+            The words to filter, lowercased like the ones added one at a time
+        author: discord.Member
+            The person who added the words to the filter
+        channels: [discord.TextChannel], Optional
+            The channels where to filter, global if not given
+        is_cleaned: bool
+            If True all punctuation will be removed from the words being checked
+
+        Returns
+        -------
+        [str]
+            The words added, words already being filtered are skipped
+        """
         all_words = await self.get_filtered_words(guild)
-        for index, word_dict in enumerate(all_words):
-            if word.lower() == word_dict["word"]:
-                all_words.pop(index)
+        filtered = {word_dict["word"] for word_dict in all_words}
+        channel_ids = [channel.id for channel in channels] if channels else []
+        added = []
+        for word in words:
+            word = word.lower()
+            if not word or word in filtered:
+                continue
+            filtered.add(word)
+            added.append(word)
+            all_words.append(
+                {
+                    "word": word,
+                    "author": author.id,
+                    "is_cleaned": is_cleaned,
+                    "channel": list(channel_ids),
+                }
+            )
+
+        if added:
+            await self.config.guild(guild).set_raw(self.rule_name, "words", value=all_words)
+            self.invalidate_pipeline(guild)
+        return added
+
+    async def remove_many_from_filter(self, guild: discord.Guild, words: [str]) -> [str]:
+        """
+        Remove many words from the filter list with a single config write
+        Returns
+        -------
+        [str]
+            The words removed, words that weren't being filtered are skipped
+        """
+        to_remove = {word.lower() for word in words}
+        all_words = await self.get_filtered_words(guild)
+        kept = [word_dict for word_dict in all_words if word_dict["word"] not in to_remove]
+        if len(kept) == len(all_words):
+            return []
 
-        await self.config.guild(guild).set_raw(self.rule_name, "words", value=all_words)
+        await self.config.guild(guild).set_raw(self.rule_name, "words", value=kept)
+        self.invalidate_pipeline(guild)
+        return [word_dict["word"] for word_dict in all_words if word_dict["word"] in to_remove]
 
     async def get_filtered_words(self, guild: discord.Guild) -> [dict]:
         """
@@ -103,32 +261,111 @@ class WordFilterRule(BaseRule):
 
     @staticmethod
     def remove_punctuation(sentence: str):
-        from string import punctuation
-
-        return sentence.translate(str.maketrans("", "", punctuation))
+        return sentence.translate(PUNCTUATION_TABLE)
 
     @staticmethod
     def no_mentions(sentence: str):
-        return re.sub(r"<@!?(\d+)>", "", sentence)
+        return MENTION_RE.sub("", sentence)
+
+    def find_filtered(
+        self,
+        sentence: str,
+        raw: AhoCorasick,
+        cleaned: AhoCorasick,
+        sentence_without_punctuation: str = None,
+    ) -> Optional[str]:
+        """
+        Single pass over the sentence for each automaton
+        Returns
+        -------
+        The filtered word found, None if the sentence is clean
+        """
+        found = raw.search(sentence)
+        if found is None and cleaned:
+            if sentence_without_punctuation is None:
+                sentence_without_punctuation = self.remove_punctuation(sentence)
+            found = cleaned.search(sentence_without_punctuation)
+        return found
 
     async def is_filtered(self, sentence: str, filtered_words: [dict]):
-        for word in filtered_words:
-            to_filter = word["word"]
-            is_cleaned = word["is_cleaned"]
+        """Checks the sentence against all filtered words, regardless of their channels"""
+        compiled = compile_word_filter(filter_key(filtered_words, with_channels=False))
+        sentence = normalize_text(sentence)
+        return self.find_filtered(sentence, compiled.raw, compiled.cleaned) is not None
+
+    def compile_options(self, rule_settings: dict, guild_settings: dict) -> dict:
+        return {"filter": compile_word_filter(filter_key(rule_settings.get("words") or []))}
+
+    def referenced_groups(self, rule_settings: dict) -> [str]:
+        return [
+            group_name
+            for word in rule_settings.get("words") or []
+            for group_name in word.get("groups") or []
+        ]
 
-            if is_cleaned:
-                sentence = self.remove_punctuation(sentence)
+    async def get_announcement_embed(
+        self,
+        message: discord.Message,
+        message_has_been_deleted: bool,
+        action_taken_success: bool,
+        action_taken: Optional[str],
+        infraction_information=None,
+    ) -> discord.Embed:
+        embed = await super().get_announcement_embed(
+            message,
+            message_has_been_deleted,
+            action_taken_success,
+            action_taken,
+            infraction_information,
+        )
+        for field in infraction_information.extra_fields:
+            embed.add_field(name=field.name, value=field.value)
+        return embed
 
-            if to_filter in sentence:
-                return True
+    def _find_in_groups(
+        self,
+        compiled: CompiledWordFilter,
+        snapshot: RuleSnapshot,
+        channel: discord.TextChannel,
+        analysis: MessageAnalysis,
+    ) -> Optional[str]:
+        for group_name in snapshot.channel_groups.groups_of_channel(channel):
+            automata = compiled.groups.get(group_name)
+            if automata is None:
+                continue
+            raw, cleaned = automata
+            found = self.find_filtered(
+                analysis.normalized,
+                raw,
+                cleaned,
+                analysis.normalized_without_punctuation if cleaned else None,
+            )
+            if found is not None:
+                return found
+        return None
 
-        return False
+    async def is_offensive(
+        self, message: discord.Message, snapshot: RuleSnapshot, analysis: MessageAnalysis
+    ):
+        compiled: CompiledWordFilter = snapshot.options["filter"]
+        if not compiled:
+            return False
 
-    async def is_offensive(self, message: discord.Message):
-        all_words = await self.get_filtered_words(message.guild)
-        sentence = self.no_mentions(message.content)
+        raw, cleaned = compiled.automata_for(message.channel.id)
+        filtered_word = self.find_filtered(
+            analysis.normalized,
+            raw,
+            cleaned,
+            # only worked out if there are punctuation insensitive words to look for
+            analysis.normalized_without_punctuation if cleaned else None,
+        )
+        if filtered_word is None and compiled.groups:
+            filtered_word = self._find_in_groups(compiled, snapshot, message.channel, analysis)
+        if filtered_word is None:
+            return False
 
-        for word in all_words:
-            channels = word["channel"]
-            if message.channel.id in channels or channels is None:
-                return await self.is_filtered(sentence, all_words)
+        return InfractionInformation(
+            message=message.content,
+            rule=self,
+            extra_fields=[EmbedField("Filtered word", f"`{filtered_word}`")],
+        )
@@ -1,22 +1,42 @@
+import json
 import logging
+from io import BytesIO, StringIO
+from typing import Union
 
 import discord
 from redbot.core import checks
 from redbot.core.commands import commands, Greedy
 from redbot.core.utils.chat_formatting import box
+from tabulate import tabulate
 
+from .actions import DiscordBackend, DryRunBackend
 from .converters import ToggleBool
 from .rules.base import BaseRuleSettingsDisplay
-from .utils import transform_bool, error_message, docstring_parameter
+from .utils import (
+    transform_bool,
+    error_message,
+    docstring_parameter,
+    thumbs_up_success,
+    check_success,
+    yes_or_no,
+)
 
 log = logging.getLogger(name="red.breadcogs.automod")
 
+# bumped when the layout of an exported configuration changes
+EXPORT_FORMAT = 1
+
 
 class Settings:
     def __init__(self, *args, **kwargs):
         self.bot = kwargs.get("bot")
         self.config = kwargs.get("config")
         self.rules_map = kwargs.get("rules_map")
+        self.pipeline_cache = kwargs.get("pipeline_cache")
+        self.settings_cache = kwargs.get("settings_cache")
+        self.verdict_memo = kwargs.get("verdict_memo")
+        self.metrics = kwargs.get("metrics")
+        self.action_executor = kwargs.get("action_executor")
 
     async def set_announcement_channel(
         self, guild: discord.Guild, channel: discord.TextChannel
@@ -32,6 +52,7 @@ class Settings:
         await self.config.guild(guild).set_raw(
             "settings", "announcement_channel", value=channel.id
         )
+        self.pipeline_cache.invalidate(guild)
 
         return before_channel, channel
 
@@ -54,6 +75,7 @@ class Settings:
             pass
 
         await self.config.guild(guild).set_raw("settings", "is_announcement_enabled", value=toggle)
+        self.pipeline_cache.invalidate(guild)
 
         return before, toggle
 
@@ -177,18 +199,134 @@ class Settings:
         group_name: str
             The group name
         channels: [discord.TextChannel]
-            A list of discord.Textchannels to add to the group
+            A list of discord.Textchannels to add to the group, categories add all their channels
 
         Returns
         -------
             None
         """
         all_groups = await self.get_channel_groups(guild)
-        if group_name in all_groups:
+        if group_name.lower() in all_groups:
             raise ValueError(f"That group already exists.")
 
         all_groups[group_name.lower()] = [ch.id for ch in channels]
+        await self._set_channel_groups(guild, all_groups)
+
+    async def edit_channel_group(
+        self, guild: discord.Guild, group_name: str, channels: [discord.TextChannel]
+    ) -> None:
+        """
+        Replace the channels of a group, rules using the group follow it
+
+        Raises
+        ------
+        ValueError
+            If the group doesn't exist
+        """
+        all_groups = await self.get_channel_groups(guild)
+        if group_name.lower() not in all_groups:
+            raise ValueError(f"`{group_name}` Could not find group.")
+
+        all_groups[group_name.lower()] = [ch.id for ch in channels]
+        await self._set_channel_groups(guild, all_groups)
+
+    async def delete_channel_group(self, guild: discord.Guild, group_name: str) -> None:
+        """
+        Delete a group, anything added for it no longer applies anywhere
+
+        Raises
+        ------
+        ValueError
+            If the group doesn't exist
+        """
+        all_groups = await self.get_channel_groups(guild)
+        if all_groups.pop(group_name.lower(), None) is None:
+            raise ValueError(f"`{group_name}` Could not find group.")
+
+        await self._set_channel_groups(guild, all_groups)
+
+    async def _set_channel_groups(self, guild: discord.Guild, all_groups: dict) -> None:
         await self.config.guild(guild).set_raw("settings", "channel_groups", value=all_groups)
+        # only the rules that use a changed group see the change
+        self.pipeline_cache.update_channel_groups(guild, all_groups)
+
+    async def export_settings(self, guild: discord.Guild) -> dict:
+        """
+        Every AutoMod setting of a guild, rules, word lists and channel groups included
+        Returns
+        -------
+        dict
+            `{"format": EXPORT_FORMAT, "guild_id": guild.id, "data": {...}}`, data is the raw
+            config as stored, read in one go, without the rules' `secret_settings`
+        """
+        data = await self.config.guild(guild).all()
+        for rule in self.rules_map.values():
+            rule_settings = data.get(rule.rule_name)
+            if rule_settings and rule.secret_settings & rule_settings.keys():
+                data[rule.rule_name] = {
+                    key: value
+                    for key, value in rule_settings.items()
+                    if key not in rule.secret_settings
+                }
+        return {"format": EXPORT_FORMAT, "guild_id": guild.id, "data": data}
+
+    async def import_settings(self, guild: discord.Guild, exported: dict) -> [str]:
+        """
+        Replace every AutoMod setting of a guild with an export, in a single write
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild to import into, ids of channels and roles are kept as they are
+        exported: dict
+            The output of `export_settings`
+
+        Returns
+        -------
+        [str]
+            The keys imported
+
+        Raises
+        -------
+            ValueError if the export isn't valid or has a value the setters would refuse,
+            nothing is written in that case
+        """
+        if not isinstance(exported, dict) or exported.get("format") != EXPORT_FORMAT:
+            raise ValueError(f"Not an AutoMod export, or not format version {EXPORT_FORMAT}.")
+        data = exported.get("data")
+        if not isinstance(data, dict):
+            raise ValueError("The export has no settings in it.")
+
+        known = {"settings"} | {rule.rule_name for rule in self.rules_map.values()}
+        unknown = [key for key in data if key not in known]
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}.")
+        not_dicts = [key for key, value in data.items() if not isinstance(value, dict)]
+        if not_dicts:
+            raise ValueError(f"Malformed settings: {', '.join(sorted(not_dicts))}.")
+
+        # the same checks the setters run, so an export can't hold what a command refuses
+        for rule in self.rules_map.values():
+            try:
+                rule.validate_settings(data.get(rule.rule_name, {}))
+            except ValueError as e:
+                raise ValueError(f"{rule.rule_name}: {e}") from e
+
+        # secrets aren't exported, the ones the guild already has are kept
+        current = await self.config.guild(guild).all()
+        data = dict(data)
+        for rule in self.rules_map.values():
+            kept = {
+                key: value
+                for key, value in current.get(rule.rule_name, {}).items()
+                if key in rule.secret_settings
+            }
+            if kept:
+                data[rule.rule_name] = {**data.get(rule.rule_name, {}), **kept}
+
+        await self.config.guild(guild).set(data)
+        self.pipeline_cache.invalidate(guild)
+        self.settings_cache.invalidate(guild.id)
+        return list(data)
 
     @commands.group()
     @checks.mod_or_permissions(manage_messages=True)
@@ -204,6 +342,187 @@ class Settings:
         from .main import __version__
         return await ctx.send(f"Current AutoMod version: `{__version__}`.")
 
+    @automodset.group(name="cache")
+    @checks.is_owner()
+    async def _settings_cache_group(self, ctx):
+        """Rule settings cache, shared by every guild"""
+        pass
+
+    @_settings_cache_group.command(name="stats")
+    async def _settings_cache_stats(self, ctx):
+        """Show how well rule settings and stateless rule verdicts are being cached"""
+        embed = discord.Embed(title="AutoMod caches")
+        for name, stats in (
+            ("Rule settings", self.settings_cache.stats()),
+            ("Verdicts", self.verdict_memo.stats()),
+        ):
+            embed.add_field(
+                name=name,
+                value=box(
+                    f"Cached    : [{stats.size}/{stats.maxsize}]\n"
+                    f"Hits      : [{stats.hits}]\n"
+                    f"Misses    : [{stats.misses}]\n"
+                    f"Hit rate  : [{stats.hit_rate:.1%}]\n"
+                    f"Evictions : [{stats.evictions}]",
+                    "ini",
+                ),
+            )
+        return await ctx.send(embed=embed)
+
+    @_settings_cache_group.command(name="size")
+    async def _settings_cache_size(self, ctx, size: int):
+        """Set how many guild rule settings are kept in memory"""
+        if size < 1:
+            return await ctx.send(error_message("Cache size must be at least 1."))
+        await self.config.settings_cache_size.set(size)
+        self.settings_cache.resize(size)
+        return await ctx.send(thumbs_up_success(f"Settings cache size set to `{size}`."))
+
+    @automodset.group(name="stats", invoke_without_command=True)
+    async def _stats(self, ctx):
+        """Show how often and how fast each rule has run in this server"""
+        rows = [
+            (
+                rule_name,
+                metrics.evaluations,
+                metrics.triggers,
+                metrics.errors,
+                f"{metrics.latency.quantile(0.5) * 1000:.2f}",
+                f"{metrics.latency.quantile(0.95) * 1000:.2f}",
+            )
+            for _, rule_name, metrics in self.metrics.rule_rows(ctx.guild.id)
+        ]
+        if not rows:
+            return await ctx.send("No messages have been checked since the cog was loaded.")
+
+        em = discord.Embed(title="AutoMod stats", color=discord.Color.greyple())
+        em.add_field(
+            name="Rules",
+            value=box(
+                tabulate(
+                    rows,
+                    ["Rule", "Checked", "Hits", "Errors", "p50 ms", "p95 ms"],
+                    tablefmt="presto",
+                ),
+                "ini",
+            ),
+            inline=False,
+        )
+        action_rows = [
+            (
+                rule_name,
+                action,
+                metrics.successes,
+                metrics.failures,
+                f"{metrics.latency.quantile(0.95) * 1000:.0f}",
+            )
+            for _, rule_name, action, metrics in self.metrics.action_rows(ctx.guild.id)
+        ]
+        if action_rows:
+            em.add_field(
+                name="Actions",
+                value=box(
+                    tabulate(
+                        action_rows,
+                        ["Rule", "Action", "Ok", "Failed", "p95 ms"],
+                        tablefmt="presto",
+                    ),
+                    "ini",
+                ),
+                inline=False,
+            )
+        return await ctx.send(embed=em)
+
+    @_stats.command(name="export")
+    @checks.is_owner()
+    async def _stats_export(self, ctx, fmt: str = "json"):
+        """
+        Export stats for every server as a file
+
+        `fmt` is either `json` or `prometheus`
+        """
+        if fmt == "json":
+            data, filename = self.metrics.to_json(), "automod_stats.json"
+        elif fmt == "prometheus":
+            data, filename = self.metrics.to_prometheus(), "automod_stats.prom"
+        else:
+            return await ctx.send(error_message("Format must be `json` or `prometheus`."))
+        return await ctx.send(file=discord.File(BytesIO(data.encode()), filename=filename))
+
+    @_stats.command(name="reset")
+    @checks.is_owner()
+    async def _stats_reset(self, ctx):
+        """Forget all recorded stats"""
+        self.metrics.reset()
+        return await ctx.send(check_success("Stats have been reset."))
+
+    @automodset.command(name="dryrun")
+    @checks.is_owner()
+    @docstring_parameter(ToggleBool.fmt_box)
+    async def _dry_run(self, ctx, toggle: ToggleBool):
+        """
+        Toggle dry run, rules still trigger and announce but no action is sent to discord
+
+        Deletes, kicks, bans and roles are only logged. This applies to every server.
+
+        {0}
+        """
+        await self.config.dry_run_actions.set(toggle)
+        self.action_executor.backend = DryRunBackend() if toggle else DiscordBackend()
+        if toggle:
+            return await ctx.send(thumbs_up_success("Actions will only be logged."))
+        return await ctx.send(thumbs_up_success("Actions will be sent to discord."))
+
+    @automodset.command(name="export")
+    @checks.admin_or_permissions(manage_guild=True)
+    async def _export_settings(self, ctx):
+        """
+        Export every AutoMod setting of this server to a file
+
+        Rules, word lists, extension lists and channel groups are all included.
+        Keys set by the bot owner, like the image detection key and endpoint, are not.
+        """
+        exported = await self.export_settings(ctx.guild)
+        output = StringIO()
+        json.dump(exported, output, indent=2)
+        return await ctx.send(
+            file=discord.File(
+                BytesIO(output.getvalue().encode()), filename=f"automod-{ctx.guild.id}.json"
+            )
+        )
+
+    @automodset.command(name="import")
+    @checks.admin_or_permissions(manage_guild=True)
+    async def _import_settings(self, ctx):
+        """
+        Replace every AutoMod setting of this server with an exported file
+
+        Attach a file from `[p]automodset export` to this command.
+        Channels and roles are matched by id, so settings from another server may need fixing.
+        """
+        if not ctx.message.attachments:
+            return await ctx.send(error_message("Attach an exported settings file."))
+
+        try:
+            exported = json.loads(await ctx.message.attachments[0].read())
+        except (UnicodeDecodeError, ValueError):
+            return await ctx.send(error_message("That file isn't valid JSON."))
+
+        if isinstance(exported, dict) and exported.get("guild_id") != ctx.guild.id:
+            should_import = await yes_or_no(
+                ctx, "These settings were exported from another server, import them anyway?"
+            )
+            if not should_import:
+                return await ctx.send("Okay, nothing was imported.")
+
+        try:
+            imported = await self.import_settings(ctx.guild, exported)
+        except ValueError as e:
+            return await ctx.send(error_message(e.args[0]))
+        return await ctx.send(
+            check_success(f"Imported {', '.join('`{0}`'.format(key) for key in imported)}.")
+        )
+
     @automodset.group(name="channelgroup", aliases=["group", "chgroup"])
     async def channel_group(self, ctx):
         """
@@ -214,11 +533,18 @@ class Settings:
         pass
 
     @channel_group.command(name="add", aliases=["create"])
-    async def _add_new_group(self, ctx, group_name: str, channels: Greedy[discord.TextChannel]):
+    async def _add_new_group(
+        self,
+        ctx,
+        group_name: str,
+        channels: Greedy[Union[discord.TextChannel, discord.CategoryChannel]],
+    ):
         """
         Add a new channel group
 
         Group name bust be one word, `-`, `_` are permitted.
+
+        Adding a category adds every channel in it, including ones made later.
         """
         try:
             await self.set_new_channel_group(ctx.guild, group_name, channels)
@@ -233,6 +559,44 @@ class Settings:
         except ValueError as e:
             return await ctx.send(await error_message(e.args[0]))
 
+    @channel_group.command(name="edit", aliases=["set"])
+    async def _edit_group(
+        self,
+        ctx,
+        group_name: str,
+        channels: Greedy[Union[discord.TextChannel, discord.CategoryChannel]],
+    ):
+        """
+        Replace the channels in a channel group
+
+        Everything added to the group follows, there is no need to add it again.
+        """
+        try:
+            await self.edit_channel_group(ctx.guild, group_name, channels)
+        except ValueError as e:
+            return await ctx.send(error_message(e.args[0]))
+        fmt_box = box("\n".join("+ {0}".format(ch.name) for ch in channels), "diff")
+        em = discord.Embed(
+            title="Channel group edited",
+            color=discord.Color.green(),
+            description=f"Channels in `{group_name}` have been replaced.",
+        )
+        em.add_field(name="Channels in group", value=fmt_box)
+        return await ctx.send(embed=em)
+
+    @channel_group.command(name="delete", aliases=["remove", "del"])
+    async def _delete_group(self, ctx, group_name: str):
+        """
+        Delete a channel group
+
+        Anything added to the group stops applying.
+        """
+        try:
+            await self.delete_channel_group(ctx.guild, group_name)
+        except ValueError as e:
+            return await ctx.send(error_message(e.args[0]))
+        return await ctx.send(thumbs_up_success(f"`{group_name}` has been deleted."))
+
     @automodset.command(name="show", aliases=["all"])
     async def show_all_settings(self, ctx, rulename: str = None):
         """
@@ -0,0 +1,146 @@
+import datetime
+import time
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from ..actions import ActionExecutor, DryRunBackend
+from ..benchmarks.fakes import FakeChannel, FakeGuild, FakeMember, FakeMessage, FakeRole
+from ..benchmarks.runner import Scenario, build_cog
+from ..metrics import Metrics
+from ..ratelimit import SlidingWindowStore
+from ..rules.maxwords import MAX_WORDS_KEY
+
+
+def make_executor():
+    return ActionExecutor(Metrics(), backend=DryRunBackend(), delete_window=0)
+
+
+def make_message(channel, guild, created_at=None):
+    return FakeMessage("spam", FakeMember(), channel, guild, created_at=created_at)
+
+
+@pytest.mark.asyncio
+async def test_deletes_in_a_channel_are_bulk_deleted():
+    executor = make_executor()
+    channel, other = FakeChannel(), FakeChannel()
+    guild = FakeGuild(channels=[channel, other])
+    messages = [make_message(channel, guild) for _ in range(5)]
+    old = make_message(channel, guild, created_at=datetime.datetime(2020, 1, 1))
+    lone = make_message(other, guild)
+
+    futures = [executor.delete(message, "MaxWordsRule") for message in messages + [old, lone]]
+    # queuing the same message twice doesn't delete it twice
+    assert executor.delete(messages[0], "MaxWordsRule") is futures[0]
+    await executor.close()
+
+    assert all(future.result() for future in futures)
+    assert sorted(executor.backend.calls, key=str) == sorted(
+        [
+            ("bulk_delete", channel.id, tuple(message.id for message in messages)),
+            # too old to bulk delete
+            ("delete", channel.id, old.id),
+            ("delete", other.id, lone.id),
+        ],
+        key=str,
+    )
+    (row,) = executor.metrics.action_rows(guild.id)
+    assert row[2] == "delete" and row[3].successes == 7
+
+
+@pytest.mark.asyncio
+async def test_repeated_punishments_are_deduplicated():
+    executor = make_executor()
+    guild = FakeGuild()
+    member, other = FakeMember(), FakeMember()
+    role = FakeRole()
+
+    bans = [executor.punish("ban", guild, member, "SpamRule", "raid") for _ in range(10)]
+    # already being banned, no need to kick
+    kick = executor.punish("kick", guild, member, "SpamRule", "raid")
+    kicks = [executor.punish("kick", guild, other, "SpamRule", "raid") for _ in range(3)]
+    roles = [executor.punish("add_role", guild, other, "SpamRule", "raid", role=role)] * 2
+    await executor.close()
+
+    assert kick is bans[0]
+    assert all(future.result() for future in bans + kicks + roles)
+    assert executor.backend.calls == [
+        ("ban", guild.id, member.id),
+        ("kick", other.id),
+        ("add_role", other.id, role.id),
+    ]
+
+
+class FailingBackend(DryRunBackend):
+    """Refuses bulk deletes and breaks on kicks"""
+
+    async def delete_messages(self, channel, messages):
+        raise discord.Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "")
+
+    async def kick(self, member, reason):
+        raise RuntimeError("broken")
+
+
+@pytest.mark.asyncio
+async def test_failed_actions_are_logged_and_retried():
+    executor = ActionExecutor(Metrics(), backend=FailingBackend(), delete_window=0)
+    channel = FakeChannel()
+    guild = FakeGuild(channels=[channel])
+    messages = [make_message(channel, guild) for _ in range(3)]
+
+    deletes = [executor.delete(message, "MaxWordsRule") for message in messages]
+    kick = executor.punish("kick", guild, FakeMember(), "SpamRule", "raid")
+    await executor.close()
+
+    # a forbidden bulk delete is retried one message at a time
+    assert all(future.result() for future in deletes)
+    assert [call[0] for call in executor.backend.calls] == ["delete"] * 3
+    assert kick.result() is False
+
+
+@pytest.mark.asyncio
+async def test_routes_are_rate_limited():
+    executor = make_executor()
+    executor._limits["kick"] = SlidingWindowStore(rate=2, per=0.1)
+    guild = FakeGuild()
+
+    start = time.monotonic()
+    for _ in range(3):
+        executor.punish("kick", guild, FakeMember(), "SpamRule", "raid")
+    await executor.close()
+
+    assert len(executor.backend.calls) == 3
+    assert time.monotonic() - start >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_listener_queues_actions(tmp_path):
+    scenario = Scenario()
+    cog = build_cog(scenario, 10, tmp_path)
+    cog.action_executor = ActionExecutor(cog.metrics, backend=DryRunBackend(), delete_window=0)
+    announcements = FakeChannel()
+    scenario.guild.channels[announcements.id] = announcements
+
+    data = cog.config.guilds[scenario.guild.id]
+    data["settings"] = {"announcement_channel": announcements.id, "is_announcement_enabled": True}
+    data["MaxWordsRule"].update(
+        {MAX_WORDS_KEY: 3, "action_to_take": "ban", "delete_message": True, "priority": 0}
+    )
+    cog.pipeline_cache.invalidate(scenario.guild)
+
+    member, channel = scenario.members[0], scenario.channels[0]
+    messages = [
+        FakeMessage(scenario.sentence(5), member, channel, scenario.guild) for _ in range(3)
+    ]
+    for message in messages:
+        await cog._listen_for_infractions(message)
+    # nothing has been sent yet, the listener only queued the actions
+    assert cog.action_executor.backend.calls == []
+
+    await cog.action_executor.close()
+    assert sorted(cog.action_executor.backend.calls, key=str) == [
+        ("ban", scenario.guild.id, member.id),
+        ("bulk_delete", channel.id, tuple(message.id for message in messages)),
+    ]
+    assert len(announcements.sent) == 3
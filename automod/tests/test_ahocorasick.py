@@ -0,0 +1,25 @@
+import pytest
+
+from ..ahocorasick import AhoCorasick
+
+search_data = [
+    (["he", "she", "his", "hers"], "ushers", "she"),
+    (["bread", "bake"], "Bakers do indeed bake bread", "bake"),
+    (["abcd", "bc"], "xabcx", "bc"),
+    (["abcd", "bcz"], "abcbcz", "bcz"),
+    (["bread"], "Bakers do indeed bake", None),
+    ([], "anything", None),
+    (["", "a"], "bab", "a"),
+]
+
+
+@pytest.mark.parametrize("patterns, text, expected", search_data)
+def test_search(patterns, text, expected):
+    assert AhoCorasick(patterns).search(text) == expected
+
+
+def test_matches_substring_check():
+    patterns = ["ana", "nab", "bana", "x"]
+    automaton = AhoCorasick(patterns)
+    for text in ["banana", "nabana", "anana", "bnx", "abn"]:
+        assert (automaton.search(text) is not None) == any(p in text for p in patterns)
@@ -0,0 +1,85 @@
+import pytest
+
+from ..analysis import MessageAnalysis
+from ..channelgroups import compile_channel_groups
+from ..benchmarks.fakes import FakeAttachment, FakeChannel, FakeGuild, FakeMember, FakeMessage
+from ..benchmarks.fakes import InMemoryConfig
+from ..pipeline import compile_rule_snapshot
+from ..rules.allowedextensions import (
+    BLACKLIST_EXTENSIONS,
+    WHITELIST_EXTENSIONS,
+    AllowedExtensionsRule,
+    compile_extension_index,
+)
+
+# 5 is a category
+CHANNEL_GROUPS = compile_channel_groups({"media": [2, 3, 5]})
+
+
+def attachment_message(channel_id, filename, category_id=None):
+    channel = FakeChannel(channel_id, category_id=category_id)
+    attachments = [FakeAttachment(filename)]
+    return FakeMessage("", FakeMember(), channel, FakeGuild(), attachments=attachments)
+
+
+def test_index_merges_global_channel_and_group_entries():
+    entries = [
+        {"extensions": ["exe"], "channels": []},
+        {"extensions": [".BAT"], "channels": [1]},
+        {"extensions": ["zip"], "channels": [], "groups": ["media"]},
+        {"extensions": ["rar"], "channels": [], "groups": ["deleted"]},
+    ]
+    index = compile_extension_index(entries)
+    assert index.extensions_for(4) == {"exe"}
+    assert index.extensions_for(1) == {"exe", "bat"}
+    assert index.extensions_for(2, {"media"}) == {"exe", "zip"}
+    # a group that no longer exists isn't global
+    assert index.extensions_for(4, {"deleted"}) == {"exe", "rar"}
+    assert index.extensions_for(4, {"other"}) == {"exe"}
+
+
+denylist_data = [
+    (1, None, "virus.exe", "exe"),
+    (2, None, "photo.png", None),
+    (2, None, "archive.zip", "zip"),
+    (4, None, "archive.zip", None),
+    # in the group through its category
+    (4, 5, "archive.zip", "zip"),
+]
+
+
+@pytest.mark.parametrize("channel_id, category_id, filename, expected", denylist_data)
+@pytest.mark.asyncio
+async def test_denylist(channel_id, category_id, filename, expected):
+    rule = AllowedExtensionsRule(InMemoryConfig())
+    rule_settings = {
+        BLACKLIST_EXTENSIONS: [
+            {"extensions": ["exe"], "channels": []},
+            {"extensions": ["zip"], "channels": [], "groups": ["media"]},
+        ]
+    }
+    snapshot = compile_rule_snapshot(rule, rule_settings, {}, CHANNEL_GROUPS)
+    message = attachment_message(channel_id, filename, category_id)
+
+    infraction = await rule.is_offensive(message, snapshot, MessageAnalysis(""))
+    if expected is None:
+        assert not infraction
+    else:
+        assert f"`{expected}`" in infraction.embed_description
+
+
+@pytest.mark.asyncio
+async def test_allowlist_only_applies_where_set():
+    rule = AllowedExtensionsRule(InMemoryConfig())
+    rule_settings = {WHITELIST_EXTENSIONS: [{"extensions": ["png", "jpg"], "channels": [1]}]}
+    snapshot = compile_rule_snapshot(rule, rule_settings, {})
+
+    async def check(channel_id, filename):
+        message = attachment_message(channel_id, filename)
+        return await rule.is_offensive(message, snapshot, MessageAnalysis(""))
+
+    assert not await check(1, "cat.PNG")
+    assert await check(1, "cat.gif")
+    # renaming payload.exe to payload doesn't get it past the allow list
+    assert "`no extension`" in (await check(1, "payload")).embed_description
+    assert not await check(2, "cat.gif")
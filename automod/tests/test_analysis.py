@@ -0,0 +1,80 @@
+import pytest
+
+from ..analysis import MessageAnalysis, inserted_text
+
+BREAD_MENTION = "<@280730525960896513>"
+NICK_MENTION = "<@!280730525960896511>"
+
+
+def test_tokens_and_counts():
+    analysis = MessageAnalysis("hello  there\nfriend")
+    assert analysis.tokens == ("hello", "there", "friend")
+    assert analysis.word_count == 3
+    assert analysis.char_count == 19
+    assert MessageAnalysis(None).tokens == ()
+
+
+def test_content_hash():
+    assert MessageAnalysis("spam").content_hash == MessageAnalysis("spam").content_hash
+    assert MessageAnalysis("spam").content_hash != MessageAnalysis("Spam").content_hash
+    assert len(MessageAnalysis("\ud800 lone surrogate").content_hash) == 16
+
+
+def test_mentions():
+    analysis = MessageAnalysis(f"hi {BREAD_MENTION} and {NICK_MENTION}, bye")
+    assert analysis.mention_tokens == (BREAD_MENTION, f"{NICK_MENTION},")
+    assert analysis.mention_ids == (280730525960896513, 280730525960896511)
+    assert analysis.without_mentions == "hi  and , bye"
+    assert analysis.without_punctuation == "hi  and  bye"
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ("join discord.gg/abc now", ("abc",)),
+        ("DISCORD.com/invite/abc", ("abc",)),
+        ("https://discord.gg/abc", ("abc",)),
+        ("<https://discordapp.com/invite/a-b?event=1>", ("a-b",)),
+        ("discord.gg/abc discord.io/abc discord.me/xyz", ("abc", "xyz")),
+        ("no invites here, discord.gg/", ()),
+    ],
+)
+def test_invite_codes(content, expected):
+    assert MessageAnalysis(content).invite_codes == expected
+
+
+@pytest.mark.parametrize(
+    "content, expected", [("no newlines", 0), ("a\nb", 1), ("a\n\n\nb\n\nc", 3), ("\n" * 7, 7)]
+)
+def test_longest_newline_run(content, expected):
+    assert MessageAnalysis(content).longest_newline_run == expected
+
+
+def test_urls():
+    assert MessageAnalysis("see https://a.com/x and http://b.org").urls == (
+        "https://a.com/x",
+        "http://b.org",
+    )
+
+
+inserted_text_data = [
+    ("hello world", "hello big world", "hello big world"),
+    ("join discord.gg/ab now", "join discord.gg/abcdef now", "discord.gg/abcdef now"),
+    ("some bad words here", "some words here", ""),
+    ("", "new message", "new message"),
+]
+
+
+@pytest.mark.parametrize("before, after, expected", inserted_text_data)
+def test_inserted_text(before, after, expected):
+    assert inserted_text(before, after) == expected
+
+
+def test_normalized_views():
+    analysis = MessageAnalysis("<@1> ＨＩ B.\u0430.D d\u0456scord.gg/AbC\u200bd")
+    assert analysis.normalized == " hi b.a.d discord.gg/abcd"
+    assert analysis.normalized_without_punctuation == " hi bad discordggabcd"
+    # codes are case sensitive, only the folding is undone
+    assert analysis.invite_codes == ("AbCd",)
+    # ascii content is left alone
+    assert MessageAnalysis("plain").folded == "plain"
@@ -0,0 +1,142 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from ..announcements import (
+    EMBED_FIELD_LIMIT,
+    AnnouncementBuffer,
+    PendingAnnouncement,
+    digest_embed,
+)
+from ..benchmarks.fakes import FakeChannel, FakeGuild, FakeMember, FakeMessage, InMemoryConfig
+from ..metrics import Metrics
+from ..rules.maxwords import MaxWordsRule
+from ..rules.wallspam import WallSpamRule
+
+
+def make_announcements(guild, channel, rules, members):
+    return [
+        PendingAnnouncement(
+            rule=rule,
+            message=FakeMessage("spam", member, channel, guild),
+            action_to_take="ban",
+            message_has_been_deleted=False,
+            action_taken_success=True,
+        )
+        for rule, member in zip(rules, members)
+    ]
+
+
+def setup():
+    announce_channel, channel = FakeChannel(), FakeChannel(name="general")
+    guild = FakeGuild(channels=[announce_channel, channel])
+    return guild, announce_channel, channel
+
+
+@pytest.mark.asyncio
+async def test_low_volume_is_sent_immediately():
+    guild, announce_channel, channel = setup()
+    buffer = AnnouncementBuffer(Metrics(), threshold=3, window=60)
+    rule = MaxWordsRule(InMemoryConfig())
+    for announcement in make_announcements(guild, channel, [rule] * 3, [FakeMember()] * 3):
+        await buffer.announce(guild, announce_channel.id, announcement)
+
+    assert [kwargs["embed"].title for _, kwargs in announce_channel.sent] == [
+        "MaxWordsRule - Offense found"
+    ] * 3
+
+
+@pytest.mark.asyncio
+async def test_high_volume_is_sent_as_one_digest():
+    guild, announce_channel, channel = setup()
+    metrics = Metrics()
+    buffer = AnnouncementBuffer(metrics, threshold=2, window=0.05)
+    rules = [MaxWordsRule(InMemoryConfig())] * 4 + [WallSpamRule(InMemoryConfig())] * 2
+    raider = FakeMember(name="raider")
+    members = [raider] * 5 + [FakeMember()]
+    for announcement in make_announcements(guild, channel, rules, members):
+        await buffer.announce(guild, announce_channel.id, announcement)
+    assert len(announce_channel.sent) == 2
+
+    await asyncio.sleep(0.1)
+    assert len(announce_channel.sent) == 3
+    digest = announce_channel.sent[-1][1]["embed"]
+    assert digest.title == "AutoMod digest - 4 offenses"
+    assert digest.fields[1].value.startswith(f"raider#0001 ({raider.id}) - `3`")
+    assert sum(row[3].successes for row in metrics.action_rows(guild.id)) == 6
+
+
+@pytest.mark.asyncio
+async def test_close_sends_held_announcements():
+    guild, announce_channel, channel = setup()
+    buffer = AnnouncementBuffer(Metrics(), threshold=1, window=60)
+    rule = MaxWordsRule(InMemoryConfig())
+    for announcement in make_announcements(guild, channel, [rule] * 3, [FakeMember()] * 3):
+        await buffer.announce(guild, announce_channel.id, announcement)
+    assert len(announce_channel.sent) == 1
+
+    await buffer.close()
+    assert len(announce_channel.sent) == 2
+    assert announce_channel.sent[-1][1]["embed"].title == "AutoMod digest - 2 offenses"
+
+
+def test_digest_embed_counts_rules_and_links_kept_messages():
+    guild, _, channel = setup()
+    maxwords, wallspam = MaxWordsRule(InMemoryConfig()), WallSpamRule(InMemoryConfig())
+    announcements = make_announcements(
+        guild, channel, [maxwords, maxwords, wallspam], [FakeMember()] * 3
+    )
+    announcements[0].message_has_been_deleted = True
+    announcements[2].action_taken_success = False
+
+    embed = digest_embed(announcements, 10)
+    rules, _, links = embed.fields
+    assert "MaxWordsRule |          2 |        0" in rules.value
+    assert "WallSpamRule |          1 |        1" in rules.value
+    assert links.value.count("🔗") == 2
+
+
+def test_digest_links_fit_in_one_field():
+    guild, _, _ = setup()
+    channel = FakeChannel(name="x" * 150)
+    rule = MaxWordsRule(InMemoryConfig())
+    announcements = make_announcements(guild, channel, [rule] * 20, [FakeMember()] * 20)
+
+    links = digest_embed(announcements, 10).fields[-1].value
+    assert len(links) <= EMBED_FIELD_LIMIT
+    shown = links.count("🔗")
+    assert 0 < shown < 8
+    assert links.endswith(f"... and {20 - shown} more")
+
+
+@pytest.mark.asyncio
+async def test_failed_sends_are_recorded_as_failures():
+    guild, announce_channel, channel = setup()
+
+    async def send(*args, **kwargs):
+        raise discord.HTTPException(SimpleNamespace(status=500, reason="Server Error"), "")
+
+    announce_channel.send = send
+    metrics = Metrics()
+    buffer = AnnouncementBuffer(metrics, threshold=3, window=60)
+    rule = MaxWordsRule(InMemoryConfig())
+    for announcement in make_announcements(guild, channel, [rule], [FakeMember()]):
+        await buffer.announce(guild, announce_channel.id, announcement)
+
+    [(_, _, action, outcome)] = metrics.action_rows(guild.id)
+    assert (action, outcome.successes, outcome.failures) == ("announce", 0, 1)
+
+
+@pytest.mark.asyncio
+async def test_rate_window_is_per_guild():
+    buffer = AnnouncementBuffer(Metrics(), threshold=1, window=60)
+    rule = MaxWordsRule(InMemoryConfig())
+    # two guilds announcing to channels that happen to share an id
+    for _ in range(2):
+        announce_channel, channel = FakeChannel(1), FakeChannel()
+        guild = FakeGuild(channels=[announce_channel, channel])
+        for announcement in make_announcements(guild, channel, [rule], [FakeMember()]):
+            await buffer.announce(guild, announce_channel.id, announcement)
+        assert len(announce_channel.sent) == 1
@@ -0,0 +1,30 @@
+import pytest
+
+from ..benchmarks.runner import CORPORA, compare, run_benchmarks
+
+
+@pytest.mark.asyncio
+async def test_benchmarks_cover_every_rule_and_corpus():
+    results = await run_benchmarks(rounds=1, messages=3, filter_sizes=(5, 50))
+    names = {(r["name"], r["corpus"], r["filter_size"]) for r in results["results"]}
+
+    for corpus in CORPORA:
+        assert ("listener", corpus, 5) in names
+        assert ("listener", corpus, 50) in names
+        assert ("rule/wordfilterrule", corpus, 50) in names
+        assert ("rule/imagedetectionrule", corpus, 5) in names
+        # filter size only matters to the word filter
+        assert ("rule/maxcharsrule", corpus, 50) not in names
+
+    assert all(r["messages"] == 3 for r in results["results"])
+
+
+def test_compare_flags_regressions():
+    def result(median):
+        return {"name": "listener", "corpus": "short_chat", "filter_size": 10, "median_us": median}
+
+    baseline = {"results": [result(100.0)]}
+    assert compare(baseline, {"results": [result(120.0)]}, tolerance=0.25) == []
+
+    (regression,) = compare(baseline, {"results": [result(200.0)]}, tolerance=0.25)
+    assert regression["change"] == 1.0
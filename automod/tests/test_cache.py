@@ -0,0 +1,137 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ..cache import LRUCache, SettingsCache, VerdictMemo
+from ..rules.maxchars import MaxCharsRule
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.stats().evictions == 1
+
+
+def test_ttl_expiry():
+    timer = FakeTimer()
+    cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+    cache.set("a", 1)
+    timer.now = 9
+    assert cache.get("a") == 1
+    timer.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_hit_and_miss_counters():
+    cache = LRUCache()
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    cache.peek("a")
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.hit_rate) == (1, 1, 0.5)
+
+
+class FakeGroup:
+    def __init__(self, config, guild_id):
+        self.config = config
+        self.guild_id = guild_id
+
+    async def get_raw(self, rule_name):
+        self.config.reads += 1
+        return dict(self.config.data[self.guild_id][rule_name])
+
+
+class FakeConfig:
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    def guild(self, guild):
+        return FakeGroup(self, guild.id)
+
+
+@pytest.mark.asyncio
+async def test_settings_cache_targeted_invalidation():
+    config = FakeConfig({1: {"A": {"x": 1}, "B": {"x": 2}}, 2: {"A": {"x": 3}}})
+    cache = SettingsCache(config, maxsize=8)
+    one, two = SimpleNamespace(id=1), SimpleNamespace(id=2)
+
+    for guild, rule_name in ((one, "A"), (one, "B"), (two, "A")):
+        await cache.get(guild, rule_name)
+    assert (await cache.get(one, "A"))["x"] == 1
+    assert config.reads == 3
+    assert cache.stats().hits == 1
+
+    config.data[1]["A"]["x"] = 10
+    cache.invalidate(1, "A")
+    assert (await cache.get(one, "A"))["x"] == 10
+    assert config.reads == 4
+
+    # other guilds and rules keep their entries
+    await cache.get(one, "B")
+    await cache.get(two, "A")
+    assert config.reads == 4
+
+    cache.invalidate(1)
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_settings_cache_missing_rule_and_resize():
+    config = FakeConfig({1: {"A": {}, "B": {}}})
+    cache = SettingsCache(config, maxsize=2)
+    guild = SimpleNamespace(id=1)
+    # never configured rules read as empty settings
+    assert await cache.get(guild, "C") == {}
+    for rule_name in ("A", "B"):
+        await cache.get(guild, rule_name)
+    assert cache.stats().evictions == 1
+
+    cache.resize(1)
+    assert len(cache) == 1
+    assert cache.stats().evictions == 2
+
+
+@pytest.mark.asyncio
+async def test_base_rule_getters_use_settings_cache():
+    config = FakeConfig({1: {"MaxCharsRule": {"is_enabled": True, "enforced_channels": [4]}}})
+    rule = MaxCharsRule(config)
+    rule.settings_cache = SettingsCache(config)
+    guild = SimpleNamespace(id=1)
+
+    assert await rule.is_enabled(guild)
+    channels = await rule.get_enforced_channels(guild)
+    channels.append(5)
+    assert await rule.get_enforced_channels(guild) == [4]
+    assert await rule.get_priority(guild) == 0
+    assert config.reads == 1
+
+
+def test_verdict_memo_is_dropped_when_the_version_changes():
+    memo = VerdictMemo(maxsize=2)
+    memo.set(1, 0, "a", True)
+    memo.set(2, 0, "a", False)
+    assert memo.get(1, 0, "a") is True
+    assert memo.get(2, 0, "a") is False
+    # settings of guild 1 changed
+    assert memo.get(1, 1, "a") is None
+    assert memo.get(2, 0, "a") is False
+
+    for key in "abc":
+        memo.set(1, 1, key, True)
+    stats = memo.stats()
+    assert (stats.size, stats.hits, stats.misses, stats.evictions) == (3, 3, 1, 1)
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ..analysis import MessageAnalysis
+from ..benchmarks.fakes import FakeChannel, FakeGuild, FakeMember, FakeMessage
+from ..benchmarks.fakes import InMemoryConfig
+from ..channelgroups import compile_channel_groups
+from ..main import AutoMod
+from ..pipeline import PipelineCache
+from ..rules.maxchars import MaxCharsRule
+from ..rules.regexfilter import RegexRule
+from ..rules.wordfilter import WordFilterRule
+
+
+def test_channels_inherit_the_groups_of_their_category():
+    # 10 is a category
+    index = compile_channel_groups({"media": [1, 10], "staff": [2, 10], "empty": []})
+    assert index.groups_of(1) == {"media"}
+    assert index.groups_of(3) == frozenset()
+    assert index.groups_of(3, category_id=10) == {"media", "staff"}
+    assert index.groups_of(2, category_id=10) == {"media", "staff"}
+    assert index.channels("media") == {1, 10}
+    assert "empty" in index
+
+
+def test_changed_groups():
+    before = compile_channel_groups({"media": [1], "staff": [2], "old": [3]})
+    after = compile_channel_groups({"media": [1], "staff": [2, 4], "new": [5]})
+    assert before.changed(after) == {"staff", "old", "new"}
+
+
+def setup():
+    config, guild = InMemoryConfig(), FakeGuild()
+    rules_map = {
+        "wordfilterrule": WordFilterRule(config),
+        "regexrule": RegexRule(config),
+        "maxcharsrule": MaxCharsRule(config),
+    }
+    config.register_guild(settings={})
+    cog = SimpleNamespace(config=config, pipeline_cache=PipelineCache(config, rules_map))
+    for name in ("get_channel_groups", "_set_channel_groups"):
+        setattr(cog, name, getattr(AutoMod, name).__get__(cog))
+    config.guilds[guild.id] = {
+        "settings": {"channel_groups": {"media": [1]}},
+        "WordFilterRule": {"is_enabled": True},
+        "RegexRule": {"is_enabled": True},
+        "MaxCharsRule": {"is_enabled": True},
+    }
+    return cog, guild, rules_map
+
+
+async def is_filtered(cog, rule, message):
+    pipeline = await cog.pipeline_cache.get(message.guild)
+    snapshot = pipeline.rules[rule.rule_name]
+    return await rule.is_offensive(message, snapshot, MessageAnalysis(message.content))
+
+
+@pytest.mark.asyncio
+async def test_group_edits_apply_to_entries_added_for_the_group():
+    cog, guild, rules_map = setup()
+    wordfilterrule, regexrule = rules_map["wordfilterrule"], rules_map["regexrule"]
+    for rule in rules_map.values():
+        rule.pipeline_cache = cog.pipeline_cache
+    await wordfilterrule.add_to_filter(guild, "bread", FakeMember(), groups=["media"])
+    await regexrule.add_pattern(guild, "cake+", FakeMember(), groups=["media"])
+
+    def message(content, channel):
+        return FakeMessage(content, FakeMember(), channel, guild)
+
+    media, general = FakeChannel(1), FakeChannel(2, category_id=20)
+    assert await is_filtered(cog, wordfilterrule, message("I like bread", media))
+    assert not await is_filtered(cog, wordfilterrule, message("I like bread", general))
+    assert await is_filtered(cog, regexrule, message("caaake cakeee", media))
+
+    pipeline = await cog.pipeline_cache.get(guild)
+    # adding the category of general to the group
+    await AutoMod.edit_channel_group(cog, guild, "media", [media, SimpleNamespace(id=20)])
+    updated = await cog.pipeline_cache.get(guild)
+
+    assert updated.version > pipeline.version
+    assert await is_filtered(cog, wordfilterrule, message("I like bread", general))
+    assert await is_filtered(cog, regexrule, message("cakeee", general))
+    # nothing was recompiled, rules not using the group keep their snapshot
+    assert updated.rules["MaxCharsRule"] is pipeline.rules["MaxCharsRule"]
+    assert updated.rules["WordFilterRule"].options is pipeline.rules["WordFilterRule"].options
+    assert [s for _, s in updated.enabled_rules] == list(updated.rules.values())
+
+    await AutoMod.delete_channel_group(cog, guild, "media")
+    assert not await is_filtered(cog, wordfilterrule, message("I like bread", media))
+    with pytest.raises(ValueError):
+        await AutoMod.delete_channel_group(cog, guild, "media")
@@ -0,0 +1,158 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from ..analysis import MessageAnalysis
+from ..benchmarks.fakes import FakeGuild, InMemoryConfig
+from ..cache import VerdictMemo
+from ..main import AutoMod
+from ..metrics import Metrics
+from ..rules.discordinvites import DiscordInviteRule, InviteResolver, invite_code
+
+ALLOWED_GUILD = 1
+OTHER_GUILD = 2
+
+INVITES = {"red": ALLOWED_GUILD, "RedVanity": ALLOWED_GUILD, "spam": OTHER_GUILD}
+
+
+class StubFetch:
+    """Resolves from `INVITES`, counting lookups"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, code):
+        self.calls.append(code)
+        await asyncio.sleep(0)
+        return INVITES.get(code)
+
+
+@pytest.mark.parametrize(
+    "link, expected",
+    [
+        ("discord.gg/red", "red"),
+        ("https://discord.com/invite/red?event=1", "red"),
+        ("red", "red"),
+        ("https://example.com", None),
+    ],
+)
+def test_invite_code(link, expected):
+    assert invite_code(link) == expected
+
+
+@pytest.mark.asyncio
+async def test_raid_is_resolved_once():
+    fetch = StubFetch()
+    resolver = InviteResolver(fetch)
+    results = await asyncio.gather(*(resolver.resolve_many(["spam", "red"]) for _ in range(50)))
+    assert sorted(fetch.calls) == ["red", "spam"]
+    assert all(result == {"spam": OTHER_GUILD, "red": ALLOWED_GUILD} for result in results)
+
+    # cached from here on, unknown invites included
+    assert await resolver.resolve("gone") is None
+    assert await resolver.resolve("gone") is None
+    assert await resolver.resolve("spam") == OTHER_GUILD
+    assert sorted(fetch.calls) == ["gone", "red", "spam"]
+
+
+@pytest.mark.asyncio
+async def test_failed_lookups_are_not_cached():
+    calls = []
+
+    async def failing_fetch(code):
+        calls.append(code)
+        raise discord.HTTPException(SimpleNamespace(status=500, reason="error"), "error")
+
+    resolver = InviteResolver(failing_fetch)
+    assert await resolver.resolve("red") is None
+    assert await resolver.resolve("red") is None
+    assert calls == ["red", "red"]
+
+
+@pytest.mark.asyncio
+async def test_verdicts_of_failed_lookups_are_not_memoized():
+    fetch = StubFetch()
+    failing = True
+
+    async def flaky_fetch(code):
+        if failing:
+            raise discord.HTTPException(SimpleNamespace(status=500, reason="error"), "error")
+        return await fetch(code)
+
+    rule = DiscordInviteRule(InMemoryConfig())
+    rule.resolver = InviteResolver(flaky_fetch)
+    snapshot = SimpleNamespace(
+        options=rule.compile_options({"allowed_guilds": [ALLOWED_GUILD]}, {})
+    )
+    cog = SimpleNamespace(metrics=Metrics(), verdict_memo=VerdictMemo())
+    pipeline = SimpleNamespace(guild_id=1, version=1)
+    message = SimpleNamespace(guild=SimpleNamespace(id=1), content="join discord.gg/red")
+
+    async def evaluate():
+        analysis = MessageAnalysis(message.content)
+        return await AutoMod._evaluate(cog, rule, snapshot, message, analysis, pipeline)
+
+    # unresolved invites are treated as not allowed, but only until they resolve
+    assert await evaluate() is True
+    failing = False
+    assert await evaluate() is False
+    assert await evaluate() is False
+    assert fetch.calls == ["red"]
+    assert cog.verdict_memo.hits == 1
+
+
+async def check(rule, content, allowed_links=(), allowed_guilds=()):
+    options = rule.compile_options(
+        {"allowed_links": list(allowed_links), "allowed_guilds": list(allowed_guilds)}, {}
+    )
+    snapshot = SimpleNamespace(options=options)
+    return await rule.is_offensive(None, snapshot, MessageAnalysis(content))
+
+
+@pytest.mark.parametrize(
+    "content, allowed_links, allowed_guilds, expected",
+    [
+        ("no invites", [], [], False),
+        ("join discord.gg/red", [], [], True),
+        ("join discord.gg/red?x=1", ["discord.gg/red"], [], False),
+        ("join <https://discord.gg/red>", ["discord.gg/red"], [], False),
+        ("join discord.gg/RedVanity", [], [ALLOWED_GUILD], False),
+        ("join discord.gg/red and discord.gg/spam", [], [ALLOWED_GUILD], True),
+        ("join discord.gg/gone", [], [ALLOWED_GUILD], True),
+    ],
+)
+@pytest.mark.asyncio
+async def test_is_offensive(content, allowed_links, allowed_guilds, expected):
+    rule = DiscordInviteRule(InMemoryConfig())
+    rule.resolver = InviteResolver(StubFetch())
+    assert await check(rule, content, allowed_links, allowed_guilds) == expected
+
+
+@pytest.mark.asyncio
+async def test_allowed_codes_skip_resolution():
+    fetch = StubFetch()
+    rule = DiscordInviteRule(InMemoryConfig())
+    rule.resolver = InviteResolver(fetch)
+    assert await check(rule, "discord.gg/spam", ["discord.gg/spam"], [ALLOWED_GUILD]) is False
+    assert fetch.calls == []
+
+
+@pytest.mark.asyncio
+async def test_add_and_delete_allowed_links_and_guilds():
+    rule = DiscordInviteRule(InMemoryConfig())
+    guild = FakeGuild()
+
+    await rule.add_allowed_link(guild, "discord.gg/red")
+    with pytest.raises(ValueError):
+        await rule.add_allowed_link(guild, "https://example.com")
+    await rule.delete_allowed_link(guild, "discord.gg/red")
+    assert await rule.get_allowed_links(guild) == []
+
+    await rule.add_allowed_guild(guild, ALLOWED_GUILD)
+    with pytest.raises(ValueError):
+        await rule.add_allowed_guild(guild, ALLOWED_GUILD)
+    assert await rule.get_allowed_guilds(guild) == [ALLOWED_GUILD]
+    await rule.remove_allowed_guild(guild, ALLOWED_GUILD)
+    assert await rule.get_allowed_guilds(guild) == []
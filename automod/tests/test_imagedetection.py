@@ -0,0 +1,150 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ..analysis import MessageAnalysis
+from ..constants import MAX_IMAGE_SIZE
+from ..rules.imagedetection import (
+    ImageDetectionRule,
+    ImageVerdictCache,
+    AZURE_KEY,
+    AZURE_ENDPOINT,
+)
+
+SNAPSHOT = SimpleNamespace(
+    options={AZURE_KEY: "key", AZURE_ENDPOINT: "https://bread.cognitiveservices.azure.com"}
+)
+
+
+def azure_response(is_adult: bool) -> dict:
+    return {
+        "adult": {"isAdultContent": is_adult, "isRacyContent": False, "isGoryContent": False},
+        "description": {"captions": [{"text": "a loaf of bread"}], "tags": ["bread"]},
+        "requestId": "not cached",
+    }
+
+
+def make_attachment(filename: str, content: bytes):
+    async def read():
+        return content
+
+    return SimpleNamespace(url=filename, filename=filename, size=len(content), read=read)
+
+
+def make_rule(responses: dict):
+    rule = ImageDetectionRule(None)
+    analyzed = []
+
+    async def analyze_image(image, subscription_key, url):
+        analyzed.append(image)
+        return responses[image]
+
+    rule.analyze_image = analyze_image
+    return rule, analyzed
+
+
+@pytest.mark.asyncio
+async def test_every_attachment_is_analyzed():
+    rule, analyzed = make_rule(
+        {b"a": azure_response(False), b"b": None, b"c": azure_response(True)}
+    )
+    attachments = [make_attachment(f"{name}.png", name.encode()) for name in "abc"]
+    message = SimpleNamespace(attachments=attachments)
+
+    infraction = await rule.is_offensive(message, SNAPSHOT, MessageAnalysis(""))
+    assert analyzed == [b"a", b"b", b"c"]
+    assert infraction.extra_fields[-1].value == "`c.png`"
+
+
+@pytest.mark.asyncio
+async def test_repeated_images_use_cached_verdict():
+    rule, analyzed = make_rule({b"raid": azure_response(True)})
+    first = SimpleNamespace(attachments=[make_attachment("raid.png", b"raid")])
+    renamed = SimpleNamespace(attachments=[make_attachment("other.png", b"raid")])
+
+    assert await rule.is_offensive(first, SNAPSHOT, MessageAnalysis(""))
+    assert await rule.is_offensive(first, SNAPSHOT, MessageAnalysis(""))
+    assert await rule.is_offensive(renamed, SNAPSHOT, MessageAnalysis(""))
+    assert analyzed == [b"raid"]
+
+    verdicts = rule.verdicts
+    assert verdicts.by_attachment.stats().hits == 1
+    assert verdicts.by_hash.stats().hits == 1
+    assert "requestId" not in verdicts.by_hash.peek(verdicts.content_hash(b"raid"))
+
+
+def test_verdicts_persist(tmp_path):
+    path = tmp_path / "verdicts.json"
+    attachment = make_attachment("raid.png", b"raid")
+    cache = ImageVerdictCache()
+    cache.load(path)
+    cache.set(attachment, cache.content_hash(b"raid"), azure_response(True))
+    cache.save()
+
+    loaded = ImageVerdictCache()
+    assert loaded.load(path) == 1
+    assert loaded.get_by_attachment(attachment)["adult"]["isAdultContent"]
+
+
+def test_clean_image_is_not_an_infraction():
+    rule = ImageDetectionRule(None)
+    attachment = SimpleNamespace(filename="a.png")
+    assert rule.get_infraction(azure_response(False), attachment) is None
+    assert "a loaf of bread" in rule.get_infraction(azure_response(True), attachment).message
+
+
+@pytest.mark.asyncio
+async def test_clean_verdicts_are_confirmed_by_content():
+    rule, analyzed = make_rule({b"safe": azure_response(False), b"nsfw": azure_response(True)})
+    clean = SimpleNamespace(attachments=[make_attachment("image.png", b"safe")])
+    # same filename and size, different content
+    swapped = SimpleNamespace(attachments=[make_attachment("image.png", b"nsfw")])
+
+    assert not await rule.is_offensive(clean, SNAPSHOT, MessageAnalysis(""))
+    assert rule.verdicts.get_by_attachment(clean.attachments[0]) is None
+    # a pre-key verdict that isn't used isn't a hit
+    assert rule.verdicts.by_attachment.stats().hits == 0
+    assert await rule.is_offensive(swapped, SNAPSHOT, MessageAnalysis(""))
+    assert analyzed == [b"safe", b"nsfw"]
+
+
+@pytest.mark.asyncio
+async def test_only_images_are_downloaded():
+    rule, analyzed = make_rule({"huge.png": azure_response(True)})
+    downloaded = []
+
+    async def read():
+        downloaded.append(True)
+        return b""
+
+    document = make_attachment("notes.txt", b"text")
+    huge = SimpleNamespace(url="huge.png", filename="huge.png", size=MAX_IMAGE_SIZE + 1, read=read)
+    message = SimpleNamespace(attachments=[document, huge])
+
+    assert await rule.is_offensive(message, SNAPSHOT, MessageAnalysis(""))
+    # the text file is skipped and the big image is analyzed from its url
+    assert analyzed == ["huge.png"]
+    assert not downloaded
+
+
+@pytest.mark.asyncio
+async def test_in_flight_requests_are_shared_per_credentials():
+    rule = ImageDetectionRule(None)
+    keys = []
+
+    async def analyze_image(image, subscription_key, url):
+        keys.append(subscription_key)
+        await asyncio.sleep(0.01)
+        return azure_response(False)
+
+    rule.analyze_image = analyze_image
+    other_guild = SimpleNamespace(options={**SNAPSHOT.options, AZURE_KEY: "other key"})
+    messages = [
+        (SimpleNamespace(attachments=[make_attachment("a.png", b"raid")]), snapshot)
+        for snapshot in (SNAPSHOT, SNAPSHOT, other_guild)
+    ]
+    await asyncio.gather(
+        *(rule.is_offensive(m, snapshot, MessageAnalysis("")) for m, snapshot in messages)
+    )
+    assert sorted(keys) == ["key", "other key"]
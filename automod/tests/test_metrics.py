@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ..analysis import MessageAnalysis
+from ..main import AutoMod
+from ..metrics import LatencyHistogram, Metrics
+
+
+def test_histogram_quantiles():
+    histogram = LatencyHistogram()
+    for _ in range(90):
+        histogram.observe(0.00002)  # 10µs - 50µs bucket
+    for _ in range(10):
+        histogram.observe(0.3)  # 100ms - 500ms bucket
+
+    assert histogram.count == 100
+    assert 0.00001 <= histogram.quantile(0.5) <= 0.00005
+    assert 0.1 <= histogram.quantile(0.99) <= 0.5
+    assert LatencyHistogram().quantile(0.5) == 0.0
+
+
+def test_record_evaluation_counts():
+    metrics = Metrics()
+    metrics.record_evaluation(1, "MaxCharsRule", 0.001, triggered=True)
+    metrics.record_evaluation(1, "MaxCharsRule", 0.001, triggered=False)
+    metrics.record_evaluation(1, "MaxCharsRule", 0.001, triggered=True, error=True)
+    metrics.record_evaluation(2, "MaxCharsRule", 0.001, triggered=False)
+
+    (rule,) = metrics.snapshot(guild_id=1)["rules"]
+    assert (rule["evaluations"], rule["triggers"], rule["errors"]) == (3, 1, 1)
+    assert len(metrics.snapshot()["rules"]) == 2
+
+
+def test_measure_action_records_failures():
+    metrics = Metrics()
+    with metrics.measure_action(1, "SpamRule", "kick") as outcome:
+        outcome.success = False
+    with pytest.raises(RuntimeError):
+        with metrics.measure_action(1, "SpamRule", "ban"):
+            raise RuntimeError
+    with metrics.measure_action(1, "SpamRule", "ban"):
+        pass
+
+    actions = {action["action"]: action for action in metrics.snapshot()["actions"]}
+    assert actions["kick"]["failures"] == 1
+    assert (actions["ban"]["successes"], actions["ban"]["failures"]) == (1, 1)
+
+
+def test_prometheus_export():
+    metrics = Metrics()
+    metrics.record_evaluation(1, "MaxCharsRule", 0.002, triggered=True)
+    metrics.record_action(1, "MaxCharsRule", "delete", 0.05, success=True)
+    text = metrics.to_prometheus()
+
+    assert 'automod_rule_evaluations_total{guild="1",rule="MaxCharsRule"} 1' in text
+    bucket = 'automod_rule_latency_seconds_bucket{guild="1",rule="MaxCharsRule",le="%s"}'
+    assert bucket % "0.001" + " 0" in text
+    assert bucket % "+Inf" + " 1" in text
+    assert (
+        'automod_actions_total{guild="1",rule="MaxCharsRule",action="delete",outcome="success"} 1'
+        in text
+    )
+    assert "# TYPE automod_action_latency_seconds histogram" in text
+
+
+@pytest.mark.asyncio
+async def test_failing_rule_is_counted_not_raised():
+    class BrokenRule:
+        rule_name = "BrokenRule"
+
+        async def is_offensive(self, message, snapshot, analysis):
+            raise ValueError
+
+    cog = SimpleNamespace(metrics=Metrics())
+    message = SimpleNamespace(guild=SimpleNamespace(id=1))
+    assert await AutoMod._evaluate(cog, BrokenRule(), None, message, MessageAnalysis("")) is None
+    (rule,) = cog.metrics.snapshot()["rules"]
+    assert rule["errors"] == 1
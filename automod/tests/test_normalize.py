@@ -0,0 +1,30 @@
+import pytest
+
+from ..normalize import CONFUSABLES, fold_text, normalize_text
+
+normalize_data = [
+    ("plain ASCII", "plain ascii"),
+    ("ＢＲＥＡＤ", "bread"),  # full width
+    ("\U0001d41b\U0001d42b\U0001d41e\U0001d41a\U0001d41d", "bread"),  # mathematical bold
+    ("ⓑⓡⓔⓐⓓ", "bread"),  # circled
+    ("br\u200bea\u200dd\ufeff", "bread"),  # zero width characters
+    ("br\u0435\u0430d", "bread"),  # cyrillic e and a
+    ("ΒΑD", "bad"),  # greek capitals
+    ("b\u0337r\u0337e\u0337a\u0337d\u0337", "bread"),  # stacked marks
+    ("Crème Straße", "creme strasse"),
+]
+
+
+@pytest.mark.parametrize("text, expected", normalize_data)
+def test_normalize_text(text, expected):
+    assert normalize_text(text) == expected
+
+
+def test_fold_text_keeps_case():
+    assert fold_text("discord.gg/A\u200bb\u0421d") == "discord.gg/AbCd"
+    text = "Nothing to fold"
+    assert fold_text(text) is text
+
+
+def test_confusables_map_to_ascii():
+    assert all(not key.isascii() and value.isascii() for key, value in CONFUSABLES.items())
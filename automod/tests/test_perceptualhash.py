@@ -0,0 +1,86 @@
+import random
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from ..benchmarks.fakes import FakeGuild, FakeMember, InMemoryConfig
+from ..cache import SettingsCache
+from ..hamming import MAX_DISTANCE, HammingIndex, hamming_distance
+from ..rules.perceptualhash import PerceptualHashRule, dhash, parse_hash, format_hash
+
+
+def make_image(size=(128, 96), fmt="PNG", seed=1) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("L", (16, 12))
+    image.putdata([rng.randrange(256) for _ in range(16 * 12)])
+    image = image.resize(size, Image.BILINEAR)
+    buffer = BytesIO()
+    image.convert("RGB").save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_dhash_survives_resize_and_reencode():
+    original = dhash(make_image())
+    resized = dhash(make_image(size=(256, 192), fmt="JPEG"))
+    different = dhash(make_image(seed=2))
+    assert hamming_distance(original, resized) <= 6
+    assert hamming_distance(original, different) > 6
+
+
+def test_index_finds_near_duplicates():
+    rng = random.Random(3)
+    hashes = [rng.getrandbits(64) for _ in range(5000)]
+    index = HammingIndex(hashes, max_distance=6)
+
+    target = hashes[1234]
+    near = target ^ 0b101001  # flip 3 bits
+    assert index.nearest(target) == (target, 0)
+    assert index.nearest(near) == (target, 3)
+    assert index.nearest(target ^ 0xFF) is None
+
+
+def test_index_matches_linear_scan():
+    rng = random.Random(4)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    index = HammingIndex(hashes, max_distance=4)
+    for _ in range(300):
+        query = rng.choice(hashes) ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+        best = min(hamming_distance(query, h) for h in hashes)
+        assert index.nearest(query)[1] == best
+
+
+def test_index_stays_selective_at_the_max_distance():
+    rng = random.Random(5)
+    hashes = [rng.getrandbits(64) for _ in range(20000)]
+    index = HammingIndex(hashes, max_distance=MAX_DISTANCE)
+    # chunks of a byte, a lookup compares against about 1/32 of the hashes
+    for _ in range(100):
+        assert len(index.candidates(rng.getrandbits(64))) < len(hashes) / 16
+    with pytest.raises(ValueError):
+        HammingIndex(hashes, max_distance=MAX_DISTANCE + 1)
+
+
+@pytest.mark.parametrize("value", ["xyz", "1" * 17, "-1"])
+def test_parse_hash_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_hash(value)
+
+
+def test_hash_round_trip():
+    assert parse_hash(format_hash(0xDEADBEEF)) == 0xDEADBEEF
+
+
+@pytest.mark.asyncio
+async def test_getters_use_settings_cache():
+    config, guild = InMemoryConfig(), FakeGuild()
+    rule = PerceptualHashRule(config)
+    rule.settings_cache = SettingsCache(config)
+    await rule.add_banned_hashes(guild, [1, 2], FakeMember())
+    await rule.set_max_distance(guild, 4)
+
+    reads = config.reads
+    for _ in range(3):
+        assert len(await rule.get_banned_hashes(guild)) == 2
+        assert await rule.get_max_distance(guild) == 4
+    assert config.reads == reads + 1
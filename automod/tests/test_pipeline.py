@@ -0,0 +1,328 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ..analysis import MessageAnalysis
+from ..cache import VerdictMemo
+from ..main import AutoMod
+from ..metrics import Metrics
+from ..pipeline import PipelineCache
+from ..rules.imagedetection import ImageDetectionRule
+from ..rules.maxchars import MaxCharsRule
+from ..rules.mentionspam import MentionSpamRule
+from ..rules.spamrule import SpamRule
+from ..rules.wordfilter import WordFilterRule
+
+GUILD = SimpleNamespace(id=1)
+
+
+class FakeGroup:
+    def __init__(self, data):
+        self.data = data
+
+    async def all(self):
+        return self.data
+
+
+class FakeConfig:
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    def guild(self, guild):
+        self.reads += 1
+        return FakeGroup(self.data)
+
+
+def make_cache(data):
+    config = FakeConfig(data)
+    rules_map = {"maxcharsrule": MaxCharsRule(config), "mentionspamrule": MentionSpamRule(config)}
+    return PipelineCache(config, rules_map), config
+
+
+@pytest.mark.asyncio
+async def test_pipeline_is_compiled_once():
+    cache, config = make_cache(
+        {
+            "settings": {"mention_threshold": 2},
+            "MaxCharsRule": {"is_enabled": True, "max_chars": 10, "whitelist_roles": [5]},
+        }
+    )
+    pipeline = await cache.get(GUILD)
+    assert await cache.get(GUILD) is pipeline
+    assert config.reads == 1
+
+    assert [snapshot.rule_name for _, snapshot in pipeline.enabled_rules] == ["MaxCharsRule"]
+    assert pipeline.rules["MaxCharsRule"].options["max_chars"] == 10
+    assert pipeline.rules["MentionSpamRule"].options["mention_threshold"] == 2
+    assert pipeline.rules["MaxCharsRule"].role_is_whitelisted([4, 5])
+    assert pipeline.rules["MaxCharsRule"].is_enforced_channel(123)
+
+
+@pytest.mark.asyncio
+async def test_pipeline_invalidate_rebuilds():
+    cache, config = make_cache({"MaxCharsRule": {"is_enabled": True}})
+    pipeline = await cache.get(GUILD)
+
+    config.data["MaxCharsRule"]["enforced_channels"] = [42]
+    cache.invalidate(GUILD)
+    rebuilt = await cache.get(GUILD)
+
+    assert rebuilt is not pipeline
+    assert rebuilt.version > pipeline.version
+    assert not rebuilt.rules["MaxCharsRule"].is_enforced_channel(123)
+    assert rebuilt.rules["MaxCharsRule"].is_enforced_channel(42)
+
+
+ANNOUNCING = {"is_announcement_enabled": True, "announcement_channel": 8}
+NOT_ANNOUNCING = {"is_announcement_enabled": False, "announcement_channel": 8}
+
+
+@pytest.mark.parametrize(
+    "rule_settings, guild_settings, expected",
+    [
+        ({"rule_specific_announce": 7}, ANNOUNCING, 7),
+        ({}, ANNOUNCING, 8),
+        ({}, NOT_ANNOUNCING, None),
+    ],
+)
+def test_announce_channel_resolution(rule_settings, guild_settings, expected):
+    cache, _ = make_cache({})
+    data = {"settings": guild_settings, "MaxCharsRule": rule_settings}
+    pipeline = cache.compile(GUILD.id, 0, data)
+    assert pipeline.get_announce_channel_id(pipeline.rules["MaxCharsRule"]) == expected
+
+
+EXEMPTIONS = {
+    "enforced_channels": [10, 11],
+    "whitelist_roles": [5],
+    "whitelist_users": [99],
+    "whitelist_channels": [11],
+}
+
+
+@pytest.mark.parametrize(
+    "author_id, role_ids, channel_id, expected",
+    [
+        (1, [4], 10, False),
+        (1, [4, 5], 10, True),  # whitelisted role
+        (99, [], 10, True),  # whitelisted user
+        (1, [], 11, True),  # whitelisted channel
+        (1, [], 12, True),  # not an enforced channel
+    ],
+)
+def test_rule_exemptions(author_id, role_ids, channel_id, expected):
+    cache, _ = make_cache({})
+    pipeline = cache.compile(GUILD.id, 0, {"MaxCharsRule": EXEMPTIONS})
+    assert pipeline.rules["MaxCharsRule"].is_exempt(author_id, role_ids, channel_id) is expected
+
+
+@pytest.mark.asyncio
+async def test_exempt_rule_does_not_skip_later_rules():
+    cache, _ = make_cache(
+        {
+            "MaxCharsRule": {"is_enabled": True, "whitelist_roles": [5]},
+            "MentionSpamRule": {"is_enabled": True},
+        }
+    )
+    checked = []
+
+    async def _handle_verdict(pipeline, rule, message, is_offensive):
+        checked.append(rule.rule_name)
+        return False
+
+    async def is_automod_immune(author):
+        return False
+
+    cog = SimpleNamespace(
+        bot=SimpleNamespace(is_automod_immune=is_automod_immune),
+        pipeline_cache=cache,
+        metrics=Metrics(),
+        verdict_memo=VerdictMemo(),
+        _handle_verdict=_handle_verdict,
+    )
+    cog._evaluate = lambda *args: AutoMod._evaluate(cog, *args)
+    cog._evaluate_for = lambda *args: AutoMod._evaluate_for(cog, *args)
+    author = SimpleNamespace(id=1, bot=False, mention="<@1>", roles=[SimpleNamespace(id=5)])
+    message = SimpleNamespace(
+        guild=GUILD, author=author, channel=SimpleNamespace(id=3), mentions=[], content="hi"
+    )
+    await AutoMod._listen_for_infractions(cog, message)
+
+    assert checked == ["MentionSpamRule"]
+
+
+def test_enabled_rules_order():
+    config = FakeConfig({})
+    rules_map = {
+        "imagedetectionrule": ImageDetectionRule(config),
+        "maxcharsrule": MaxCharsRule(config),
+        "mentionspamrule": MentionSpamRule(config),
+    }
+    cache = PipelineCache(config, rules_map)
+    data = {
+        "ImageDetectionRule": {"is_enabled": True, "priority": -5},
+        "MaxCharsRule": {"is_enabled": True, "priority": 2},
+        "MentionSpamRule": {"is_enabled": True},
+    }
+    pipeline = cache.compile(GUILD.id, 0, data)
+    names = [snapshot.rule_name for _, snapshot in pipeline.enabled_rules]
+    # io bound rules always run last, whatever their priority
+    assert names == ["MentionSpamRule", "MaxCharsRule", "ImageDetectionRule"]
+
+
+@pytest.mark.asyncio
+async def test_terminating_verdict_cancels_outstanding_checks():
+    cancelled = []
+
+    class FastRule:
+        rule_name = "FastRule"
+
+        async def is_offensive(self, message, snapshot, analysis):
+            return True
+
+    class SlowRule:
+        rule_name = "SlowRule"
+
+        async def is_offensive(self, message, snapshot, analysis):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(self.rule_name)
+                raise
+
+    acted = []
+
+    async def _handle_verdict(pipeline, rule, message, is_offensive):
+        acted.append(rule.rule_name)
+        return True
+
+    cog = SimpleNamespace(_handle_verdict=_handle_verdict, metrics=Metrics())
+    cog._evaluate = lambda *args: AutoMod._evaluate(cog, *args)
+    cog._evaluate_for = lambda *args: AutoMod._evaluate_for(cog, *args)
+    rules = [(SlowRule(), None), (FastRule(), None)]
+    message = SimpleNamespace(guild=GUILD)
+    await AutoMod._evaluate_concurrently(cog, None, message, MessageAnalysis(""), rules)
+    await asyncio.sleep(0)
+
+    assert acted == ["FastRule"]
+    assert cancelled == ["SlowRule"]
+    # cancelled checks are not counted
+    assert [name for _, name, _ in cog.metrics.rule_rows()] == ["FastRule"]
+
+
+@pytest.mark.asyncio
+async def test_stateless_verdicts_are_memoized_until_settings_change():
+    cache, _ = make_cache({"MaxCharsRule": {"is_enabled": True, "max_chars": 5}})
+    rule = cache.rules_map["maxcharsrule"]
+    calls = []
+    is_offensive = rule.is_offensive
+
+    async def counting_is_offensive(message, snapshot, analysis):
+        calls.append(message.content)
+        return await is_offensive(message, snapshot, analysis)
+
+    rule.is_offensive = counting_is_offensive
+    cog = SimpleNamespace(metrics=Metrics(), verdict_memo=VerdictMemo())
+    author = SimpleNamespace(id=1, mention="<@1>")
+    message = SimpleNamespace(guild=GUILD, author=author, content="too long")
+
+    async def evaluate():
+        pipeline = await cache.get(GUILD)
+        snapshot = pipeline.rules["MaxCharsRule"]
+        analysis = MessageAnalysis(message.content)
+        return await AutoMod._evaluate(cog, rule, snapshot, message, analysis, pipeline)
+
+    assert [await evaluate() for _ in range(3)] == [True] * 3
+    assert calls == ["too long"]
+    (_, _, metrics), = cog.metrics.rule_rows()
+    # memoized verdicts still count as evaluations
+    assert (metrics.evaluations, metrics.triggers) == (3, 3)
+
+    cache.invalidate(GUILD)
+    await evaluate()
+    assert len(calls) == 2
+
+
+def make_edit_cog(data):
+    config = FakeConfig(data)
+    rules_map = {
+        "wordfilterrule": WordFilterRule(config),
+        "maxcharsrule": MaxCharsRule(config),
+        "spamrule": SpamRule(config, None, None),
+    }
+    seen = {}
+    for rule in rules_map.values():
+
+        async def is_offensive(message, snapshot, analysis, rule_name=rule.rule_name):
+            seen[rule_name] = analysis.content
+            return False
+
+        rule.is_offensive = is_offensive
+
+    async def _handle_verdict(pipeline, rule, message, is_offensive):
+        return False
+
+    async def is_automod_immune(author):
+        return False
+
+    cog = SimpleNamespace(
+        bot=SimpleNamespace(is_automod_immune=is_automod_immune),
+        pipeline_cache=PipelineCache(config, rules_map),
+        metrics=Metrics(),
+        verdict_memo=VerdictMemo(),
+        edit_debounce=0,
+        _pending_edits={},
+        _edit_tasks={},
+        _handle_verdict=_handle_verdict,
+    )
+    cog._evaluate = lambda *args: AutoMod._evaluate(cog, *args)
+    cog._evaluate_for = lambda *args: AutoMod._evaluate_for(cog, *args)
+    cog._listen_for_infractions = lambda *args, **kwargs: AutoMod._listen_for_infractions(
+        cog, *args, **kwargs
+    )
+    cog._check_edit_later = lambda *args: AutoMod._check_edit_later(cog, *args)
+    return cog, seen
+
+
+def edited(content, message_id=7):
+    author = SimpleNamespace(id=1, bot=False, mention="<@1>", roles=[])
+    return SimpleNamespace(
+        id=message_id, guild=GUILD, author=author, channel=SimpleNamespace(id=3), content=content
+    )
+
+
+@pytest.mark.asyncio
+async def test_edits_only_rerun_content_rules_on_what_changed():
+    cog, seen = make_edit_cog(
+        {
+            "WordFilterRule": {"is_enabled": True},
+            "MaxCharsRule": {"is_enabled": True},
+            "SpamRule": {"is_enabled": True},
+        }
+    )
+    before = edited("I like to bake things and eat them")
+    await AutoMod.on_message_edit(cog, before, edited("I like to bake bread and eat them"))
+    # edits arriving while it settles are coalesced, only the latest is checked
+    await AutoMod.on_message_edit(cog, before, edited("I like to bake rye bread and eat them"))
+    await asyncio.gather(*cog._edit_tasks.values())
+
+    assert seen == {
+        "WordFilterRule": "bake rye bread and",
+        "MaxCharsRule": "I like to bake rye bread and eat them",
+    }
+    assert not cog._pending_edits and not cog._edit_tasks
+
+
+@pytest.mark.asyncio
+async def test_edits_that_keep_the_content_are_skipped():
+    cog, seen = make_edit_cog({"WordFilterRule": {"is_enabled": True}})
+    await AutoMod.on_message_edit(cog, edited("hi"), edited("hi"))
+    assert not cog._edit_tasks
+
+    # typo fixed and reverted before it settled
+    await AutoMod.on_message_edit(cog, edited("hi"), edited("hu"))
+    await AutoMod.on_message_edit(cog, edited("hu"), edited("hi"))
+    await asyncio.gather(*cog._edit_tasks.values())
+    assert seen == {}
@@ -0,0 +1,70 @@
+from ..ratelimit import SlidingWindowCounter, SlidingWindowStore
+
+
+def test_rate_limited_after_rate_hits():
+    store = SlidingWindowStore(rate=3, per=10.0)
+    assert [store.hit("a", t) for t in (0, 1, 2, 3)] == [False, False, False, True]
+    # other keys have their own bucket
+    assert store.hit("b", 3) is False
+
+
+def test_window_slides():
+    store = SlidingWindowStore(rate=2, per=10.0)
+    assert not store.hit("a", 0)
+    assert not store.hit("a", 5)
+    assert store.hit("a", 9)
+    # the hit at 0 has left the window
+    assert not store.hit("a", 10.5)
+
+
+def test_idle_buckets_expire():
+    store = SlidingWindowStore(rate=2, per=10.0)
+    store.hit("a", 0)
+    store.hit("b", 5)
+    store.hit("c", 12)
+    assert "a" not in store
+    assert "b" in store
+    assert store.expired == 1
+
+
+def test_max_buckets_evicts_least_recently_used():
+    store = SlidingWindowStore(rate=2, per=100.0, max_buckets=2)
+    store.hit("a", 0)
+    store.hit("b", 1)
+    store.hit("a", 2)
+    store.hit("c", 3)
+    assert len(store) == 2
+    assert "b" not in store
+    assert store.stats().evicted == 1
+    assert store.stats().bytes_used > 0
+
+
+def test_retry_after():
+    store = SlidingWindowStore(rate=2, per=10.0)
+    assert store.retry_after("a", 0) == 0
+    store.hit("a", 1)
+    store.hit("a", 4)
+    assert store.retry_after("a", 5) == 6
+    assert store.retry_after("a", 12) == 0
+
+
+def test_counter_counts_distinct_keys_in_window():
+    counter = SlidingWindowCounter(per=10.0)
+    assert [counter.hit(key, t) for key, t in (("a", 0), ("b", 1), ("a", 2))] == [1, 2, 2]
+    # "a" was seen again at 2, so only "b" leaves the window
+    assert counter.hit("c", 11.5) == 2
+    assert counter.count(12.5) == 1
+
+
+def test_counter_ignores_hits_older_than_the_window():
+    counter = SlidingWindowCounter(per=10.0)
+    counter.hit("a", 100)
+    # replayed from the start, outside the window of the latest hit
+    assert [counter.hit(key, t) for key, t in (("b", 0), ("c", 95))] == [1, 2]
+
+
+def test_counter_is_bounded():
+    counter = SlidingWindowCounter(per=10.0, max_keys=2)
+    for t, key in enumerate("abc"):
+        counter.hit(key, t)
+    assert len(counter) == 2
@@ -0,0 +1,150 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from ..analysis import MessageAnalysis
+from ..benchmarks.fakes import FakeGuild, FakeMember, InMemoryConfig
+from ..rules.regexfilter import (
+    CompiledRegexFilter,
+    RegexRule,
+    RegexWorker,
+    compile_regex_filter,
+    regex_key,
+    validate_pattern,
+)
+
+scoped_patterns = [
+    {"pattern": r"fr[e3]{2}\s+nitro", "ignore_case": True, "channel": []},
+    {"pattern": r"\bbuy\b", "ignore_case": False, "channel": [1]},
+]
+
+channel_scoping_data = [
+    ("get FREE nitro here", 2, r"fr[e3]{2}\s+nitro", "FREE nitro"),
+    ("get fr33   nitro", 1, r"fr[e3]{2}\s+nitro", "fr33   nitro"),
+    ("buy now", 2, None, None),
+    ("buy now", 1, r"\bbuy\b", "buy"),
+    ("BUY now", 1, None, None),
+    ("nobuyers", 1, None, None),
+]
+
+
+@pytest.mark.parametrize("content, channel_id, pattern, matched", channel_scoping_data)
+@pytest.mark.asyncio
+async def test_channel_scoped_patterns(content, channel_id, pattern, matched):
+    rule = RegexRule(InMemoryConfig())
+    message = SimpleNamespace(content=content, channel=SimpleNamespace(id=channel_id))
+    snapshot = SimpleNamespace(
+        options={"filter": compile_regex_filter(regex_key(scoped_patterns))}
+    )
+    result = await rule.is_offensive(message, snapshot, MessageAnalysis(content))
+    if pattern is None:
+        assert result is False
+    else:
+        assert [field.value for field in result.extra_fields] == [f"`{pattern}`", f"`{matched}`"]
+
+
+unsafe_patterns = [
+    "",
+    "a" * 301,
+    "(unclosed",
+    "(?P<name>a)",
+    r"(a)\1",
+    "(a+)+b",
+    "(a*)*b",
+    "(?:x|y+)*z",
+    "a?",
+    "(?i)global flag",
+    # overlapping alternatives in a repeat
+    "(a|a)*b",
+    "(a|aa)*c",
+    r"(\w|\d)+x",
+    # overlapping repeats next to each other
+    ".*.*.*.*.*x",
+    r"\w+\s*\w+",
+    r"(\w+)\d+x",
+    # bounded repeats nest too
+    "(a{1,100}){1,100}b",
+    "(?:(?:a{0,50}){0,50}){0,50}b",
+    "(?:a?){25}a{25}",
+    "a{2,50}(b{1,3})+",
+    # more than one wildcard
+    ".*x.*x.*x.*x.*y",
+    ".{0,100}x.{0,100}x.{0,100}y",
+    r"\S+@\S+",
+]
+
+
+@pytest.mark.parametrize("pattern", unsafe_patterns)
+def test_unsafe_patterns_rejected(pattern):
+    with pytest.raises(ValueError):
+        validate_pattern(pattern)
+
+
+safe_patterns = [
+    r"\d{3}-\d{4}",
+    "(ab)+c",
+    r"a{2,50}(\d{3}-)+",
+    "(?i:spam)",
+    "(cat|dog)+",
+    "(ab|a)+",
+    r"\s+\w+",
+    r"\d+(\.\d+)?",
+    r"https?://\S+",
+]
+
+
+@pytest.mark.parametrize("pattern", safe_patterns)
+def test_safe_patterns_accepted(pattern):
+    validate_pattern(pattern)
+
+
+@pytest.mark.asyncio
+async def test_worker_stops_slow_searches():
+    worker = RegexWorker(timeout=0.5)
+    # not something validate_pattern lets through, built by hand to take exponential time
+    slow = CompiledRegexFilter(
+        patterns=("(a+)+b",), pattern=re.compile("(?P<p0>(?:(a+)+b))"), channels={}, groups={}
+    )
+    compiled = compile_regex_filter(regex_key(scoped_patterns))
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            await worker.search(slow, "a" * 40, 1)
+        # a new process is started for the next search
+        assert await worker.search(compiled, "get fr33 nitro", 1) == (
+            r"fr[e3]{2}\s+nitro",
+            "fr33 nitro",
+        )
+        assert await worker.search(compiled, "nothing", 1) is None
+    finally:
+        worker.close()
+
+
+def test_compile_cache_and_invalid_stored_patterns():
+    key = regex_key(scoped_patterns + [{"pattern": "(a+)+", "channel": []}])
+    compiled = compile_regex_filter(key)
+    assert compile_regex_filter(key) is compiled
+    # the unsafe pattern is skipped, not compiled into the alternation
+    assert len(compiled.patterns) == 2
+    assert not compile_regex_filter(())
+
+
+@pytest.mark.asyncio
+async def test_add_and_remove_patterns():
+    config = InMemoryConfig()
+    rule = RegexRule(config)
+    guild = FakeGuild()
+    author = FakeMember()
+
+    await rule.add_pattern(guild, "spam+", author)
+    with pytest.raises(ValueError):
+        await rule.add_pattern(guild, "spam+", author)
+    with pytest.raises(ValueError):
+        await rule.add_pattern(guild, "(x+)+", author)
+    assert [pattern["pattern"] for pattern in await rule.get_patterns(guild)] == ["spam+"]
+
+    await rule.remove_pattern(guild, "spam+")
+    assert await rule.get_patterns(guild) == []
+    with pytest.raises(ValueError):
+        await rule.remove_pattern(guild, "spam+")
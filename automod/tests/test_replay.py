@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from ..benchmarks.replay import ReplayGuild, compare_profiles, record_to_message, replay
+
+LOG = [
+    {"content": "hi", "author_id": 1, "role_ids": [5], "channel_id": 10, "created_at": 0},
+    {"content": "one two three four five six", "author_id": 2, "channel_id": 10},
+    {
+        "content": "file",
+        "author_id": 2,
+        "channel_id": 11,
+        "attachments": [{"filename": "a.exe", "size": 3}],
+        "created_at": "2020-01-01T12:00:00Z",
+    },
+]
+
+
+def log_lines():
+    return [json.dumps(record) for record in LOG] + [""]
+
+
+def test_records_become_messages():
+    guild = ReplayGuild()
+    first, _, third = [record_to_message(record, guild) for record in LOG]
+    assert [role.id for role in first.author.roles] == [5]
+    assert first.channel is guild.get_channel(10)
+    assert third.attachments[0].filename == "a.exe"
+    assert third.created_at.hour == 12 and third.created_at.tzinfo is None
+
+
+@pytest.mark.asyncio
+async def test_profiles_are_compared_over_the_same_log():
+    strict = await replay(
+        log_lines(), {"maxwordsrule": {"is_enabled": True, "max_words": 5, "delete_message": True}}
+    )
+    relaxed = await replay(log_lines(), {"maxwordsrule": {"is_enabled": True, "max_words": 50}})
+
+    assert strict["messages"] == 3
+    assert strict["rules"]["MaxWordsRule"]["evaluations"] == 3
+    assert strict["rules"]["MaxWordsRule"]["triggers"] == 1
+    # deletes go to the dry run backend
+    assert strict["actions"] == {"delete": 1}
+    assert compare_profiles(strict, relaxed) == {
+        "MaxWordsRule": {"before": 1, "after": 0, "change": -1}
+    }
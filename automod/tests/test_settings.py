@@ -0,0 +1,131 @@
+import pytest
+
+from ..benchmarks.fakes import FakeGuild, FakeMember, FakeRole, InMemoryConfig
+from ..cache import SettingsCache
+from ..pipeline import PipelineCache
+from ..rules.imagedetection import ImageDetectionRule
+from ..rules.maxwords import MaxWordsRule
+from ..rules.perceptualhash import PerceptualHashRule
+from ..rules.regexfilter import RegexRule
+from ..rules.spamrule import SpamRule
+from ..rules.wallspam import WallSpamRule
+from ..rules.wordfilter import WordFilterRule
+from ..settings import EXPORT_FORMAT, Settings
+
+
+def make_settings():
+    config = InMemoryConfig()
+    rules_map = {
+        "maxwordsrule": MaxWordsRule(config),
+        "wordfilterrule": WordFilterRule(config),
+        "imagedetectionrule": ImageDetectionRule(config),
+        "regexrule": RegexRule(config),
+        "wallspamrule": WallSpamRule(config),
+        "spamrule": SpamRule(config, None, None),
+        "perceptualhashrule": PerceptualHashRule(config),
+    }
+    pipeline_cache = PipelineCache(config, rules_map)
+    settings_cache = SettingsCache(config)
+    for rule in rules_map.values():
+        rule.pipeline_cache = pipeline_cache
+        rule.settings_cache = settings_cache
+    return Settings(
+        config=config,
+        rules_map=rules_map,
+        pipeline_cache=pipeline_cache,
+        settings_cache=settings_cache,
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_then_import_into_another_guild():
+    settings = make_settings()
+    source, target = FakeGuild(), FakeGuild()
+    wordfilter = settings.rules_map["wordfilterrule"]
+    await wordfilter.toggle_enabled(source, True)
+    await wordfilter.add_many_to_filter(source, ["bread", "cake"], FakeMember())
+    # cached before the import, so the import has to invalidate it
+    assert not (await settings.pipeline_cache.get(target)).enabled_rules
+
+    exported = await settings.export_settings(source)
+    assert exported["format"] == EXPORT_FORMAT
+    writes = settings.config.writes
+    imported = await settings.import_settings(target, exported)
+
+    assert settings.config.writes == writes + 1
+    assert "WordFilterRule" in imported
+    assert len(await wordfilter.get_filtered_words(target)) == 2
+    (rule, _), = (await settings.pipeline_cache.get(target)).enabled_rules
+    assert rule is wordfilter
+
+
+@pytest.mark.asyncio
+async def test_secret_settings_are_not_exported():
+    settings = make_settings()
+    guild = FakeGuild()
+    imagedetection = settings.rules_map["imagedetectionrule"]
+    await imagedetection.set_key(guild, "secret")
+    await imagedetection.set_endpoint(guild, "https://bread.cognitiveservices.azure.com")
+    await imagedetection.toggle_enabled(guild, True)
+
+    exported = await settings.export_settings(guild)
+    assert exported["data"]["ImageDetectionRule"] == {"is_enabled": True}
+    assert await imagedetection.get_key(guild) == "secret"
+
+
+@pytest.mark.asyncio
+async def test_import_keeps_existing_secrets():
+    settings = make_settings()
+    guild = FakeGuild()
+    imagedetection = settings.rules_map["imagedetectionrule"]
+    await imagedetection.set_key(guild, "secret")
+    exported = {"format": EXPORT_FORMAT, "data": {"ImageDetectionRule": {"is_enabled": True}}}
+
+    await settings.import_settings(guild, exported)
+    assert await imagedetection.get_key(guild) == "secret"
+    assert await imagedetection.is_enabled(guild)
+
+
+def rule_export(rule_name, rule_settings):
+    return {"format": EXPORT_FORMAT, "data": {rule_name: rule_settings}}
+
+
+@pytest.mark.parametrize(
+    "exported",
+    [
+        [],
+        {"format": EXPORT_FORMAT + 1, "data": {}},
+        {"format": EXPORT_FORMAT},
+        {"format": EXPORT_FORMAT, "data": {"NotARule": {}}},
+        {"format": EXPORT_FORMAT, "data": {"MaxWordsRule": []}},
+        rule_export("ImageDetectionRule", {"azure_endpoint": "http://169.254.169.254"}),
+        rule_export("ImageDetectionRule", {"azure_key": "stolen"}),
+        rule_export("MaxWordsRule", {"action_to_take": "explode"}),
+        rule_export("RegexRule", {"patterns": [{"pattern": "(a+)+b"}]}),
+        rule_export("RegexRule", {"patterns": [{"pattern": f"w{i}"} for i in range(51)]}),
+        rule_export("WallSpamRule", {"long_word_threshold": 0}),
+        rule_export("WallSpamRule", {"repetition_ratio": "high"}),
+        rule_export("SpamRule", {"joins": [10 ** 9, 10]}),
+        rule_export("SpamRule", {"joins": [10, 0]}),
+        rule_export("PerceptualHashRule", {"max_distance": 64}),
+        rule_export("PerceptualHashRule", {"banned_hashes": [{"hash": "not hex"}]}),
+    ],
+)
+@pytest.mark.asyncio
+async def test_invalid_imports_write_nothing(exported):
+    settings = make_settings()
+    with pytest.raises(ValueError):
+        await settings.import_settings(FakeGuild(), exported)
+    assert settings.config.writes == 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_whitelist_roles():
+    settings = make_settings()
+    guild, rule = FakeGuild(), settings.rules_map["maxwordsrule"]
+    roles = [FakeRole() for _ in range(3)]
+    await rule.append_whitelist_role(guild, roles[0])
+
+    assert await rule.append_whitelist_roles(guild, roles) == [roles[1].id, roles[2].id]
+    assert await rule.remove_whitelist_roles(guild, roles[:2]) == [roles[0].id, roles[1].id]
+    assert await rule.get_all_whitelisted_roles(guild) == [roles[2].id]
@@ -0,0 +1,157 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+
+from ..analysis import MessageAnalysis
+from ..benchmarks.fakes import FakeBot, FakeChannel, FakeGuild, FakeMember, FakeMessage
+from ..benchmarks.fakes import InMemoryConfig
+from ..pipeline import compile_rule_snapshot
+from ..rules.config.models import InfractionInformation
+from ..rules.spamrule import (
+    MAX_OFFENDERS,
+    MAX_RAID_COUNT,
+    RAID_JOIN_RATE,
+    RaidDetector,
+    RaidRates,
+    RaidState,
+    SpamRule,
+)
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def setup():
+    announce_channel, channel = FakeChannel(name="mod-log"), FakeChannel(name="general")
+    guild = FakeGuild(channels=[announce_channel, channel])
+    rule = SpamRule(InMemoryConfig(), FakeBot(), None)
+    snapshot = compile_rule_snapshot(
+        rule, {"is_enabled": True}, {"announcement_channel": announce_channel.id}
+    )
+    return rule, snapshot, guild, announce_channel, channel
+
+
+async def send(rule, snapshot, message):
+    return await rule.is_offensive(message, snapshot, MessageAnalysis(message.content))
+
+
+def test_raid_starts_on_joins_and_ends_after_cooldown():
+    detector = RaidDetector(cooldown=30)
+    started = [detector.record_join(member_id, member_id * 0.1) for member_id in range(10)]
+    assert started == [False] * (RAID_JOIN_RATE[0] - 1) + [True]
+    assert detector.is_raid
+    # still being raided, so this doesn't start it again but pushes the end back
+    assert not detector.record_join(99, 5)
+    assert not detector.should_end(30)
+    assert detector.should_end(35)
+    assert detector.end() is not None
+    assert not detector.is_raid
+
+
+def test_raid_starts_on_distinct_authors():
+    detector = RaidDetector()
+    started = [detector.record_message(i, i, i * 0.1) for i in range(20)]
+    assert started[-1] and not any(started[:-1])
+    assert "people talking" in detector.raid.reason
+
+
+@pytest.mark.asyncio
+async def test_raid_thresholds_are_set_per_guild():
+    rule, _, guild, _, channel = setup()
+    await rule.set_raid_threshold(guild, "authors", 3, 5)
+    assert await rule.get_raid_thresholds(guild) == RaidRates(authors=(3, 5))
+    invalid = [
+        ("bots", 3, 5),
+        ("authors", 1, 5),
+        ("authors", MAX_RAID_COUNT + 1, 5),
+        ("authors", 3, 0),
+    ]
+    for name, count, per in invalid:
+        with pytest.raises(ValueError):
+            await rule.set_raid_threshold(guild, name, count, per)
+
+    rule_settings = rule.config.guilds[guild.id]["SpamRule"]
+    snapshot = compile_rule_snapshot(rule, {"is_enabled": True, **rule_settings}, {})
+    for i in range(3):
+        message = FakeMessage(
+            "hi", FakeMember(), channel, guild, created_at=START + datetime.timedelta(0, i)
+        )
+        await send(rule, snapshot, message)
+    assert rule.get_raid(guild).reason == "3 people talking in 5s"
+
+    await rule.reset_raid_threshold(guild, "authors")
+    assert await rule.get_raid_thresholds(guild) == RaidRates()
+
+
+def test_changing_a_window_restarts_its_counter():
+    detector = RaidDetector()
+    detector.record_join(1, 0)
+    detector.record_message(1, 1, 0)
+    detector.set_rates(RaidRates(joins=(10, 30.0), messages=(30, 10.0)))
+    assert len(detector.joins) == 0
+    assert len(detector.messages) == len(detector.authors) == 1
+
+
+def test_raid_offenders_are_capped():
+    raid = RaidState(started_at=0, last_seen=0, reason="test")
+    for member_id in range(MAX_OFFENDERS + 10):
+        raid.add_offender(member_id)
+    assert len(raid.offenders) == MAX_OFFENDERS
+
+
+@pytest.mark.asyncio
+async def test_limits_are_stricter_during_a_raid():
+    rule, snapshot, guild, _, channel = setup()
+    spammer = FakeMember()
+    messages = [
+        FakeMessage(str(i), spammer, channel, guild, created_at=START + datetime.timedelta(0, i))
+        for i in range(7)
+    ]
+    # 6 messages in 12 seconds is fine normally
+    assert [await send(rule, snapshot, m) for m in messages[:6]] == [False] * 6
+
+    rule._raids[guild.id]._reached("test", time.time())
+    verdict = await send(rule, snapshot, messages[6])
+    assert isinstance(verdict, InfractionInformation)
+    assert verdict.extra_fields[0].name == "Raid mode"
+    assert rule.offenders[guild.id] == {spammer.id}
+
+
+@pytest.mark.asyncio
+async def test_raid_is_announced_and_offenders_exported():
+    rule, snapshot, guild, announce_channel, channel = setup()
+    rule.raid_check_interval = 0
+    detector = rule._raids[guild.id]
+    detector.cooldown = 0
+
+    for i in range(RAID_JOIN_RATE[0]):
+        member = FakeMember()
+        member.guild = guild
+        member.joined_at = START + datetime.timedelta(seconds=i * 0.1)
+        rule.record_join(member, snapshot)
+    assert detector.is_raid
+    detector.raid.offenders.add(1234)
+    # caught before the raid
+    rule.offenders[guild.id].update({1234, 5678})
+
+    await rule._raid_watchers[guild.id]
+    assert not detector.is_raid
+    assert rule.bot.dispatched == ["automod_raid", "automod_raid"]
+    (enabled, _), (ended, kwargs) = announce_channel.sent
+    assert "Raid mode enabled" in enabled
+    assert "`1` members" in ended
+    exported = kwargs["file"].fp.read()
+    assert b"1234" in exported and b"5678" not in exported
+    assert rule.offenders[guild.id] == {1234, 5678}
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_raid_watchers():
+    rule, snapshot, guild, _, _ = setup()
+    rule._raids[guild.id]._reached("test", time.time())
+    rule._start_raid(guild, snapshot)
+    task = rule._raid_watchers[guild.id]
+    rule.close()
+    with pytest.raises(asyncio.CancelledError):
+        await task
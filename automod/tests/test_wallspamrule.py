@@ -1,7 +1,15 @@
 import pytest
 from redbot.core import Config
 
-from ..rules.wallspam import WallSpamRule
+from ..analysis import MessageAnalysis
+from ..benchmarks.fakes import FakeGuild, InMemoryConfig
+from ..rules.config.WallspamRuleConfig import WallspamRuleConfig
+from ..rules.wallspam import (
+    WallSpamRule,
+    WallTextDetector,
+    char_entropy,
+    longest_word_run,
+)
 
 first_character_repeating_data = [
     ("1" * 501, True),
@@ -29,3 +37,57 @@ async def test_wallspam_first_character_repeating(message_content, expected):
 @pytest.mark.asyncio
 async def test_is_wall_text(message_content, expected):
     assert await WallSpamRule.is_wall_text(message_content) == expected
+
+
+@pytest.mark.parametrize(
+    "message_content, expected", first_character_repeating_data + wall_text_data
+)
+def test_detector_defaults_match_old_checks(message_content, expected):
+    assert (WallTextDetector().check(MessageAnalysis(message_content)) is not None) == expected
+
+
+@pytest.mark.parametrize(
+    "detector, message_content, expected",
+    [
+        (WallTextDetector(emptyline_threshold=5), "start" + "\n" * 5 + "end", True),
+        (WallTextDetector(emptyline_threshold=5), "start" + "\n" * 4 + "end", False),
+        (WallTextDetector(repetition_ratio=0.5), " ".join(["a", "b", "c"] * 10), True),
+        (WallTextDetector(repetition_ratio=0.5), " ".join(str(i) for i in range(30)), False),
+        # too short for the ratio to count
+        (WallTextDetector(repetition_ratio=0.5), "a a a a", False),
+        (WallTextDetector(word_run=4), "hi spam spam spam spam bye", True),
+        (WallTextDetector(word_run=4), "hi spam spam spam bye spam", False),
+        (WallTextDetector(char_run=10), "hello " + "!" * 10, True),
+        (WallTextDetector(char_run=10), "hello " + "!" * 9, False),
+        (WallTextDetector(min_entropy=1.5), "ab " * 40, True),
+        (WallTextDetector(min_entropy=1.5), "the quick brown fox jumps over a lazy dog" * 3, False),
+        (WallTextDetector(), "", False),
+    ],
+)
+def test_detector_checks(detector, message_content, expected):
+    assert (detector.check(MessageAnalysis(message_content)) is not None) == expected
+
+
+def test_detector_reason():
+    reason = WallTextDetector(char_run=5).check(MessageAnalysis("aaaaaaa"))
+    assert reason == "`a` repeated 7 times in a row"
+
+
+def test_char_entropy():
+    assert char_entropy("aaaa") == 0
+    assert char_entropy("abcd") == 2
+
+
+def test_longest_word_run():
+    assert longest_word_run(["a", "b", "b", "a", "a", "a"]) == 3
+    assert longest_word_run([]) == 0
+
+
+@pytest.mark.asyncio
+async def test_count_thresholds_must_be_whole_numbers():
+    rule, guild = WallSpamRule(InMemoryConfig()), FakeGuild()
+    word_run, ratio = WallspamRuleConfig.word_run_threshold, WallspamRuleConfig.repetition_ratio
+    with pytest.raises(ValueError, match="whole number"):
+        await rule.set_wall_text_threshold(guild, word_run, 2.5)
+    assert await rule.set_wall_text_threshold(guild, word_run, 3.0) == 3
+    assert await rule.set_wall_text_threshold(guild, ratio, 0.5) == 0.5
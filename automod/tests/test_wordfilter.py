@@ -1,13 +1,25 @@
+from types import SimpleNamespace
+
 import pytest
 from redbot.core import Config
 
-from ..rules.wordfilter import WordFilterRule
+from ..analysis import MessageAnalysis
+from ..benchmarks.fakes import FakeGuild, FakeMember, InMemoryConfig
+from ..rules.wordfilter import WordFilterRule, compile_word_filter, filter_key
 
 word_filter_data = [
     ("Bakers do indeed bake bread", [{"word": "do", "is_cleaned": False}], True),
-    ("Bakers do indeed bake bread", [{"word": "DO", "is_cleaned": False}], False),
+    ("Bakers do indeed bake bread", [{"word": "DO", "is_cleaned": False}], True),
     ("Bake,rs do ind,eed b.ake br!ead", [{"word": "do", "is_cleaned": True}], True),
-    ("Bak;e;rs d,o inde.ed bake bread", [{"word": "DO", "is_cleaned": True}], False),
+    ("Bak;e;rs d,o inde.ed bake bread", [{"word": "DO", "is_cleaned": True}], True),
+    ("I B.R.E.A.D you", [{"word": "bread", "is_cleaned": True}], True),
+    ("I B.R.E.A.D you", [{"word": "bread", "is_cleaned": False}], False),
+    # full width, zero width space, cyrillic look-alikes, stacked accents
+    ("ｂｒｅａｄ", [{"word": "bread", "is_cleaned": False}], True),
+    ("br\u200bead", [{"word": "bread", "is_cleaned": False}], True),
+    ("br\u0435\u0430d", [{"word": "bread", "is_cleaned": False}], True),
+    ("b\u0337r\u0337e\u0337a\u0337d", [{"word": "bread", "is_cleaned": False}], True),
+    ("Crème brûlée", [{"word": "creme", "is_cleaned": False}], True),
 ]
 
 no_punctuation_data = [
@@ -33,3 +45,50 @@ def test_no_mentions():
 @pytest.mark.parametrize("sentence, expected", no_punctuation_data)
 def test_no_punctuation(sentence, expected):
     assert WordFilterRule.remove_punctuation(sentence) == expected
+
+
+scoped_words = [
+    {"word": "bread", "is_cleaned": False, "channel": []},
+    {"word": "bake", "is_cleaned": True, "channel": [1]},
+]
+
+channel_scoping_data = [
+    ("I like bread", 2, "bread"),
+    ("I b.a.k.e", 2, None),
+    ("I b.a.k.e", 1, "bake"),
+    ("I like br.ead", 1, None),
+]
+
+
+@pytest.mark.parametrize("sentence, channel_id, expected", channel_scoping_data)
+@pytest.mark.asyncio
+async def test_channel_scoped_filter(sentence, channel_id, expected):
+    wordfilterrule = WordFilterRule(Config)
+    compiled = compile_word_filter(filter_key(scoped_words))
+    message = SimpleNamespace(content=sentence, channel=SimpleNamespace(id=channel_id))
+    snapshot = SimpleNamespace(options={"filter": compiled})
+
+    infraction = await wordfilterrule.is_offensive(message, snapshot, MessageAnalysis(sentence))
+    if expected is None:
+        assert not infraction
+    else:
+        assert infraction.extra_fields[0].value == f"`{expected}`"
+
+
+@pytest.mark.asyncio
+async def test_bulk_add_and_remove_write_once():
+    config, guild, author = InMemoryConfig(), FakeGuild(), FakeMember()
+    wordfilterrule = WordFilterRule(config)
+    await wordfilterrule.add_to_filter(guild, "bread", author)
+
+    words = [f"word{i}" for i in range(500)] + ["BREAD", "word1"]
+    writes = config.writes
+    added = await wordfilterrule.add_many_to_filter(guild, words, author)
+    assert config.writes == writes + 1
+    # already filtered and repeated words are skipped
+    assert len(added) == 500 and "bread" not in added
+
+    removed = await wordfilterrule.remove_many_from_filter(guild, ["bread", "word0", "nope"])
+    assert removed == ["bread", "word0"]
+    assert len(await wordfilterrule.get_filtered_words(guild)) == 499
+    assert await wordfilterrule.remove_many_from_filter(guild, ["nope"]) == []
@@ -1,9 +1,13 @@
 import discord
 import aiohttp
 
+from os.path import splitext
+
 from redbot.core.utils.predicates import ReactionPredicate
 from redbot.core.utils.menus import start_adding_reactions
 
+from .constants import IMAGE_EXTENSIONS
+
 
 async def maybe_add_role(
     user: discord.Member, role: discord.Role,
@@ -106,6 +110,11 @@ def transform_bool_to_emoji(b):
     return "✅" if b else "❌"
 
 
+def is_image(attachment: discord.Attachment) -> bool:
+    """Whether an attachment's extension is one of `IMAGE_EXTENSIONS`"""
+    return splitext(attachment.filename.lower())[1] in IMAGE_EXTENSIONS
+
+
 async def send_to_paste(content: str, extension: str = None, url="http://utils.red") -> str:
     """
     Handy tool to send string content to a pastebin